@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+This module replays recorded PV generation and building load through the
+baseline battery policy with a simple battery model, and computes the
+energy and demand cost of the resulting net power.  Parameter sweeps of
+the policy run in parallel worker processes.
+
+The costs follow the price data of the mpc: 'pi_e' in $/kWh on the net
+power of each time step, and 'pi_d' in $/kW on the peak net power of each
+demand price period in each billing month.
+
+Usage::
+
+    python controller/baseline_backtest.py --data history.csv --price data/Price.csv --max_battery_soc 0.9 0.95 1.0
+
+"""
+
+from __future__ import division
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from baseline_policy import Baseline_Policy
+
+# Policy parameters that can be swept from the command line
+sweep_parameters = ['max_battery_rate', 'min_battery_rate', 'max_battery_soc', 'min_battery_soc',
+                    'night_charge_start', 'night_charge_end']
+
+# Backtest of a worker process
+_worker_backtest = None
+
+def _initialize_worker(data, price, config):
+    '''Build the backtest of a worker process.
+
+    '''
+
+    global _worker_backtest
+    _worker_backtest = Baseline_Backtest(data, price, config)
+
+def _run_parameters(parameters):
+    '''Run the backtest of one parameter set in a worker process.
+
+    '''
+
+    plan, kpis = _worker_backtest.run(parameters)
+
+    return kpis
+
+def get_cost(net_power, price, billing_period='MS'):
+    '''Get the energy and demand cost of a net power timeseries.
+
+    Parameters
+    ----------
+    net_power : Series
+        Net power drawn from the grid in W, negative for export.
+    price : DataFrame
+        'pi_e' in $/kWh and optionally 'pi_d' in $/kW, on the index of
+        net_power.
+    billing_period : str, optional
+        Frequency of the demand charge periods.
+        Default is 'MS', monthly.
+
+    Returns
+    -------
+    cost : dict
+        'energy_cost', 'demand_cost' and 'total_cost' in $, and the
+        'peak_power' in kW.
+
+    '''
+
+    dt = pd.Series(net_power.index).diff().dt.total_seconds().shift(-1)
+    dt = dt.fillna(dt.median() if len(dt) > 1 else 0).values / 3600
+    power = net_power.values / 1000
+    energy_cost = np.nansum(power * price['pi_e'].values * dt)
+    demand_cost = 0.
+    if 'pi_d' in price:
+        df = pd.DataFrame({'power': power, 'pi_d': np.round(price['pi_d'].values, 12)}, index=net_power.index)
+        peaks = df.groupby([pd.Grouper(freq=billing_period), 'pi_d'])['power'].max().clip(lower=0)
+        demand_cost = (peaks * peaks.index.get_level_values('pi_d')).sum()
+
+    return {'energy_cost': energy_cost,
+            'demand_cost': demand_cost,
+            'total_cost': energy_cost + demand_cost,
+            'peak_power': power.max() if len(power) > 0 else np.nan}
+
+class Baseline_Backtest(object):
+    '''Replay recorded data through the baseline battery policy.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Recorded 'pv_generation' and 'building_load' in W and
+        'battery_soc', with a UTC time index.  The first state of charge
+        is the initial state of the battery.
+    price : DataFrame
+        'pi_e' in $/kWh and optionally 'pi_d' in $/kW, with a UTC time
+        index.  It is held constant between its times.
+    config : dict
+        Baseline configuration, as returned by baseline_config.get_config().
+        'charge_efficiency' and 'discharge_efficiency' (default 0.95) set
+        the battery model.
+    freq : str, optional
+        Time step of the replay.
+        Default is '5T'.
+    '''
+
+    def __init__(self, data, price, config, freq='5T'):
+        '''Constructor.
+
+        '''
+        # Naive and aware indexes do not align, which would hold one price over all data
+        for name, df in [('data', data), ('price', price)]:
+            if getattr(df.index, 'tz', None) is None:
+                raise ValueError('The time index of the {0} must be time zone aware.'.format(name))
+        self.config = config
+        self.data = data[['pv_generation', 'building_load', 'battery_soc']].resample(freq).mean()
+        self.data = self.data.interpolate(method='time').dropna()
+        price = price.sort_index()
+        self.price = price.reindex(price.index.union(self.data.index)).fillna(method='ffill').reindex(self.data.index)
+        self.charge_efficiency = config.get('charge_efficiency', 0.95)
+        self.discharge_efficiency = config.get('discharge_efficiency', 0.95)
+        # Cost without battery, to compare the policies with
+        self.reference_cost = get_cost(self.data['building_load'] - self.data['pv_generation'], self.price)
+
+    def run(self, parameters=None):
+        '''Replay the data with one set of policy parameters.
+
+        Parameters
+        ----------
+        parameters : dict, optional
+            Arguments of Baseline_Policy replacing the ones of the
+            configuration, e.g. {'max_battery_soc': 0.9}.
+
+        Returns
+        -------
+        plan : DataFrame
+            Replay of the policy, see Baseline_Policy.simulate, with the
+            'net_power' in W.
+        kpis : dict
+            The parameters, the costs (see get_cost), the 'savings' in $
+            compared to no battery, the 'battery_throughput' in kWh and the
+            'time_below_min_soc' as fraction of the time.
+
+        '''
+
+        parameters = parameters or {}
+        config = dict(self.config)
+        config.update(parameters)
+        policy = Baseline_Policy.from_config(config)
+        plan = policy.simulate(self.data.index, self.data['pv_generation'].values, self.data['building_load'].values,
+                               self.data['battery_soc'].iloc[0], charge_efficiency=self.charge_efficiency,
+                               discharge_efficiency=self.discharge_efficiency)
+        plan['net_power'] = plan['net_load'] + plan['battery_power']
+        kpis = dict(parameters)
+        kpis.update(get_cost(plan['net_power'], self.price))
+        kpis['savings'] = self.reference_cost['total_cost'] - kpis['total_cost']
+        dt = np.append(np.diff(plan.index.asi8) / 1e9 / 3600, 0)
+        kpis['battery_throughput'] = np.sum(np.abs(plan['battery_power'].values) * dt) / 1000
+        kpis['time_below_min_soc'] = (plan['battery_soc'] < policy.min_battery_soc - 1e-6).mean()
+
+        return plan, kpis
+
+    def get_recorded_kpis(self):
+        '''Get the costs of the recorded operation, with the battery power estimated from the recorded state of charge.
+
+        Returns
+        -------
+        kpis : dict
+            Costs, see get_cost.
+
+        '''
+
+        capacity = self.config.get('battery_total_capacity', 40500)
+        dt = pd.Series(self.data.index).diff().dt.total_seconds().values / 3600
+        battery_power = np.append(np.diff(self.data['battery_soc'].values) * capacity / dt[1:], 0)
+
+        return get_cost(self.data['building_load'] - self.data['pv_generation'] + battery_power, self.price)
+
+    def sweep(self, grid, n_workers=None):
+        '''Replay the data for every combination of policy parameters in parallel.
+
+        Parameters
+        ----------
+        grid : dict or list
+            Values of each policy parameter, e.g.
+            {'max_battery_soc': [0.9, 0.95], 'night_charge_end': [5, 6]},
+            or a list of parameter dictionaries.
+        n_workers : int, optional
+            Number of worker processes.
+            Default is the number of CPUs.
+
+        Returns
+        -------
+        kpis : DataFrame
+            KPIs of each parameter set, see run, sorted by total cost.
+
+        '''
+
+        if isinstance(grid, dict):
+            names = sorted(grid)
+            grid = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+        n_workers = min(n_workers or multiprocessing.cpu_count(), len(grid))
+        # Send the data once to each worker, not with every parameter set
+        pool = multiprocessing.Pool(processes=n_workers, initializer=_initialize_worker,
+                                    initargs=(self.data, self.price, self.config))
+        try:
+            results = pool.map(_run_parameters, grid)
+        finally:
+            pool.close()
+            pool.join()
+
+        return pd.DataFrame(results).sort_values('total_cost').reset_index(drop=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the baseline battery policy on recorded data.')
+    parser.add_argument('--data', help='csv file of pv_generation, building_load and battery_soc with a UTC time index, '
+                                       'queried with baseline_config if not given')
+    parser.add_argument('--start', help='start time in UTC of the data to query')
+    parser.add_argument('--end', help='end time in UTC of the data to query')
+    parser.add_argument('--price', required=True, help='csv file of pi_e and pi_d')
+    parser.add_argument('--price_tz', default='America/Los_Angeles', help='time zone of the price csv time index')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    for name in sweep_parameters:
+        parser.add_argument('--' + name, type=float, nargs='+', help='values of {0} to sweep'.format(name))
+    args = parser.parse_args()
+
+    import baseline_config
+    config = baseline_config.get_config()
+    if args.data:
+        data = pd.read_csv(args.data, index_col=0, parse_dates=True)
+        if data.index.tz is None:
+            data = data.tz_localize('UTC')
+    else:
+        from data_manager import Data_Manager
+        data_manager = Data_Manager(data_manager_config=config['data_manager_config'])
+        data = data_manager.get_timeseries_from_config(config='baseline', start_time=pd.to_datetime(args.start),
+                                                       end_time=pd.to_datetime(args.end))
+        # The data manager returns naive UTC times
+        data = data.tz_localize('UTC')
+    price = pd.read_csv(args.price, index_col=0, parse_dates=True).tz_localize(args.price_tz).tz_convert('UTC')
+
+    backtest = Baseline_Backtest(data, price, config)
+    print('Cost without battery: {0:.2f} $'.format(backtest.reference_cost['total_cost']))
+    print('Cost as operated: {0:.2f} $'.format(backtest.get_recorded_kpis()['total_cost']))
+    grid = dict((name, getattr(args, name)) for name in sweep_parameters if getattr(args, name))
+    print(backtest.sweep(grid if grid else [{}], n_workers=args.workers).to_string())
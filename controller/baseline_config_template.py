@@ -9,6 +9,10 @@ config={
     'min_battery_soc': 0.25,
     'historical_data_interval_minutes': 15,
     'battery_total_capacity': 40500,
+    'night_charge_start': 0,
+    'night_charge_end': 6,
+    'charge_efficiency': 0.95,
+    'discharge_efficiency': 0.95,
     'default_flexstat_hsp': 68,
     'default_flexstat_csp': 70,
     'default_freezer_sp': -7,
@@ -34,6 +38,7 @@ config={
                 "type": "csv",
                 # "type": "csv|xbos",
                 "filename": "Shadow/setpoints_baseline.csv",
+                # "rotate": "daily",
                 "devices": {
                     # "flexstat/thermostat_east/actuation": {"cooling_setpoint": "Trtu_east_cool", "heating_setpoint": "Trtu_east_heat"},
                     # "flexstat/thermostat_west/actuation": {"cooling_setpoint": "Trtu_west_cool", "heating_setpoint": "Trtu_west_heat"},
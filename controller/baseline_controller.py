@@ -1,9 +1,10 @@
 import datetime
+import os
 import pandas as pd
-import time
 from data_manager import Data_Manager
 import baseline_config
-import pytz
+from scheduler import Scheduler
+from baseline_policy import Baseline_Policy
 
 class Baseline_Controller:
     def __init__(self, config):
@@ -11,11 +12,8 @@ class Baseline_Controller:
         self.data_manager_config = self.config.get('data_manager_config')
         self.data_manager = Data_Manager(data_manager_config=self.data_manager_config)
 
-        self.max_battery_rate = self.config.get('max_battery_rate', 21000)
-        self.min_battery_rate = self.config.get('min_battery_rate', -21000)
-        self.max_battery_soc = self.config.get('max_battery_soc', 0.95)
-        self.min_battery_soc = self.config.get('min_battery_soc', 0.25)
-        self.battery_total_capacity = self.config.get('battery_total_capacity', 40500)
+        # Battery rules, shared with the plans and backtests over whole horizons
+        self.policy = Baseline_Policy.from_config(self.config)
 
         self.default_flexstat_hsp = self.config.get('default_flexstat_hsp', 68)
         self.default_flexstat_csp = self.config.get('default_flexstat_csp', 70)
@@ -26,7 +24,14 @@ class Baseline_Controller:
         
         print("The baseline controller has been instantiated")
 
-    def generate_setpoints(self):
+    def generate_setpoints(self, sink=None):
+        '''Compute the battery setpoint from the last 5 minutes of data and push the setpoints
+
+            Parameters
+            ----------
+            sink: dict
+                setpoints sink configuration replacing data_sink["setpoints"], e.g. for a shadow run
+        '''
         end_time = datetime.datetime.utcnow()
         start_time = end_time - datetime.timedelta(minutes=self.historical_data_interval)
 
@@ -45,40 +50,8 @@ class Baseline_Controller:
         print("current battery_soc = {0}".format(battery_soc))
         print("current net_load = {0}".format(net_load))
 
-        # PV generation > building load, charge the battery
-        if net_load < 0:
-            print("PV generation more than load, charge battery")
-            # charge if the battery is not full
-            if battery_soc < self.max_battery_soc:
-                # do not exceed maximum battery rate
-                if abs(net_load) > self.max_battery_rate:
-                    print("excess PV is greater than battery charge rate; changing charge rate to max_battery_rate={0}".format(self.max_battery_rate))
-                    battery_setpoint = self.max_battery_rate
-                else:
-                    battery_setpoint = abs(net_load)
-            else:
-                print("Battery already full, new battery_setpoint = 0")
-                battery_setpoint = 0
-        # PV generation < building load, discharge the battery
-        else:
-            # discharge battery only if it isn't empty
-            if battery_soc > self.min_battery_soc:
-                if (-1*net_load) < self.min_battery_rate:
-                    print("Current net load cannot be completely supported by battery, battery discharging at maximum rate={0}".format(self.min_battery_rate))
-                    battery_setpoint = self.min_battery_rate
-                else:
-                    battery_setpoint = -1*net_load
-            else:
-                print("Battery already empty, new battery_setpoint = 0")
-                battery_setpoint = 0
-
-        time_now = pytz.timezone("UTC").localize(datetime.datetime.utcnow()).astimezone(pytz.timezone("America/Los_Angeles")).replace(tzinfo = None)
-        if time_now.hour >= 0 and time_now.hour <= 5:
-            hour_now = round(time_now.hour + time_now.minute/60 + time_now.second/3600, 2)
-            print("low price time - charging battery so that it reaches maximum SOC by 6AM")
-            battery_setpoint = (self.max_battery_soc - battery_soc)*self.battery_total_capacity/(6-hour_now)
-            if battery_setpoint > self.max_battery_rate:
-                battery_setpoint = self.max_battery_rate
+        hour_now = self.policy.get_hours([end_time])
+        battery_setpoint = float(self.policy.get_setpoints([net_load], [battery_soc], hour_now)[0])
 
         print("\n")
         print("New battery_setpoint = {0}".format(battery_setpoint))
@@ -89,20 +62,30 @@ class Baseline_Controller:
                                    index=[end_time+datetime.timedelta(minutes=5)])
         setpoint_df.index.name='Time'
         setpoint_df = setpoint_df.resample('1T').mean().tz_localize("UTC")
-        self.data_manager.set_setpoints(df=setpoint_df, overwrite=False)
+        self.data_manager.set_setpoints(df=setpoint_df, overwrite=False, sink=sink)
 
-if __name__ == '__main__':
-    minute = -1
+    def generate_plan(self, pv_generation, building_load, battery_soc):
+        '''Compute the battery setpoints of the baseline policy over a horizon
+
+            Parameters
+            ----------
+            pv_generation: Series
+                forecast of the PV generation in W, with a UTC time index
+            building_load: Series
+                forecast of the building load in W, with the same index
+            battery_soc: float
+                current state of charge of the battery
 
+            Returns
+            -------
+            plan: DataFrame
+                net_load and battery_setpoint in W and the expected battery_soc, see Baseline_Policy.simulate
+        '''
+        return self.policy.simulate(pv_generation.index, pv_generation.values, building_load.values, battery_soc)
+
+if __name__ == '__main__':
     controller = Baseline_Controller(config=baseline_config.get_config())
-    while True:
-        time.sleep(1)
-        t = datetime.datetime.now()
-        print(t)
-        if (t.minute in [0,5,10,15,20,25,30,35,40,45,50,55]) and (t.minute != minute):
-            minute = t.minute
-            try:
-                controller.generate_setpoints()
-                print('Run ended ok.\n')
-            except Exception as e :
-               print('Run ended in error={0}'.format(str(e)))
\ No newline at end of file
+    # Run at xx:x0:00 and xx:x5:00, skipping the runs that would overlap a long one
+    scheduler = Scheduler(controller.generate_setpoints, name='baseline', period=300,
+                          log_filename=os.path.abspath(os.path.join(__file__, '..', 'output', 'schedule_baseline.csv')))
+    scheduler.run()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the rule based battery policy of the baseline
+controller, evaluated with NumPy arrays over a whole horizon.
+
+The policy charges the battery from excess PV and discharges it to cover
+the net load, within the rate and state of charge limits.  During the
+night charging window, it charges the battery so that it reaches the
+maximum state of charge at the end of the window.
+
+"""
+
+from __future__ import division
+import numpy as np
+import pandas as pd
+
+class Baseline_Policy(object):
+    '''Rule based battery policy of the baseline controller.
+
+    Parameters
+    ----------
+    max_battery_rate : float, optional
+        Maximum charging power in W.
+        Default is 21000.
+    min_battery_rate : float, optional
+        Maximum discharging power in W, as a negative number.
+        Default is -21000.
+    max_battery_soc : float, optional
+        State of charge above which the battery is not charged from PV,
+        and that the night charging aims for.
+        Default is 0.95.
+    min_battery_soc : float, optional
+        State of charge below which the battery is not discharged.
+        Default is 0.25.
+    battery_total_capacity : float, optional
+        Capacity of the battery in Wh.
+        Default is 40500.
+    night_charge_start : float, optional
+        Local hour at which the night charging window starts.
+        Default is 0.
+    night_charge_end : float, optional
+        Local hour at which the night charging window ends.  It may be
+        lower than night_charge_start for a window across midnight.
+        Default is 6.
+    tz : str, optional
+        Time zone of the night charging window.
+        Default is 'America/Los_Angeles'.
+    '''
+
+    def __init__(self, max_battery_rate=21000, min_battery_rate=-21000, max_battery_soc=0.95, min_battery_soc=0.25,
+                 battery_total_capacity=40500, night_charge_start=0, night_charge_end=6, tz='America/Los_Angeles'):
+        '''Constructor.
+
+        '''
+        self.max_battery_rate = max_battery_rate
+        self.min_battery_rate = min_battery_rate
+        self.max_battery_soc = max_battery_soc
+        self.min_battery_soc = min_battery_soc
+        self.battery_total_capacity = battery_total_capacity
+        self.night_charge_start = night_charge_start
+        self.night_charge_end = night_charge_end
+        self.tz = tz
+
+    @classmethod
+    def from_config(cls, config):
+        '''Create the policy from a baseline configuration dictionary.
+
+        Parameters
+        ----------
+        config : dict
+            Configuration as returned by baseline_config.get_config().
+
+        Returns
+        -------
+        policy : Baseline_Policy
+            New policy, with the defaults for missing keys.
+
+        '''
+
+        return cls(max_battery_rate=config.get('max_battery_rate', 21000),
+                   min_battery_rate=config.get('min_battery_rate', -21000),
+                   max_battery_soc=config.get('max_battery_soc', 0.95),
+                   min_battery_soc=config.get('min_battery_soc', 0.25),
+                   battery_total_capacity=config.get('battery_total_capacity', 40500),
+                   night_charge_start=config.get('night_charge_start', 0),
+                   night_charge_end=config.get('night_charge_end', 6),
+                   tz=config.get('tz', 'America/Los_Angeles'))
+
+    def get_hours(self, index):
+        '''Get the local hour of the day of a time index.
+
+        Parameters
+        ----------
+        index : DatetimeIndex
+            Time index, UTC if naive.
+
+        Returns
+        -------
+        hours : array
+            Hour of the day in the time zone of the policy, with the
+            minutes and seconds as fraction.
+
+        '''
+
+        index = pd.DatetimeIndex(index)
+        if index.tz is None:
+            index = index.tz_localize('UTC')
+        index = index.tz_convert(self.tz)
+
+        return np.asarray(index.hour + index.minute / 60 + index.second / 3600, dtype=float)
+
+    def get_setpoints(self, net_load, soc, hours):
+        '''Evaluate the policy for given states of charge.
+
+        Parameters
+        ----------
+        net_load : array
+            Building load minus PV generation in W.
+        soc : array
+            State of charge of the battery.
+        hours : array
+            Local hour of the day, see get_hours.
+
+        Returns
+        -------
+        setpoints : array
+            Battery power in W, positive for charging.
+
+        '''
+
+        charge, discharge, night, night_gain = self.get_terms(net_load, hours)
+        soc = np.asarray(soc, dtype=float)
+        setpoints = np.where(np.asarray(net_load) < 0,
+                             np.where(soc < self.max_battery_soc, charge, 0.),
+                             np.where(soc > self.min_battery_soc, discharge, 0.))
+        night_setpoints = np.minimum(night_gain * (self.max_battery_soc - soc), self.max_battery_rate)
+
+        return np.where(night, night_setpoints, setpoints)
+
+    def simulate(self, index, pv_generation, building_load, soc_initial, charge_efficiency=1., discharge_efficiency=1.):
+        '''Evaluate the policy over a horizon, with the state of charge following the setpoints.
+
+        The state of charge is integrated over each time step with the
+        setpoint of its start.  The battery power is limited so that the
+        state of charge stays between 0 and 1.
+
+        Parameters
+        ----------
+        index : DatetimeIndex
+            Time index of the horizon, UTC if naive.
+        pv_generation : array
+            PV generation in W.
+        building_load : array
+            Building load in W.
+        soc_initial : float
+            State of charge at the first time of the index.
+        charge_efficiency : float, optional
+            Fraction of the charging power stored in the battery.
+            Default is 1.
+        discharge_efficiency : float, optional
+            Fraction of the energy taken from the battery delivered as
+            discharging power.
+            Default is 1.
+
+        Returns
+        -------
+        plan : DataFrame
+            'net_load', 'battery_setpoint' and the 'battery_power' the
+            battery delivers in W, and the 'battery_soc' at the start of
+            each time step, indexed by index.
+
+        '''
+
+        index = pd.DatetimeIndex(index)
+        net_load = np.asarray(building_load, dtype=float) - np.asarray(pv_generation, dtype=float)
+        charge, discharge, night, night_gain = self.get_terms(net_load, self.get_hours(index))
+        # Energy of one W over each time step, as fraction of the capacity
+        step = np.diff(index.asi8) / 1e9 / 3600 / self.battery_total_capacity
+        step = np.append(step, step[-1] if len(step) > 0 else 0.)
+
+        # The recursion only compares floats, the rest is computed above
+        is_charge = (net_load < 0).tolist()
+        charge, discharge, night, night_gain, step = [a.tolist() for a in [charge, discharge, night, night_gain, step]]
+        max_soc = self.max_battery_soc
+        min_soc = self.min_battery_soc
+        max_rate = self.max_battery_rate
+        setpoints = [0.] * len(index)
+        powers = [0.] * len(index)
+        socs = [0.] * len(index)
+        soc = min(max(float(soc_initial), 0.), 1.)
+        for i in range(len(index)):
+            socs[i] = soc
+            if night[i]:
+                setpoint = min(night_gain[i] * (max_soc - soc), max_rate)
+            elif is_charge[i]:
+                setpoint = charge[i] if soc < max_soc else 0.
+            else:
+                setpoint = discharge[i] if soc > min_soc else 0.
+            setpoints[i] = setpoint
+            if setpoint >= 0:
+                stored = min(setpoint * charge_efficiency * step[i], 1. - soc)
+                power = stored / (charge_efficiency * step[i]) if step[i] > 0 else setpoint
+            else:
+                stored = max(setpoint / discharge_efficiency * step[i], -soc)
+                power = stored * discharge_efficiency / step[i] if step[i] > 0 else setpoint
+            powers[i] = power
+            soc = soc + stored
+
+        return pd.DataFrame({'net_load': net_load, 'battery_setpoint': setpoints, 'battery_power': powers, 'battery_soc': socs},
+                            index=index, columns=['net_load', 'battery_setpoint', 'battery_power', 'battery_soc'])
+
+    def get_terms(self, net_load, hours):
+        '''Get the parts of the policy that do not depend on the state of charge.
+
+        Returns
+        -------
+        charge : array
+            Setpoint when charging from excess PV.
+        discharge : array
+            Setpoint when discharging to cover the net load.
+        night : array of bool
+            True in the night charging window.
+        night_gain : array
+            Setpoint per unit of state of charge below max_battery_soc in
+            the night charging window.
+
+        '''
+
+        net_load = np.asarray(net_load, dtype=float)
+        hours = np.asarray(hours, dtype=float)
+        charge = np.minimum(-net_load, self.max_battery_rate)
+        discharge = np.maximum(-net_load, self.min_battery_rate)
+        if self.night_charge_start <= self.night_charge_end:
+            night = (hours >= self.night_charge_start) & (hours < self.night_charge_end)
+        else:
+            # Window across midnight
+            night = (hours >= self.night_charge_start) | (hours < self.night_charge_end)
+        hours_left = np.mod(self.night_charge_end - hours, 24)
+        night_gain = np.where(night, self.battery_total_capacity / np.maximum(hours_left, 1e-6), 0.)
+
+        return charge, discharge, night, night_gain
@@ -1,61 +1,117 @@
+import os
+import functools
+import multiprocessing
 import pandas as pd
 import pytz
 import datetime
 import time
 from baseline_controller import Baseline_Controller, baseline_config
 from mpc_controller import MPC_Controller, mpc_config, tz_computer, islanding
+from scheduler import Scheduler, read_schedule_logs
 
 tz_local = pytz.timezone("America/Los_Angeles")
 tz_utc = pytz.timezone("UTC")
 
+outdir = os.path.abspath(os.path.join(__file__, '..', 'output'))
+
 df = pd.read_csv("controller/test_schedule.csv", index_col=0)
 df.start_time = pd.to_datetime(df.start_time)
 df.end_time = pd.to_datetime(df.end_time)
+df['start_time_utc'] = [tz_local.localize(t).astimezone(tz_utc) for t in df.start_time]
+df['end_time_utc'] = [tz_local.localize(t).astimezone(tz_utc) for t in df.end_time]
+
+def get_live_controller(time_now):
+    '''Get the controller that pushes the setpoints to the devices.
+
+        Parameters
+        ----------
+        time_now: datetime in UTC
+            current time
+
+        Returns
+        -------
+        name: str
+            'baseline' during the baseline tests, 'mpc' otherwise
+    '''
+    tests = df[(df.start_time_utc <= time_now) & (time_now <= df.end_time_utc)]
+    if len(tests) > 0 and bool(tests['is_baseline'].iloc[0]):
+        return 'baseline'
+    return 'mpc'
+
+def get_shadow_sink(data_sink):
+    '''Get the setpoints sink of a controller running in shadow, which never reaches the devices.
+
+        Parameters
+        ----------
+        data_sink: dict
+            data_sink section of the data manager configuration
 
-minute = -1
-
-baseline_controller = Baseline_Controller(config=baseline_config.get_config())
-mpc_controller = MPC_Controller(mpc_config=mpc_config, tz_computer=tz_computer, islanding=islanding)
-
-for index, row in df.iterrows():
-    st = tz_local.localize(row['start_time']).astimezone(tz_utc)
-    et = tz_local.localize(row['end_time']).astimezone(tz_utc)
-    print("start_time = ", st)
-    print("end time = ", et)
-    is_baseline = bool(row['is_baseline'])
-    
-    time_now = tz_utc.localize(datetime.datetime.utcnow())
-    run_minute = -1
-    while st <= time_now and time_now <= et:
-        if time_now.minute%5==0  and time_now.minute != run_minute:
-            run_minute = time_now.minute
-            if is_baseline:
-                print("time_now = {0}; running baseline".format(time_now.strftime("%Y-%m-%d %H:%M:%S")))
-                try:
-                    baseline_controller.generate_setpoints()
-                    print('Baseline run ended ok.\n')
-                except Exception as e:
-                    print('Baseline run ended in error={0}'.format(str(e)))
-            else:
-                print("time_now = {0}; runnign mpc".format(time_now.strftime("%Y-%m-%d %H:%M:%S")))
-                try:
-                    mpc_controller.run()
-                    print('MPC run ended ok.\n')
-                except Exception as e:
-                    print('MPC run ended in error, error={0}'.format(str(e)))
-        time.sleep(10)
+        Returns
+        -------
+        sink: dict
+            data_sink["shadow_setpoints"] if configured, else a csv file next to the
+            data_sink["setpoints"] csv file, with the suffix _shadow
+    '''
+    if "shadow_setpoints" in data_sink:
+        return data_sink["shadow_setpoints"]
+    base, ext = os.path.splitext(data_sink["setpoints"].get("filename", "setpoints.csv"))
+    return {"type": "csv", "filename": base + "_shadow" + ext}
+
+def run_worker(name):
+    '''Run one controller every 5 minutes, live or in shadow according to the test schedule.
+
+        Each controller runs in its own process, so that a long mpc solve never delays the baseline.
+
+        Parameters
+        ----------
+        name: str
+            'baseline' or 'mpc'
+    '''
+    if name == 'baseline':
+        controller = Baseline_Controller(config=baseline_config.get_config())
+        run = controller.generate_setpoints
+        shadow_sink = get_shadow_sink(controller.data_manager_config["data_sink"])
+        run_shadow = functools.partial(run, sink=shadow_sink)
+    else:
+        controller = MPC_Controller(mpc_config=mpc_config, tz_computer=tz_computer, islanding=islanding,
+                                    resident=getattr(mpc_config, 'resident', False))
+        run = controller.run
+        shadow_sink = get_shadow_sink(controller.config["data_manager_config"]["data_sink"])
+        # Statistics, timing and archive of the shadow runs are kept apart from the live ones
+        run_shadow = functools.partial(run, sink=shadow_sink, role='shadow')
+
+    def run_cycle():
         time_now = tz_utc.localize(datetime.datetime.utcnow())
-        print("time_now = {0}".format(time_now.strftime("%Y-%m-%d %H:%M:%S")))
-
-minute = -1
-while True:
-    time.sleep(10)
-    t = datetime.datetime.now()
-    print(t)
-    if (t.minute%5==0) and (t.minute != minute):
-        minute = t.minute
-        try:
-            mpc_controller.run()
-            print('Run ended ok.')
-        except Exception as e :
-            print('Run ended in error, error={0}'.format(str(e)))
\ No newline at end of file
+        if get_live_controller(time_now) == name:
+            role = 'live'
+            run()
+        else:
+            role = 'shadow'
+            run_shadow()
+        print("time_now = {0}; ran {1} ({2})".format(time_now.strftime("%Y-%m-%d %H:%M:%S"), name, role))
+        return name, role
+
+    # Run at xx:x0:00 and xx:x5:00, skipping the runs that would overlap a long one
+    scheduler = Scheduler(run_cycle, name=name, period=300,
+                          log_filename=os.path.join(outdir, 'schedule_{0}.csv'.format(name)))
+    scheduler.run()
+
+if __name__ == '__main__':
+    names = ['baseline', 'mpc']
+    log_filenames = [os.path.join(outdir, 'schedule_{0}.csv'.format(name)) for name in names]
+    workers = {}
+    last_tick = None
+    while True:
+        # Start the workers, and restart any that stopped
+        for name in names:
+            if name not in workers or not workers[name].is_alive():
+                if name in workers:
+                    print('The {0} worker stopped with exit code {1}, restarting it.'.format(name, workers[name].exitcode))
+                workers[name] = multiprocessing.Process(target=run_worker, args=(name,), name=name)
+                workers[name].start()
+        time.sleep(60)
+        # Timing and outcome of both controllers side by side
+        logs = read_schedule_logs(log_filenames)
+        if logs is not None and logs.index[-1] != last_tick:
+            last_tick = logs.index[-1]
+            print(logs[['role', 'jitter', 'duration', 'status']].tail(1).T)
@@ -5,47 +5,100 @@ import os
 from influxdb import DataFrameClient
 import yaml
 import time
+import collections
+import csv
+import glob
+import threading
+from multiprocessing.pool import ThreadPool
+from timing import Phase_Timer
+from influx_cache import Influx_Cache
+from influx_writer import Influx_Writer
+from setpoint_messages import build_messages
 
 try:
     # xboswave packages
     from pyxbos.eapi_pb2 import *
     from pyxbos.wavemq_pb2 import *
     from pyxbos.wavemq_pb2_grpc import *
+    import grpc
     from grpc import insecure_channel
-    from pyxbos import xbos_pb2
-    from pyxbos import flexstat_pb2
-    from pyxbos import parker_pb2
-    from pyxbos import rtac_pb2
-    from pyxbos import nullabletypes_pb2 as types
     import base64
 except ImportError:
     print("not importing xbos packages")
 
+try:
+    # columnar data files
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError:
+    print("not importing pyarrow packages")
+
 class Data_Manager():
 
-    def __init__(self, data_path="data", data_manager_config=None):
+    def __init__(self, data_path="data", data_manager_config=None, timer=None):
         '''Constructor
 
             Parameters
             ----------
             data_path: str
-                folder name in the root directory of the repository where the data files are located
+                folder name in the root directory of the repository where the data files are located,
+                overridden by data_manager_config["data_path"] if given
 
             data_manager_config: dict
                 configuration dict for data_manager
+
+            timer: timing.Phase_Timer
+                timer that records the duration of each sink write, a new timer if None
         '''
         self.data_manager_config = data_manager_config
-
-        self.data_path = data_path + "/"
+        self.influx_batch = False
+        self.influx_cache = None
+        # Latest forecast timestamp and time of the query, keyed by (measurement, uuid)
+        self.forecast_issue_index = {}
+        self.forecast_issue_lock = threading.Lock()
+        self.forecast_ttl = 3300
+        self.forecast_max_age = 48*3600
+        self.influx_write_batch_size = None
+        self.influx_writer = None
+        self.wavemq_channel = None
+        self.publish_summary = {}
+        self.timer = timer if timer is not None else Phase_Timer()
+        # Parsed csv files, most recently used last
+        self.csv_cache = collections.OrderedDict()
+        self.csv_cache_size = self.data_manager_config.get("csv_cache_size", 16)
+        self.csv_cache_lock = threading.Lock()
+
+        self.data_path = self.data_manager_config.get("data_path", data_path) + "/"
 
         for source_type in self.data_manager_config["source"]:
             if source_type == "csv_files":
                 self.files = self.data_manager_config["source"][source_type]
                 self.init_csv(files=self.files)
+            elif source_type == "parquet_files":
+                self.parquet_files = self.data_manager_config["source"][source_type]
+                self.init_parquet(files=self.parquet_files)
             elif source_type == "influxdb":
                 with open(self.data_manager_config["source"][source_type]["config_filename"], "r") as fp:
                     self.influx_cfg = yaml.safe_load(fp)[self.data_manager_config["source"][source_type]["section"]]
                 self.init_influx(influx_cfg=self.influx_cfg)
+                # Query all variables of a section at once unless disabled
+                self.influx_batch = self.data_manager_config["source"][source_type].get("batch_queries", True)
+                # Time to keep the latest forecast timestamps, about the forecast issue interval, and age of
+                # the oldest forecast searched
+                self.forecast_ttl = self.data_manager_config["source"][source_type].get("forecast_ttl", 3300)
+                self.forecast_max_age = self.data_manager_config["source"][source_type].get("forecast_max_age", 48*3600)
+                # Points per write request, and optional writes from a background thread
+                self.influx_write_batch_size = self.data_manager_config["source"][source_type].get("write_batch_size", 5000)
+                if self.data_manager_config["source"][source_type].get("write_nonblocking", False):
+                    self.influx_writer = Influx_Writer(max_queue=self.data_manager_config["source"][source_type].get("write_queue_size", 100),
+                                                       retries=self.data_manager_config["source"][source_type].get("write_retries", 3))
+                # Keep queried data in a local cache and only query what changed
+                cache_cfg = self.data_manager_config["source"][source_type].get("cache", None)
+                if cache_cfg:
+                    self.influx_cache = Influx_Cache(path=cache_cfg["path"],
+                                                     retention=cache_cfg.get("retention", 7*24*3600),
+                                                     overlap=cache_cfg.get("overlap", 0))
+                    self.influx_batch = True
             elif source_type == "xbos":
                 self.xbos_cfg = self.data_manager_config["source"]["xbos"]
                 self.init_xbos(xbos_cfg=self.xbos_cfg)
@@ -98,8 +151,9 @@ class Data_Manager():
         )
         self.namespace = self.ensure_b64decode(xbos_cfg.get('namespace'))
         self.wavemq = xbos_cfg.get('wavemq', 'localhost:4516')
-        wavemq_channel = insecure_channel(self.wavemq)
-        self.xbos_client = WAVEMQStub(wavemq_channel)
+        self.xbos_timeout = xbos_cfg.get('publish_timeout', 10)
+        self.xbos_retries = xbos_cfg.get('publish_retries', 1)
+        self.connect_wavemq()
         self.xbos_schema = "xbosproto/XBOS"
 
 
@@ -120,6 +174,30 @@ class Data_Manager():
             if not os.path.exists(filename):
                 raise Exception("file {0} does not exist in folder {1}".format(file, self.data_path))
 
+    def init_parquet(self, files):
+        '''Check the parquet or feather files in the config["parquet_files"]
+
+            Files are written by process/convert_to_parquet.py, with a time column in UTC sorted ascending.
+
+            Parameters
+            ----------
+            files: list
+                names of the files in the data folder
+
+            Returns
+            -------
+            None
+
+        '''
+        try:
+            pq
+        except NameError:
+            raise ImportError("pyarrow is required for the parquet_files source")
+        for file in files:
+            filename = self.data_path + file
+            if not os.path.exists(filename):
+                raise Exception("file {0} does not exist in folder {1}".format(file, self.data_path))
+
     def b64decode(self, e):
         return base64.b64decode(e, altchars=bytes('-_', 'utf8'))
 
@@ -158,26 +236,8 @@ class Data_Manager():
             q = "select prediction_time, value from %s where \"uuid\"=\'%s\'" % (measurement, uuid)
             q += " and time= " + (str(latest_ts))
             df = self.influx_client.query(q)[measurement]
-            df = df[['prediction_time', 'value']]
-            df.prediction_time = pd.to_datetime(df.prediction_time.astype(int) * 1e9)
-            df = df.sort_values(by='prediction_time').set_index('prediction_time').tz_localize(self.tz_utc)
-            df.index.name = 'time'
-            if start_time != None and end_time != None:
-                # df = df[st_hour: end_time]
-                df = df[st_hour: et_hour]
-            elif start_time != None:
-                df = df[st_hour:]
-            elif end_time != None:
-                # df = df[:end_time]
-                df = df[:et_hour]
-
-            if agg != 'raw':
-                window = window.replace("m", "T")
-                if config_name != 'price' and config_name != 'constraint':
-                    df = df.resample(window).agg(agg).interpolate(method='linear')[start_time:end_time]
-                else:
-                    df = df.resample(window).agg(agg).fillna(method='ffill')[start_time:end_time]
-                df = df[start_time:end_time]
+            df = self.process_forecast_from_influx(df, start_time=start_time, end_time=end_time, window=window,
+                                                   agg=agg, config_name=config_name)
         else:
             if agg != 'raw':
                 q = "select %s(value) as value from %s where \"uuid\"=\'%s\'" % (agg, measurement, uuid)
@@ -197,15 +257,224 @@ class Data_Manager():
             df = self.influx_client.query(q)[measurement]
         return df
 
-    def get_single_data_from_csv(self, filename, column_name, start_time=None, end_time=None, tz="America/Los_Angeles", agg='mean', window='5m', config_name=None):
+    def process_forecast_from_influx(self, df, start_time=None, end_time=None, window='5m', agg='mean', config_name=None):
+        '''Index the latest forecast of one variable by prediction time and resample it to the window
+
+               Parameters
+               ----------
+               df: pandas DataFrame
+                   forecast as queried from influxdb, with the columns prediction_time and value
+               start_time : datetime
+                   Start time of timeseries
+               end_time : datetime
+                   End time of timeseries
+               window: str
+                   resampling window, e.g. '5m'
+               agg: str
+                   aggregation function of the resampling, 'raw' to not resample
+               config_name: str
+                   section name in config file, price and constraint forecasts are forward filled
+
+               Returns
+               -------
+               df: pandas DataFrame
+                   DataFrame where the column is the forecast of the variable
+           '''
         if start_time != None:
             st_hour = datetime.datetime.combine(start_time.date(), datetime.time(start_time.hour, 0, 0, tzinfo=start_time.tzinfo))
 
-        file_tz = pytz.timezone(tz)
-        window = window.replace('m', 'T')
-        df = pd.read_csv(self.data_path + filename, index_col=0, parse_dates=True)
-        df = df.tz_localize(file_tz).tz_convert(self.tz_utc)
-        df.index = pd.to_datetime(df.index)
+        if end_time != None:
+            et_hour = datetime.datetime.combine(end_time.date(), datetime.time(end_time.hour, 0, 0, tzinfo=start_time.tzinfo)) + datetime.timedelta(hours=1)
+
+        df = df[['prediction_time', 'value']]
+        df.prediction_time = pd.to_datetime(df.prediction_time.astype(int) * 1e9)
+        df = df.sort_values(by='prediction_time').set_index('prediction_time').tz_localize(self.tz_utc)
+        df.index.name = 'time'
+        if start_time != None and end_time != None:
+            # df = df[st_hour: end_time]
+            df = df[st_hour: et_hour]
+        elif start_time != None:
+            df = df[st_hour:]
+        elif end_time != None:
+            # df = df[:end_time]
+            df = df[:et_hour]
+
+        if agg != 'raw':
+            window = window.replace("m", "T")
+            if config_name != 'price' and config_name != 'constraint':
+                df = df.resample(window).agg(agg).interpolate(method='linear')[start_time:end_time]
+            else:
+                df = df.resample(window).agg(agg).fillna(method='ffill')[start_time:end_time]
+            df = df[start_time:end_time]
+        return df
+
+    def get_batch_data_from_influx(self, uuids, measurement='timeseries', start_time=None, end_time=None, window='5m', agg='mean', forecast=False, config_name=None):
+        '''From the influxdb measurement, get several variables with one query per step, grouped by uuid
+
+               The DataFrame of each uuid is the same as the one returned by get_single_data_from_influx.
+               Forecasts need one query for the latest forecast times of all uuids, one more for the uuids
+               without a forecast in the last 63 minutes, and one query for the data.
+               With a cache, forecasts already cached for their issue time are not queried, and only the
+               part of the time range of timeseries that is not cached yet is queried.
+
+               Parameters
+               ----------
+               uuids: list
+                   uuids of the variables being queried
+               measurement: string
+                   measurement which contains the variables to be queried
+               start_time : datetime
+                   Start time of timeseries
+               end_time : datetime
+                   End time of timeseries
+
+               Returns
+               -------
+               dfs: dict
+                   pandas DataFrame of each uuid, where the column is the variable being queried.
+                   uuids without data are missing.
+           '''
+        uuids = sorted(set(uuids))
+
+        if forecast:
+            latest_ts = self.get_batch_last_ts_influx(uuids=uuids)
+            dfs = {}
+            # Issued forecasts do not change, so a cached forecast is complete
+            if self.influx_cache is not None:
+                for uuid in latest_ts:
+                    df = self.influx_cache.get_forecast(uuid, measurement, latest_ts[uuid])
+                    if df is not None:
+                        dfs[uuid] = df
+            missing_ts = dict((uuid, latest_ts[uuid]) for uuid in latest_ts if uuid not in dfs)
+            if len(missing_ts) > 0:
+                fetched = self.query_batch_forecast_from_influx(latest_ts=missing_ts, measurement=measurement)
+                if self.influx_cache is not None:
+                    for uuid in fetched:
+                        self.influx_cache.put_forecast(uuid, measurement, missing_ts[uuid], fetched[uuid])
+                dfs.update(fetched)
+            for uuid in dfs:
+                dfs[uuid] = self.process_forecast_from_influx(dfs[uuid], start_time=start_time, end_time=end_time,
+                                                              window=window, agg=agg, config_name=config_name)
+        elif self.influx_cache is not None and start_time != None and end_time != None:
+            # Only query the part of the time range that is not cached yet
+            fetch_starts = [self.influx_cache.get_fetch_start(uuid, measurement, agg, window, start_time, end_time) for uuid in uuids]
+            fetch_starts = [fetch_start for fetch_start in fetch_starts if fetch_start is not None]
+            if len(fetch_starts) > 0:
+                fetch_start = min(fetch_starts)
+                fetched = self.query_batch_timeseries_from_influx(uuids=uuids, measurement=measurement, start_time=fetch_start,
+                                                                  end_time=end_time, window=window, agg=agg)
+                for uuid in uuids:
+                    self.influx_cache.put_series(uuid, measurement, agg, window, fetched.get(uuid, None), fetch_start, end_time)
+            dfs = {}
+            for uuid in uuids:
+                df = self.influx_cache.get_series(uuid, measurement, agg, window, start_time, end_time)
+                if df is not None:
+                    dfs[uuid] = df
+        else:
+            dfs = self.query_batch_timeseries_from_influx(uuids=uuids, measurement=measurement, start_time=start_time,
+                                                          end_time=end_time, window=window, agg=agg)
+        return dfs
+
+    def query_batch_timeseries_from_influx(self, uuids, measurement='timeseries', start_time=None, end_time=None, window='5m', agg='mean'):
+        '''Query the timeseries of several uuids in one query grouped by uuid
+
+               Parameters
+               ----------
+               uuids: list
+                   uuids of the variables being queried
+               measurement: string
+                   measurement which contains the variables to be queried
+               start_time : datetime
+                   Start time of timeseries
+               end_time : datetime
+                   End time of timeseries
+
+               Returns
+               -------
+               dfs: dict
+                   pandas DataFrame of each uuid with data
+           '''
+        uuid_filter = " or ".join("\"uuid\"=\'%s\'" % uuid for uuid in uuids)
+        if agg != 'raw':
+            q = "select %s(value) as value from %s where (%s)" % (agg, measurement, uuid_filter)
+        else:
+            q = "select value from %s where (%s)" % (measurement, uuid_filter)
+
+        if start_time != None and end_time != None:
+            q += " and time >= '%s' and time <= '%s'" % (start_time.strftime("%Y-%m-%dT%H:%M:%SZ"), end_time.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        elif start_time != None:
+            q += " and time >= '%s'" % (start_time.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        elif end_time != None:
+            q += " and time <= '%s'" % (end_time.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+        if agg != 'raw':
+            q += " group by time(%s), \"uuid\"" % (window)
+        else:
+            q += " group by \"uuid\""
+
+        return self.split_influx_result_by_uuid(self.influx_client.query(q))
+
+    def query_batch_forecast_from_influx(self, latest_ts, measurement='timeseries'):
+        '''Query the forecasts of several uuids, each issued at a given time, in one query grouped by uuid
+
+               InfluxDB does not support time conditions joined with or, so the query selects all forecasts
+               of the uuids issued between the earliest and the latest issue time, and the rows of each uuid
+               issued at its own time are kept.
+
+               Parameters
+               ----------
+               latest_ts: dict
+                   time in ns since epoch each forecast was issued, keyed by uuid
+               measurement: string
+                   measurement which contains the forecasts
+
+               Returns
+               -------
+               dfs: dict
+                   pandas DataFrame of each uuid with data, with the columns prediction_time and value
+           '''
+        uuid_filter = " or ".join("\"uuid\"=\'%s\'" % uuid for uuid in sorted(latest_ts))
+        q = "select prediction_time, value from %s where (%s)" % (measurement, uuid_filter)
+        q += " and time >= %s and time <= %s" % (min(latest_ts.values()), max(latest_ts.values()))
+        q += " group by \"uuid\""
+        dfs = self.split_influx_result_by_uuid(self.influx_client.query(q))
+        for uuid in list(dfs):
+            df = dfs[uuid][pd.DatetimeIndex(dfs[uuid].index).asi8 == int(latest_ts[uuid])]
+            if len(df) > 0:
+                dfs[uuid] = df
+            else:
+                del dfs[uuid]
+
+        return dfs
+
+    def split_influx_result_by_uuid(self, res):
+        '''Split the result of a query grouped by uuid into one DataFrame per uuid
+
+            Parameters
+            ----------
+            res: dict
+                result of influxdb.DataFrameClient.query, keyed by (measurement, (('uuid', uuid),))
+
+            Returns
+            -------
+            dfs: dict
+                pandas DataFrame of each uuid
+        '''
+        dfs = {}
+        for key in res:
+            if isinstance(key, tuple):
+                tags = dict(key[1])
+                dfs[tags['uuid']] = res[key]
+        return dfs
+
+    def get_single_data_from_csv(self, filename, column_name, start_time=None, end_time=None, tz="America/Los_Angeles", agg='mean', window='5m', config_name=None, rotate=None):
+        if start_time != None:
+            st_hour = datetime.datetime.combine(start_time.date(), datetime.time(start_time.hour, 0, 0, tzinfo=start_time.tzinfo))
+
+        if rotate == 'daily':
+            df = self.read_rotated_csv(self.data_path + filename, start_time=start_time, end_time=end_time, tz=tz)
+        else:
+            df = self.read_csv_cached(self.data_path + filename, tz=tz)
 
         if start_time != None and end_time != None:
             idx = df.loc[st_hour: end_time].index
@@ -219,6 +488,85 @@ class Data_Manager():
         else:
             df = df.loc[:, column_name]
 
+        df = self.resample_local_data(df, start_time=start_time, end_time=end_time, agg=agg, window=window,
+                                      config_name=config_name)
+
+        return df
+
+    def get_single_data_from_parquet(self, filename, column_name, start_time=None, end_time=None, agg='mean', window='5m', config_name=None):
+        '''From a parquet or feather file, get one column as a Series
+
+            Only the time column and the requested column are read.  For parquet files, the time range
+            is passed to the reader as a filter, so that row groups outside of the range are skipped.
+
+            Parameters
+            ----------
+            filename: str
+                name of the .parquet or .feather file in the data folder
+            column_name: str
+                column being queried
+            start_time : datetime in UTC
+                Start time of timeseries
+            end_time : datetime in UTC
+                End time of timeseries
+
+            Returns
+            -------
+            df: pandas Series
+                timeseries of the column, with the same processing as get_single_data_from_csv
+        '''
+        if start_time != None:
+            st_hour = datetime.datetime.combine(start_time.date(), datetime.time(start_time.hour, 0, 0, tzinfo=start_time.tzinfo))
+
+        path = self.data_path + filename
+        columns = ['time', column_name]
+        if filename.endswith('.feather'):
+            df = feather.read_feather(path, columns=columns)
+        else:
+            filters = []
+            if start_time != None:
+                filters.append(('time', '>=', pd.Timestamp(st_hour).tz_convert(self.tz_utc).tz_localize(None)))
+            if end_time != None:
+                filters.append(('time', '<=', pd.Timestamp(end_time).tz_convert(self.tz_utc).tz_localize(None)))
+            df = pq.read_table(path, columns=columns, filters=filters if filters else None).to_pandas()
+        df = df.set_index('time').tz_localize(self.tz_utc)[column_name]
+
+        if start_time != None and end_time != None:
+            df = df.loc[st_hour: end_time]
+        elif start_time != None:
+            df = df.loc[st_hour:]
+        elif end_time != None:
+            df = df.loc[:end_time]
+
+        df = self.resample_local_data(df, start_time=start_time, end_time=end_time, agg=agg, window=window,
+                                      config_name=config_name)
+
+        return df
+
+    def resample_local_data(self, df, start_time=None, end_time=None, agg='mean', window='5m', config_name=None):
+        '''Resample a timeseries read from a local file to the window
+
+            Parameters
+            ----------
+            df: pandas Series
+                timeseries with a UTC time index
+            start_time : datetime in UTC
+                Start time of timeseries
+            end_time : datetime in UTC
+                End time of timeseries
+            agg: str
+                aggregation function of the resampling, 'raw' to not resample
+            window: str
+                resampling window, e.g. '5m'
+            config_name: str
+                section name in config file, price and constraint data are forward filled
+
+            Returns
+            -------
+            df: pandas Series
+                resampled timeseries without missing values
+        '''
+        window = window.replace('m', 'T')
         if agg != 'raw':
             if config_name != 'price' and config_name != 'constraint':
                 df = df.resample(window).agg(agg).interpolate(method='linear')[start_time:end_time]
@@ -228,8 +576,87 @@ class Data_Manager():
 
         return df
 
+    def read_csv_cached(self, path, tz="America/Los_Angeles"):
+        '''Read a csv file with a time index in local time zone tz, converted to UTC
+
+            Parsed files are cached by path and time zone, and parsed again if the modification time
+            or size of the file changed.  The least recently used file is dropped once more than
+            data_manager_config["csv_cache_size"] (default 16) files are cached.  The returned
+            DataFrame is shared with the cache and must not be modified in place.
+
+            Parameters
+            ----------
+            path: str
+                path of the csv file
+            tz: str
+                time zone of the time index in the file
+
+            Returns
+            -------
+            df: DataFrame
+                content of the file with a UTC time index
+        '''
+        key = (os.path.abspath(path), tz)
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        with self.csv_cache_lock:
+            if key in self.csv_cache:
+                cached_version, df = self.csv_cache.pop(key)
+                if cached_version == version:
+                    self.csv_cache[key] = (cached_version, df)
+                    return df
+
+        df = pd.read_csv(path, index_col=0, parse_dates=True)
+        df = df.tz_localize(pytz.timezone(tz)).tz_convert(self.tz_utc)
+        df.index = pd.to_datetime(df.index)
+        # Files written in append mode may repeat timestamps, the last row wins
+        if df.index.has_duplicates:
+            df = df[~df.index.duplicated(keep='last')]
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+
+        with self.csv_cache_lock:
+            self.csv_cache[key] = (version, df)
+            while len(self.csv_cache) > self.csv_cache_size:
+                self.csv_cache.popitem(last=False)
+        return df
+
+    def read_rotated_csv(self, path, start_time=None, end_time=None, tz="America/Los_Angeles"):
+        '''Read the daily files of a csv file written with rotate='daily', see write_df_to_csv
+
+            Parameters
+            ----------
+            path: str
+                path of the csv file, without the day
+            start_time : datetime in UTC
+                Start time of the data, all files before end_time if None
+            end_time : datetime in UTC
+                End time of the data, all files after start_time if None
+            tz: str
+                time zone of the time index in the files
+
+            Returns
+            -------
+            df: DataFrame
+                content of the files of the days from start_time to end_time, with a UTC time index
+        '''
+        base, ext = os.path.splitext(path)
+        first_day = start_time.strftime('%Y%m%d') if start_time is not None else None
+        last_day = end_time.strftime('%Y%m%d') if end_time is not None else None
+        df_list = []
+        for day_path in sorted(glob.glob('%s_[0-9]*%s' % (base, ext))):
+            day = day_path[len(base)+1:len(day_path)-len(ext)]
+            if (first_day is None or day >= first_day) and (last_day is None or day <= last_day):
+                df_list.append(self.read_csv_cached(day_path, tz=tz))
+        if not df_list:
+            raise IOError('No daily files of %s found between %s and %s' % (path, start_time, end_time))
+        df = pd.concat(df_list, axis=0)
+        if df.index.has_duplicates:
+            df = df[~df.index.duplicated(keep='last')]
+        return df.sort_index()
+
     def get_last_ts_influx(self, uuid, measurement='timeseries'):
-        '''Query influx forecast table to retrieve the timestamp of the latest forecast
+        '''Get the timestamp of the latest forecast from the forecast issue index
 
          Parameters
             ----------
@@ -243,12 +670,78 @@ class Data_Manager():
             ts: int
                 latest timestamp when the forecasts came in
         '''
-        res = self.influx_client.query(
-            "select last(value), time from timeseries where \"uuid\"=\'%s\' and time > now() - 63m "%uuid)
-        if not measurement in res:
-            res = self.influx_client.query(
-                "select last(value), time from timeseries where \"uuid\"=\'%s\' " % uuid)
-        return res[measurement].index.values[0].astype('uint64')
+        latest_ts = self.get_batch_last_ts_influx(uuids=[uuid], measurement=measurement)
+        if not uuid in latest_ts:
+            raise ValueError("no forecast of uuid {0} in the last {1} s".format(uuid, self.forecast_max_age))
+        return latest_ts[uuid]
+
+    def get_batch_last_ts_influx(self, uuids, measurement='timeseries'):
+        '''Get the timestamp of the latest forecast of several uuids from the forecast issue index
+
+            The index keeps the latest forecast timestamp of each uuid for forecast_ttl seconds.  When
+            a requested uuid is not indexed or has expired, all expired uuids of the index are refreshed
+            together with one query over the last 63 minutes, and one over the last forecast_max_age
+            seconds for those without a recent forecast.  Older forecasts are not searched.  A forecast
+            issued after a refresh is only used once the entry expires, so forecast_ttl is a little less
+            than the forecast issue interval, by default 3300 s for hourly forecasts.
+
+         Parameters
+            ----------
+            uuids: list
+                uuids of the variables we're interested in
+            measurement: str
+                measurement to find the latest forecast from. default measurement = timeseries
+
+            Returns
+            -------
+            ts: dict
+                latest timestamp when the forecasts came in, for each uuid with a forecast
+        '''
+        # Refreshes are serialized, so that sections fetched concurrently share one refresh
+        with self.forecast_issue_lock:
+            now = time.time()
+            expired = [uuid for uuid in uuids if (measurement, uuid) not in self.forecast_issue_index or
+                       now - self.forecast_issue_index[(measurement, uuid)][1] > self.forecast_ttl]
+            if expired:
+                refresh = set(expired)
+                for key in self.forecast_issue_index:
+                    if key[0] == measurement and now - self.forecast_issue_index[key][1] > self.forecast_ttl:
+                        refresh.add(key[1])
+                refresh = sorted(refresh)
+                latest_ts = self.query_last_ts_influx(uuids=refresh, measurement=measurement, lookback='63m')
+                missing = [uuid for uuid in refresh if uuid not in latest_ts]
+                if missing:
+                    latest_ts.update(self.query_last_ts_influx(uuids=missing, measurement=measurement,
+                                                               lookback='{0}s'.format(int(self.forecast_max_age))))
+                for uuid in refresh:
+                    if uuid in latest_ts:
+                        self.forecast_issue_index[(measurement, uuid)] = (latest_ts[uuid], now)
+                    else:
+                        self.forecast_issue_index.pop((measurement, uuid), None)
+            return dict((uuid, self.forecast_issue_index[(measurement, uuid)][0]) for uuid in uuids
+                        if (measurement, uuid) in self.forecast_issue_index)
+
+    def query_last_ts_influx(self, uuids, measurement='timeseries', lookback='63m'):
+        '''Query influx forecast table to retrieve the timestamp of the latest forecast of several uuids
+
+         Parameters
+            ----------
+            uuids: list
+                uuids of the variables we're interested in
+            measurement: str
+                measurement to find the latest forecast from. default measurement = timeseries
+            lookback: str
+                influxdb duration before now in which the forecasts are searched
+
+            Returns
+            -------
+            ts: dict
+                latest timestamp when the forecasts came in, for each uuid with a forecast in the lookback
+        '''
+        uuid_filter = " or ".join("\"uuid\"=\'%s\'" % uuid for uuid in uuids)
+        dfs = self.split_influx_result_by_uuid(self.influx_client.query(
+            "select last(value), time from %s where (%s) and time > now() - %s group by \"uuid\"" % (measurement, uuid_filter, lookback)))
+        return dict((uuid, dfs[uuid].index.values[0].astype('uint64')) for uuid in dfs)
 
     def get_timeseries_from_config(self, config, start_time=None, end_time=None, forecast=False):
         '''From the configuration dictionary, get a DataFrame of all the variables in the variable map
@@ -275,6 +768,25 @@ class Data_Manager():
         df_list = []
         column_names = []
 
+        # Query the influxdb variables with the same measurement, window and aggregation together
+        influx_dfs = {}
+        if self.influx_cache is not None:
+            self.influx_cache.prune()
+        if self.influx_batch:
+            groups = {}
+            for variable in variables:
+                variable_cfg = variables[variable]
+                if variable_cfg.get("type", section_type) == "influxdb":
+                    group = (variable_cfg.get('measurement', 'timeseries'), variable_cfg.get('window', '5m'), variable_cfg.get('agg', 'mean'))
+                    groups.setdefault(group, []).append(variable_cfg.get('uuid'))
+            for group in groups:
+                measurement, window, agg = group
+                dfs = self.get_batch_data_from_influx(uuids=groups[group], measurement=measurement, start_time=start_time,
+                                                      end_time=end_time, window=window, agg=agg, forecast=forecast,
+                                                      config_name=config)
+                for uuid in dfs:
+                    influx_dfs[group + (uuid,)] = dfs[uuid]
+
         for variable in variables:
             variable_cfg = variables[variable]
             source_type = variable_cfg.get("type", section_type)
@@ -285,9 +797,21 @@ class Data_Manager():
                 tz = variable_cfg.get('tz', 'America/Los_Angeles')
                 agg = variable_cfg.get('agg', 'mean')
                 window = variable_cfg.get('window', '5m')
+                rotate = variable_cfg.get('rotate', None)
 
                 df = self.get_single_data_from_csv(filename=filename, column_name=column_name, start_time=start_time,
-                                                   end_time=end_time, tz=tz, agg=agg, window=window, config_name=config)
+                                                   end_time=end_time, tz=tz, agg=agg, window=window, config_name=config,
+                                                   rotate=rotate)
+                df_list.append(df)
+                column_names.append(variable)
+            elif source_type == "parquet":
+                filename = variable_cfg.get('filename')
+                column_name = variable_cfg.get('column')
+                agg = variable_cfg.get('agg', 'mean')
+                window = variable_cfg.get('window', '5m')
+
+                df = self.get_single_data_from_parquet(filename=filename, column_name=column_name, start_time=start_time,
+                                                       end_time=end_time, agg=agg, window=window, config_name=config)
                 df_list.append(df)
                 column_names.append(variable)
             elif source_type == "influxdb":
@@ -296,9 +820,12 @@ class Data_Manager():
                 agg = variable_cfg.get('agg', 'mean')
                 measurement = variable_cfg.get('measurement', 'timeseries')
 
-                df = self.get_single_data_from_influx(uuid=uuid, measurement=measurement, start_time=start_time,
-                                                      end_time=end_time, window=window, agg=agg, forecast=forecast,
-                                                      config_name=config)
+                if (measurement, window, agg, uuid) in influx_dfs:
+                    df = influx_dfs[(measurement, window, agg, uuid)]
+                else:
+                    df = self.get_single_data_from_influx(uuid=uuid, measurement=measurement, start_time=start_time,
+                                                          end_time=end_time, window=window, agg=agg, forecast=forecast,
+                                                          config_name=config)
                 df_list.append(df)
                 column_names.append(variable)
 
@@ -333,6 +860,52 @@ class Data_Manager():
         df = self.get_timeseries_from_config(config=config, start_time=start_time, end_time=end_time, forecast=forecast)
         return df
 
+    def prepare_cycle_data(self, requests, max_workers=None):
+        '''Get the data of several config sections concurrently
+
+            The sections are fetched in a thread pool, so that the time taken is that of the
+            slowest section instead of the sum of all sections.  The time of each fetch is
+            added to the timer as phase fetch_<section>.
+
+            Parameters
+            ----------
+            requests: dict
+                (start_time, end_time) in UTC keyed by section name in config file
+            max_workers: int
+                maximum number of threads, one per section if None
+
+            Returns
+            -------
+            data: dict
+                DataFrame of each section, as returned by get_data_from_config
+        '''
+        sections = sorted(requests)
+        if len(sections) == 0:
+            return {}
+
+        def fetch(section):
+            fetch_start = time.time()
+            try:
+                df = self.get_data_from_config(section, start_time=requests[section][0], end_time=requests[section][1])
+            except Exception as e:
+                return section, None, e, time.time() - fetch_start
+            return section, df, None, time.time() - fetch_start
+
+        pool = ThreadPool(processes=min(max_workers or len(sections), len(sections)))
+        try:
+            results = pool.map(fetch, sections)
+        finally:
+            pool.close()
+            pool.join()
+
+        data = {}
+        for section, df, error, duration in results:
+            self.timer.add('fetch_{0}'.format(section), duration)
+            if error is not None:
+                raise error
+            data[section] = df
+        return data
+
     def init_data_from_config(self, config):
         '''Get config file from mpc and retrieve required variables
 
@@ -351,8 +924,11 @@ class Data_Manager():
         variables = list(section_config["variables"].keys())
         return pd.DataFrame(columns=variables)
 
-    def write_df_to_csv(self, df, filename, overwrite=True):
-        '''Write df to csv: if file exists, append; else create new file
+    def write_df_to_csv(self, df, filename, overwrite=True, rotate=None):
+        '''Write df to csv: if overwrite is False and the file exists, append; else create new file
+
+            Appending only writes the new rows.  Rows with timestamps already in the file are kept,
+            and dropped when the file is read with read_csv_cached, which keeps the last row.
 
             Parameters
             ----------
@@ -360,25 +936,67 @@ class Data_Manager():
                 DataFrame, whose each column has to be written to csv
             filename: str
                 path and name of the csv file the df is written to
+            overwrite: bool
+                True to replace the file, False to append to it
+            rotate: str
+                'daily' to write the rows of each UTC day to their own file, see get_rotated_filename,
+                None to write all rows to filename
 
             Returns
             -------
             None
 
         '''
-        if not overwrite:
-            if os.path.exists(filename):
+        if rotate == 'daily':
+            days = pd.DatetimeIndex(df.index).strftime('%Y%m%d')
+            for day in sorted(set(days)):
+                self.write_df_to_csv(df=df[days == day], filename=self.get_rotated_filename(filename, day),
+                                     overwrite=overwrite)
+            return
+        elif rotate is not None:
+            raise ValueError('Rotation "%s" unknown, use "daily" or None' % rotate)
+
+        if not overwrite and os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'r') as f:
+                header = next(csv.reader(f))
+            columns = [str(column) for column in df.columns]
+            if set(columns).issubset(header[1:]):
+                # Same columns as the file: only write the new rows, in the order of the header
+                df = df.copy()
+                df.columns = columns
+                df.reindex(columns=header[1:]).to_csv(filename, mode='a', header=False)
+            else:
+                # New columns: rewrite the file with the union of the columns
                 existing_df = pd.read_csv(filename, index_col=0, parse_dates=True).tz_localize(self.tz_utc)
                 new_df = pd.concat([existing_df, df], axis=0)
                 new_df.to_csv(filename)
-            else:
-                df.to_csv(filename)
         else:
             df.to_csv(filename)
 
+    def get_rotated_filename(self, filename, day):
+        '''Get the name of the file of one day of a daily rotated csv file
+
+            Parameters
+            ----------
+            filename: str
+                path and name of the csv file, e.g. Shadow/setpoints.csv
+            day: str
+                day in the format YYYYMMDD
+
+            Returns
+            -------
+            filename: str
+                path and name of the file of the day, e.g. Shadow/setpoints_20200101.csv
+        '''
+        base, ext = os.path.splitext(filename)
+        return '%s_%s%s' % (base, day, ext)
+
     def write_df_to_influx(self, df, influx_dataframe_client, measurement):
         '''Write df to influx: overwrites if timestamp already exists for each column
 
+            Points are sent in requests of influx_write_batch_size points.  If influx_writer is set,
+            the write is queued on its background thread and this method returns right away.
+
             Parameters
             ----------
             df: DataFrame
@@ -393,143 +1011,153 @@ class Data_Manager():
             None
 
         '''
-        df.index.name = 'time'
-        df_to_send = []
-        for col in df.columns:
-            df2 = df[[col]]
-            df2.columns = ['value']
-            df2['name'] = col
-            df2 = df2.dropna()
-            df2['value'] = df2['value'].astype(float)
-            df_to_send.append(df2)
-        df = pd.concat(df_to_send, axis=0)
-        influx_dataframe_client.write_points(dataframe=df, measurement=measurement, tag_columns=['name'],
-                                        field_columns=['value'])
+        df = self.to_influx_format(df)
+        if self.influx_writer is not None:
+            self.influx_writer.put(influx_dataframe_client, df, measurement, batch_size=self.influx_write_batch_size)
+        else:
+            influx_dataframe_client.write_points(dataframe=df, measurement=measurement, tag_columns=['name'],
+                                                 field_columns=['value'], batch_size=self.influx_write_batch_size)
+
+    def to_influx_format(self, df):
+        '''Convert df to the long format written to influx, with one row per time and column
+
+            Parameters
+            ----------
+            df: DataFrame
+                DataFrame with a time index
+
+            Returns
+            -------
+            df: DataFrame
+                DataFrame with the index time and the columns value and name, without missing values
+        '''
+        stacked = df.stack(dropna=True)
+        long_df = pd.DataFrame({'value': stacked.values.astype(float),
+                                'name': stacked.index.get_level_values(1).astype(str)},
+                               index=stacked.index.get_level_values(0), columns=['value', 'name'])
+        long_df.index.name = 'time'
+        return long_df
+
+    def connect_wavemq(self):
+        '''Create the grpc channel to wavemq, closing the previous one
+
+            Returns
+            -------
+            None
+        '''
+        if self.wavemq_channel is not None:
+            self.wavemq_channel.close()
+        self.wavemq_channel = insecure_channel(self.wavemq)
+        self.xbos_client = WAVEMQStub(self.wavemq_channel)
 
     def publish_on_wavemq(self, uri, *msgs):
         """publishes msgs in list as payload objects"""
-        pos = []
-        for msg in msgs:
-            pos.append(PayloadObject(
-                schema = self.xbos_schema,
-                content = msg.SerializeToString(),
-                ))
+        return self.publish_all_on_wavemq({uri: msgs})[uri]
 
-        try:
-            x = self.xbos_client.Publish(PublishParams(
-                perspective=self.perspective,
-                namespace=self.namespace,
-                uri = uri,
-                content = pos,
-                persist=True
-                ))
-            if not x:
-                print("Error publishing: {0}".format(x))
+    def publish_all_on_wavemq(self, uri_msgs):
+        '''Publish the messages of several uris concurrently over the wavemq channel
+
+            Each publish waits at most xbos_cfg["publish_timeout"] seconds (default 10) for its acknowledgement.
+            Publishes that fail with a grpc error are retried xbos_cfg["publish_retries"] times (default 1)
+            on a new channel.  Other errors are recorded in the summary of their uri without retry, so that
+            no error of one device stops the publishing of the others or the control run.
+
+            Parameters
+            ----------
+            uri_msgs: dict
+                list of messages keyed by uri
+
+            Returns
+            -------
+            summary: dict
+                for each uri, 'acknowledged' (bool), 'seconds' to the acknowledgement or error of the last
+                attempt, number of 'attempts' and 'error' (None if acknowledged)
+        '''
+        summary = {}
+        pending = list(uri_msgs.keys())
+        for attempt in range(1, self.xbos_retries + 2):
+            futures = {}
+            done_times = {}
+            errors = {}
+            start = time.time()
+            for uri in pending:
+                try:
+                    content = [PayloadObject(schema=self.xbos_schema, content=msg.SerializeToString()) for msg in uri_msgs[uri]]
+                    params = PublishParams(perspective=self.perspective, namespace=self.namespace, uri=uri,
+                                           content=content, persist=True)
+                    futures[uri] = self.xbos_client.Publish.future(params, timeout=self.xbos_timeout)
+                    futures[uri].add_done_callback(lambda future, uri=uri: done_times.__setitem__(uri, time.time()))
+                except Exception as e:
+                    errors[uri] = str(e)
+
+            failed = []
+            for uri in pending:
+                if uri in errors:
+                    # Not sent, a new channel would not help
+                    error = errors[uri]
+                else:
+                    try:
+                        response = futures[uri].result()
+                        error = response.error.message if response.HasField('error') else None
+                    except grpc.RpcError as e:
+                        error = "%s: %s" % (e.code(), e.details())
+                        failed.append(uri)
+                    except Exception as e:
+                        error = str(e)
+                summary[uri] = {'acknowledged': error is None,
+                                'seconds': done_times.get(uri, time.time()) - start,
+                                'attempts': attempt,
+                                'error': error}
+
+            if not failed or attempt > self.xbos_retries:
+                break
+            print("Error publishing on wavemq to %s, reconnecting" % (", ".join(failed)))
+            try:
+                self.connect_wavemq()
+            except Exception as e:
+                for uri in failed:
+                    summary[uri]['error'] = "%s; reconnecting failed: %s" % (summary[uri]['error'], str(e))
+                break
+            pending = failed
+
+        for uri in summary:
+            if summary[uri]['acknowledged']:
+                print("published on wavemq to topic %s in %.2f s" % (uri, summary[uri]['seconds']))
             else:
-                print("published on wavemq")
-        except Exception as e:
-            print("Error publishing: {0}".format(e))
+                print("Error publishing on wavemq to topic %s: %s" % (uri, summary[uri]['error']))
+        return summary
 
     def set_setpoints_xbos(self, df, device_config):
-        df = df.dropna()
-        for device in device_config:
-            var_cfg = device_config[device]
-
-            relevant_df_cols = []
-            relevant_new_col_names = []
-            for variable in var_cfg:
-                df_var_name = var_cfg[variable]
-                relevant_df_cols.append(df_var_name)
-                relevant_new_col_names.append(variable)
-
-            device_df = df[relevant_df_cols]
-            device_df.columns = relevant_new_col_names
-
-            # df.columns = [cols[col] if col in cols.keys() else col for col in df.columns]
-
-            setpoint_list = []
-            if device.startswith("flexstat"):
-                for index, row in device_df.iterrows():
-                    change_time = int(index.value)
-                    hsp = row.get('heating_setpoint', None)
-                    csp = row.get('cooling_setpoint', None)
-
-                    if hsp != None and csp != None:
-                        setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                                  heating_setpoint=types.Double(value=hsp),
-                                                                  cooling_setpoint=types.Double(value=csp))
-                    elif hsp!=None:
-                        setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                                  heating_setpoint=types.Double(value=hsp))
-                    elif csp!=None:
-                        setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                                  cooling_setpoint=types.Double(value=csp))
-                    else:
-                        setpoint = None
-
-                    if setpoint != None:
-                        setpoint_list.append(setpoint)
-                msg = xbos_pb2.XBOS(
-                    flexstat_actuation_message=flexstat_pb2.FlexstatActuationMessage(
-                        time=int(time.time() * 1e9),
-                        setpoints = setpoint_list
-                    )
-                )
-            elif device.startswith("parker"):
-                for index, row in device_df.iterrows():
-                    change_time = int(index.value)
-                    device_setpoint = row.get('setpoint', None)
-                    differential = row.get('differential', None)
-
-                    if device_setpoint != None and differential!=None:
-                        setpoint = parker_pb2.ParkerSetpoints(change_time=change_time,
-                                                              setpoint=types.Double(value=device_setpoint),
-                                                              differential=types.Double(value=differential))
-                    elif device_setpoint!=None:
-                        setpoint = parker_pb2.ParkerSetpoints(change_time=change_time,
-                                                              setpoint=types.Double(value=device_setpoint))
-                    elif differential!=None:
-                        setpoint = parker_pb2.ParkerSetpoints(change_time=change_time,
-                                                              differential=types.Double(value=differential))
-                    else:
-                        setpoint=None
-
-                    if setpoint != None:
-                        setpoint_list.append(setpoint)
-
-                msg = xbos_pb2.XBOS(
-                    parker_actuation_message=parker_pb2.ParkerActuationMessage(
-                        time=int(time.time() * 1e9),
-                        setpoints = setpoint_list
-                    )
-                )
-            elif device.startswith("emulated_battery"):
-                for index, row in device_df.iterrows():
-                    change_time = int(index.value)
-                    real_power_setpoint = row.get('real_power_setpoint', None)
-
-                    if real_power_setpoint != None:
-                        setpoint = rtac_pb2.RtacSetpoints(change_time=change_time,
-                                                      real_power_setpoint=types.Double(value=real_power_setpoint))
-                        setpoint_list.append(setpoint)
-
-                if len(setpoint_list) > 0:
-                    msg = xbos_pb2.XBOS(
-                        rtac_actuation_message=rtac_pb2.RtacActuationMessage(
-                            time=int(time.time() * 1e9),
-                            setpoints = setpoint_list
-                        )
-                    )
-            print("publishing on to wavemq to topic %s"%(device))
-            self.publish_on_wavemq(device, msg)
-
-    def set_setpoints(self, df, overwrite=True):
+        '''Publish the setpoints of each device in device_config on wavemq
+
+            Parameters
+            ----------
+            df: DataFrame
+                DataFrame of setpoints with a time index
+            device_config: dict
+                setpoint fields of each device topic, mapped to columns of df
+
+            Returns
+            -------
+            None, the acknowledgement of each device is kept in publish_summary, see publish_all_on_wavemq
+
+        '''
+        msgs = build_messages(df, device_config)
+        print("publishing on to wavemq to topics %s"%(", ".join(msgs)))
+        self.publish_summary = self.publish_all_on_wavemq(dict((device, [msgs[device]]) for device in msgs))
+
+    def set_setpoints(self, df, overwrite=True, sink=None):
         '''Set following variables: uCharge, uDischarge, Trtu, Tref, Tfre, Trtu_cool, Trtu_heat
 
             Parameters
             ----------
             df: DataFrame
                 DataFrame, whose each column has to be written to a settings.csv
+            overwrite: bool
+                True to replace the csv file, False to append to it
+            sink: dict
+                setpoints sink configuration to use instead of data_sink["setpoints"],
+                e.g. for a controller running in shadow
 
             Returns
             -------
@@ -537,16 +1165,20 @@ class Data_Manager():
 
         '''
         #TODO: include push to devices when ready
-        for source_type in self.data_sink["setpoints"]["type"].split('|'):
-            if source_type == "csv":
-                filename = self.data_path + self.data_sink["setpoints"]["filename"]
-                self.write_df_to_csv(df=df, filename=filename, overwrite=overwrite)
-            elif source_type == "influxdb":
-                measurement = self.data_sink["setpoints"]["measurement"]
-                self.write_df_to_influx(df=df, influx_dataframe_client=self.influx_client, measurement=measurement)
-            elif source_type == "xbos":
-                device_config = self.data_sink["setpoints"]["devices"]
-                self.set_setpoints_xbos(df=df, device_config=device_config)
+        if sink is None:
+            sink = self.data_sink["setpoints"]
+        for source_type in sink["type"].split('|'):
+            with self.timer.phase('sink_{0}'.format(source_type)):
+                if source_type == "csv":
+                    filename = self.data_path + sink["filename"]
+                    self.write_df_to_csv(df=df, filename=filename, overwrite=overwrite,
+                                         rotate=sink.get("rotate", None))
+                elif source_type == "influxdb":
+                    measurement = sink["measurement"]
+                    self.write_df_to_influx(df=df, influx_dataframe_client=self.influx_client, measurement=measurement)
+                elif source_type == "xbos":
+                    device_config = sink["devices"]
+                    self.set_setpoints_xbos(df=df, device_config=device_config)
 
     def set_data(self, df):
         '''Set one or more columns in the dataframe to corresponding destinations in data_sink
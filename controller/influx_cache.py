@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the influx cache, a local sqlite database in front
+of InfluxDB that keeps the timeseries and forecasts already queried, so
+that the data manager only queries what changed since the last cycle.
+
+Timeseries are kept per uuid, measurement, aggregation and window,
+together with the time range they cover.  Forecasts are kept per uuid
+and measurement by the time they were issued, since an issued forecast
+does not change.  Entries older than the retention are dropped.
+
+"""
+
+import sqlite3
+import threading
+import time
+import os
+import numpy as np
+import pandas as pd
+
+class Influx_Cache(object):
+    '''Local cache of InfluxDB query results.
+
+    Parameters
+    ----------
+    path : str
+        Path of the sqlite database file.  The folder is created if needed.
+    retention : float, optional
+        Time in seconds after which cached data are dropped.
+        Default is 7 days.
+    overlap : float, optional
+        Time in seconds before the end of the cached range that is queried
+        again, to pick up late data and the last, incomplete window.
+        It is at least one aggregation window.
+        Default is 0.
+    prune_interval : float, optional
+        Minimum time in seconds between two removals of old data.
+        Default is one hour.
+    '''
+
+    def __init__(self, path, retention=7*24*3600, overlap=0, prune_interval=3600):
+        '''Constructor.
+
+        '''
+        self.path = path
+        self.retention = retention
+        self.overlap = overlap
+        self.prune_interval = prune_interval
+        self.last_prune = None
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        # One connection shared by the threads of the data manager
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock:
+            self.connection.executescript('''
+                create table if not exists series (
+                    uuid text, measurement text, agg text, window text, time integer, value real,
+                    primary key (uuid, measurement, agg, window, time));
+                create table if not exists coverage (
+                    uuid text, measurement text, agg text, window text, start integer, final integer,
+                    primary key (uuid, measurement, agg, window));
+                create table if not exists forecasts (
+                    uuid text, measurement text, issue_time integer, prediction_time real, value real);
+                create index if not exists forecasts_issue on forecasts (uuid, measurement, issue_time);
+                ''')
+            self.connection.commit()
+
+    def get_fetch_start(self, uuid, measurement, agg, window, start_time, end_time):
+        '''Get the start time of the query needed to complete the cached timeseries.
+
+        Parameters
+        ----------
+        uuid : str
+            uuid of the variable.
+        measurement : str
+            InfluxDB measurement of the variable.
+        agg : str
+            Aggregation function of the query, 'raw' for none.
+        window : str
+            Aggregation window of the query, e.g. '5m'.
+        start_time : datetime in UTC
+            Start time of the requested timeseries.
+        end_time : datetime in UTC
+            End time of the requested timeseries.
+
+        Returns
+        -------
+        fetch_start : pandas datetime or None
+            Start time in UTC of the query, start_time if the cache does
+            not hold the start of the range, None if no query is needed.
+
+        '''
+
+        with self.lock:
+            row = self.connection.execute('select start, final from coverage where uuid=? and measurement=? and agg=? and window=?',
+                                          (uuid, measurement, agg, window)).fetchone()
+        start = self._to_ns(start_time)
+        end = self._to_ns(end_time)
+        if row is None or row[0] > start or row[1] < start:
+            return self._from_ns(start)
+        refetch = row[1] - self._get_overlap_ns(window)
+        if agg != 'raw':
+            # Start at a window boundary, so that the first window is complete
+            window_ns = pd.Timedelta(window.replace('m', 'T')).value
+            refetch = refetch - refetch % window_ns
+        if end <= refetch:
+            return None
+
+        return self._from_ns(max(start, refetch))
+
+    def put_series(self, uuid, measurement, agg, window, df, fetch_start, fetch_end):
+        '''Store the result of a query.
+
+        Parameters
+        ----------
+        uuid : str
+            uuid of the variable.
+        measurement : str
+            InfluxDB measurement of the variable.
+        agg : str
+            Aggregation function of the query, 'raw' for none.
+        window : str
+            Aggregation window of the query, e.g. '5m'.
+        df : DataFrame or None
+            Query result with a UTC time index and a 'value' column, None
+            if the query returned no data.
+        fetch_start : datetime in UTC
+            Start time of the query.
+        fetch_end : datetime in UTC
+            End time of the query.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        key = (uuid, measurement, agg, window)
+        start = self._to_ns(fetch_start)
+        end = self._to_ns(fetch_end)
+        rows = []
+        if df is not None and len(df) > 0:
+            times = self._index_to_ns(df.index)
+            values = df['value'].astype(float).values
+            rows = [key + (int(t), None if np.isnan(v) else float(v)) for t, v in zip(times, values)]
+        with self.lock:
+            row = self.connection.execute('select start, final from coverage where uuid=? and measurement=? and agg=? and window=?',
+                                          key).fetchone()
+            if row is None or row[1] < start or row[0] > end:
+                # Not contiguous with the cached range, start over
+                self.connection.execute('delete from series where uuid=? and measurement=? and agg=? and window=?', key)
+                coverage = (start, end)
+            else:
+                self.connection.execute('delete from series where uuid=? and measurement=? and agg=? and window=? and time>=? and time<=?',
+                                        key + (start, end))
+                coverage = (min(row[0], start), max(row[1], end))
+            self.connection.executemany('insert or replace into series values (?, ?, ?, ?, ?, ?)', rows)
+            self.connection.execute('insert or replace into coverage values (?, ?, ?, ?, ?, ?)', key + coverage)
+            self.connection.commit()
+
+        return None
+
+    def get_series(self, uuid, measurement, agg, window, start_time, end_time):
+        '''Get a cached timeseries.
+
+        Parameters
+        ----------
+        uuid : str
+            uuid of the variable.
+        measurement : str
+            InfluxDB measurement of the variable.
+        agg : str
+            Aggregation function of the query, 'raw' for none.
+        window : str
+            Aggregation window of the query, e.g. '5m'.
+        start_time : datetime in UTC
+            Start time of the timeseries.
+        end_time : datetime in UTC
+            End time of the timeseries.
+
+        Returns
+        -------
+        df : DataFrame or None
+            Timeseries with a UTC time index and a 'value' column, as
+            returned by InfluxDB.  None if there are no data.
+
+        '''
+
+        with self.lock:
+            rows = self.connection.execute('select time, value from series where uuid=? and measurement=? and agg=? and window=? and time>=? and time<=? order by time',
+                                           (uuid, measurement, agg, window, self._to_ns(start_time), self._to_ns(end_time))).fetchall()
+        if len(rows) == 0:
+            return None
+        df = pd.DataFrame({'value': [np.nan if row[1] is None else row[1] for row in rows]},
+                          index=pd.to_datetime([row[0] for row in rows]).tz_localize('UTC'))
+
+        return df
+
+    def get_forecast(self, uuid, measurement, issue_time):
+        '''Get a cached forecast.
+
+        Parameters
+        ----------
+        uuid : str
+            uuid of the variable.
+        measurement : str
+            InfluxDB measurement of the forecast.
+        issue_time : int
+            Time in ns since epoch the forecast was issued.
+
+        Returns
+        -------
+        df : DataFrame or None
+            Forecast with the columns 'prediction_time' and 'value', as
+            returned by InfluxDB.  None if the forecast is not cached.
+
+        '''
+
+        with self.lock:
+            rows = self.connection.execute('select prediction_time, value from forecasts where uuid=? and measurement=? and issue_time=?',
+                                           (uuid, measurement, int(issue_time))).fetchall()
+        if len(rows) == 0:
+            return None
+        index = pd.to_datetime([int(issue_time)]*len(rows)).tz_localize('UTC')
+        df = pd.DataFrame({'prediction_time': [row[0] for row in rows],
+                           'value': [np.nan if row[1] is None else row[1] for row in rows]},
+                          index=index, columns=['prediction_time', 'value'])
+
+        return df
+
+    def put_forecast(self, uuid, measurement, issue_time, df):
+        '''Store a forecast.
+
+        Parameters
+        ----------
+        uuid : str
+            uuid of the variable.
+        measurement : str
+            InfluxDB measurement of the forecast.
+        issue_time : int
+            Time in ns since epoch the forecast was issued.
+        df : DataFrame
+            Forecast with the columns 'prediction_time' and 'value'.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        rows = [(uuid, measurement, int(issue_time), float(p), None if pd.isnull(v) else float(v))
+                for p, v in zip(df['prediction_time'].values, df['value'].values)]
+        with self.lock:
+            self.connection.execute('delete from forecasts where uuid=? and measurement=? and issue_time=?',
+                                    (uuid, measurement, int(issue_time)))
+            self.connection.executemany('insert into forecasts values (?, ?, ?, ?, ?)', rows)
+            self.connection.commit()
+
+        return None
+
+    def prune(self, now=None, force=False):
+        '''Drop the data older than the retention.
+
+        Only runs if the last removal is older than prune_interval, unless
+        forced.
+
+        Parameters
+        ----------
+        now : float, optional
+            Current time in seconds since epoch.
+            Default is the time of the computer clock.
+        force : bool, optional
+            True to drop the old data regardless of prune_interval.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        if now is None:
+            now = time.time()
+        if not force and self.last_prune is not None and now - self.last_prune < self.prune_interval:
+            return None
+        cutoff = int((now - self.retention) * 1e9)
+        with self.lock:
+            self.connection.execute('delete from series where time<?', (cutoff,))
+            self.connection.execute('delete from forecasts where issue_time<?', (cutoff,))
+            self.connection.execute('delete from coverage where final<?', (cutoff,))
+            self.connection.execute('update coverage set start=? where start<?', (cutoff, cutoff))
+            self.connection.commit()
+        self.last_prune = now
+
+        return None
+
+    def _get_overlap_ns(self, window):
+        '''Get the overlap of a query in ns, at least one aggregation window.
+
+        '''
+
+        window_ns = pd.Timedelta(window.replace('m', 'T')).value
+
+        return max(window_ns, int(self.overlap * 1e9))
+
+    def _to_ns(self, time):
+        '''Convert a time, UTC if naive, to ns since epoch.
+
+        '''
+
+        time = pd.Timestamp(time)
+        if time.tzinfo is not None:
+            time = time.tz_convert('UTC').tz_localize(None)
+
+        return int(time.value)
+
+    def _from_ns(self, value):
+        '''Convert ns since epoch to a UTC pandas datetime.
+
+        '''
+
+        return pd.Timestamp(value).tz_localize('UTC')
+
+    def _index_to_ns(self, index):
+        '''Convert a time index, UTC if naive, to ns since epoch.
+
+        '''
+
+        index = pd.DatetimeIndex(index)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+
+        return index.asi8
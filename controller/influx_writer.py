@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the background influx writer, which writes frames
+to InfluxDB from a worker thread, so that a slow database does not hold
+up the control loop.
+
+Writes wait in a bounded queue.  When the queue is full, the oldest
+write is dropped.  Failed writes are retried with an increasing delay.
+
+"""
+
+import atexit
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class Influx_Writer(object):
+    '''Write frames to InfluxDB from a background thread.
+
+    Parameters
+    ----------
+    max_queue : int, optional
+        Maximum number of writes waiting in the queue.
+        Default is 100.
+    retries : int, optional
+        Number of times a failed write is retried.
+        Default is 3.
+    retry_delay : float, optional
+        Delay in seconds before the first retry, doubled for each retry.
+        Default is 1.
+    '''
+
+    def __init__(self, max_queue=100, retries=3, retry_delay=1.):
+        '''Constructor.
+
+        '''
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name='influx_writer')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, influx_dataframe_client, df, measurement, batch_size=None):
+        '''Queue a write.
+
+        Parameters
+        ----------
+        influx_dataframe_client : influxdb.DataFrameClient
+            Client to write with.
+        df : DataFrame
+            Frame in the long format of Data_Manager.to_influx_format.
+        measurement : str
+            Name of the measurement to store the values.
+        batch_size : int, optional
+            Number of points per request, all at once if None.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        item = (influx_dataframe_client, df, measurement, batch_size)
+        while True:
+            try:
+                self.queue.put(item, block=False)
+                return None
+            except queue.Full:
+                # Keep the most recent data
+                try:
+                    self.queue.get(block=False)
+                    self.queue.task_done()
+                    self.dropped += 1
+                    print('Influx write queue full, dropped the oldest write.')
+                except queue.Empty:
+                    pass
+
+    def flush(self, timeout=None):
+        '''Wait until the queued writes are done.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time in seconds to wait, no limit if None.
+
+        Returns
+        -------
+        done : bool
+            True if the queue is empty.
+
+        '''
+
+        start = time.time()
+        while self.queue.unfinished_tasks > 0:
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(0.05)
+
+        return True
+
+    def close(self, timeout=10.):
+        '''Wait a limited time for the queued writes at exit.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        if not self.flush(timeout=timeout):
+            print('Influx writer stopped with {0} writes pending.'.format(self.queue.unfinished_tasks))
+
+        return None
+
+    def _run(self):
+        '''Write the queued frames.
+
+        '''
+
+        while True:
+            influx_dataframe_client, df, measurement, batch_size = self.queue.get()
+            try:
+                delay = self.retry_delay
+                for attempt in range(self.retries + 1):
+                    try:
+                        influx_dataframe_client.write_points(dataframe=df, measurement=measurement, tag_columns=['name'],
+                                                             field_columns=['value'], batch_size=batch_size)
+                        break
+                    except Exception as e:
+                        if attempt == self.retries:
+                            self.failed += 1
+                            print('Influx write to {0} failed after {1} retries, error={2}'.format(measurement, self.retries, str(e)))
+                        else:
+                            time.sleep(delay)
+                            delay = delay * 2
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a linear program of the store optimization problem,
+which can be solved in-process as a fast alternative to the JModelica
+optimization of SolarPlus.Building.Optimization.Store.
+
+The zones, refrigerator and freezer are R1C1 models discretized with
+backward Euler steps, the battery is an integrator of its power and the
+PV generation and power balance are linear in the inputs.  The quadratic
+comfort penalties of the Modelica objective are replaced by the
+constraints of the problem, softened with slack variables whose cost is
+scaled to the objective, so that they are only violated when the bounds
+cannot be met.
+
+"""
+
+import time
+import pandas as pd
+import numpy as np
+
+try:
+    from scipy import sparse
+    from scipy.optimize import linprog
+except ImportError:
+    print("not importing scipy packages")
+
+# Parameters not estimated in models/pars_thermal.csv, from the Modelica model
+default_parameters = {'Ecap': 145800000.,
+                      'P_cap': 21000.,
+                      'A_pv': 272.6,
+                      'eff_pv': 0.26,
+                      'effDcAc_pv': 0.98,
+                      'A_win': 33*0.5,
+                      'Qint': 25000.,
+                      'Qint_west_fraction': 0.45,
+                      'Pload': 0.,
+                      'SOC_0': 0.5}
+
+controls = ['uCool', 'uHeat', 'uRef', 'uFreCool', 'uBattery']
+states = ['Trtu_west', 'Trtu_east', 'Tref', 'Tfre', 'E']
+control_bounds = {'uCool': (0, 1),
+                  'uHeat': (0, 1),
+                  'uRef': (0, 1),
+                  'uFreCool': (0, 1),
+                  'uBattery': (-1, 1)}
+
+def load_parameters(csvpath):
+    '''Load the thermal parameters estimated for the Modelica model.
+
+    Parameters
+    ----------
+    csvpath : str
+        Path to a parameter file such as models/pars_thermal.csv, with
+        the columns Name and Value.
+
+    Returns
+    -------
+    parameters : dict
+        Parameter values, with the 'thermal.' prefix removed from the names.
+
+    '''
+    df = pd.read_csv(csvpath)
+    parameters = dict()
+    for name, value in zip(df['Name'], df['Value']):
+        parameters[name.split('.')[-1]] = float(value)
+
+    return parameters
+
+class Linear_Store(object):
+    '''Linear program of the store optimization problem.
+
+    Parameters
+    ----------
+    parameters : dict
+        Model parameters, see load_parameters.  Missing battery, PV and
+        internal gain parameters are taken from default_parameters.
+    objective : str, optional
+        'EnergyMin', 'EnergyCostMin' or 'EnergyPlusDemandCostMin'.
+        Default is 'EnergyCostMin'.
+    step : int, optional
+        Time step of the discretization in seconds.
+        Default is 300.
+    slack_penalty : float, optional
+        Cost per unit of state or power constraint violation and per step,
+        relative to the cost of running all equipment at full power for
+        one step, see get_slack_cost.  The penalty is thereby in the units
+        of the objective, J or $.
+        Default is 1e3.
+    method : str, optional
+        Method of scipy.optimize.linprog.
+        Default is 'highs' if available, otherwise 'interior-point'.
+    '''
+
+    def __init__(self, parameters, objective='EnergyCostMin', step=300, slack_penalty=1e3, method=None):
+        '''Constructor.
+
+        '''
+        self.parameters = dict(default_parameters)
+        self.parameters.update(parameters)
+        if objective not in ['EnergyMin', 'EnergyCostMin', 'EnergyPlusDemandCostMin']:
+            raise ValueError('Objective "{0}" unknown or not available.'.format(objective))
+        self.objective = objective
+        self.step = step
+        self.slack_penalty = slack_penalty
+        self.method = method
+        self.Ac, self.Bc = self._get_continuous_model()
+        self.power_coefficients = self._get_power_coefficients()
+
+    def optimize(self, start_time, final_time, initial_state, weather, price=None, constraints=None):
+        '''Solve the optimization problem.
+
+        All data is in base units: K, W, W/m2, $/J and $/W.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+        initial_state : dict
+            Initial values of 'Trtu_west', 'Trtu_east', 'Tref', 'Tfre' and
+            'SOC'.  'Trtu' sets both RTU zones.  Missing states are taken
+            from the '<state>_0' parameters.
+        weather : DataFrame
+            Columns 'Tout', 'poa_pv' and 'poa_win'.
+        price : DataFrame, optional
+            Columns 'pi_e' and, for demand charges, 'pi_d'.
+        constraints : dict, optional
+            {variable : {'GTE' : Series, 'LTE' : Series}} bounds on
+            controls, states, 'SOC', 'Trtu' or 'Pnet'.
+
+        Returns
+        -------
+        results : DataFrame
+            Controls, states and power outputs over the horizon.
+        statistics : dict
+            Statistics of the solver with keys 'status', 'iterations',
+            'objective' and 'solve_time'.
+
+        '''
+        index = pd.date_range(start_time, final_time, freq='{0}s'.format(self.step))
+        n = len(index) - 1
+        dt = float(self.step)
+        p = self.parameters
+        weather = self._resample(weather, index)
+        if price is not None:
+            price = self._resample(price, index)
+        x0 = self._get_initial_state(initial_state)
+        # Disturbances and PV generation at the end of each step
+        Tout = weather['Tout'].values
+        Ppv = p['A_pv'] * p['eff_pv'] * p['effDcAc_pv'] * np.maximum(weather['poa_pv'].values, 0)
+        Qsol = p['A_win'] * np.maximum(weather['poa_win'].values, 0)
+        Qint_west = p['Qint'] * p['Qint_west_fraction']
+        Qint_east = p['Qint'] * (1 - p['Qint_west_fraction'])
+        dc = np.zeros((n + 1, len(states)))
+        dc[:, 0] = (Tout / p['Rrtu_west'] + Qsol + Qint_west) / p['Crtu_west']
+        dc[:, 1] = (Tout / p['Rrtu_east'] + Qsol + Qint_east) / p['Crtu_east']
+        p0 = p['Pload'] - Ppv
+        # Variables: controls u_k and states x_k+1 for each step, then slacks and peaks
+        nu = len(controls)
+        nx = len(states)
+        block = nu + nx
+        n_var = block * n
+        u_idx = lambda k, i: k * block + i
+        x_idx = lambda k, j: k * block + nu + j
+        # Dynamics: (I - dt*Ac) x_k+1 - dt*Bc u_k - x_k = dt*dc_k+1
+        M = np.eye(nx) - dt * self.Ac
+        rows, cols, vals, b_eq = [], [], [], []
+        for k in range(n):
+            for j in range(nx):
+                row = k * nx + j
+                for jj in range(nx):
+                    if M[j, jj] != 0:
+                        rows.append(row); cols.append(x_idx(k, jj)); vals.append(M[j, jj])
+                for i in range(nu):
+                    if self.Bc[j, i] != 0:
+                        rows.append(row); cols.append(u_idx(k, i)); vals.append(-dt * self.Bc[j, i])
+                rhs = dt * dc[k + 1, j]
+                if k == 0:
+                    rhs += x0[j]
+                else:
+                    rows.append(row); cols.append(x_idx(k - 1, j)); vals.append(-1.)
+                b_eq.append(rhs)
+        eq = (rows, cols, vals, b_eq)
+        # Bounds of controls
+        bounds = [(None, None)] * n_var
+        for k in range(n):
+            for i, name in enumerate(controls):
+                lb, ub = control_bounds[name]
+                if constraints and name in constraints:
+                    lb = max(lb, self._get_bound(constraints[name], 'GTE', index[k], lb))
+                    ub = min(ub, self._get_bound(constraints[name], 'LTE', index[k], ub))
+                bounds[u_idx(k, i)] = (lb, max(ub, lb))
+        # Soft bounds of states and net power
+        rows, cols, vals, b_ub = [], [], [], []
+        slack_bounds = []
+        def add_soft_bound(terms, constant, bound, sign):
+            # sign * (terms + constant) - slack <= sign * bound
+            slack = n_var + len(slack_bounds)
+            row = len(b_ub)
+            for col, val in terms:
+                rows.append(row); cols.append(col); vals.append(sign * val)
+            rows.append(row); cols.append(slack); vals.append(-1.)
+            b_ub.append(sign * (bound - constant))
+            slack_bounds.append((0, None))
+        for variable in (constraints or {}):
+            for constraint_type in constraints[variable]:
+                sign = -1. if constraint_type == 'GTE' else 1.
+                for k in range(n):
+                    terms, constant, t = self._get_terms(variable, k, u_idx, x_idx, p0)
+                    if terms is None:
+                        continue
+                    bound = self._get_bound(constraints[variable], constraint_type, index[t], None)
+                    if bound is None or np.isnan(bound):
+                        continue
+                    add_soft_bound(terms, constant, bound, sign)
+        n_slack = len(slack_bounds)
+        # Objective: energy (cost) of the net power over each step
+        c = np.zeros(n_var + n_slack)
+        if self.objective == 'EnergyMin' or price is None:
+            weight = np.ones(n + 1)
+        else:
+            weight = price['pi_e'].values
+        constant_cost = 0.
+        for k in range(n):
+            for i in range(nu):
+                c[u_idx(k, i)] += weight[k] * self.power_coefficients[i] * dt
+            constant_cost += weight[k] * p0[k] * dt
+        pi_d = None
+        if self.objective == 'EnergyPlusDemandCostMin' and price is not None:
+            pi_d = price['pi_d'].values[:n]
+        c[n_var:] = self.get_slack_cost(weight[:n], pi_d, dt)
+        # Demand charge on the peak net power of each demand price period
+        peak_bounds = []
+        if pi_d is not None:
+            periods = sorted(set(np.round(pi_d, 12)))
+            c = np.concatenate([c, np.array(periods)])
+            for g, period in enumerate(periods):
+                peak = n_var + n_slack + g
+                peak_bounds.append((0, None))
+                for k in np.where(np.round(pi_d, 12) == period)[0]:
+                    row = len(b_ub)
+                    for i in range(nu):
+                        rows.append(row); cols.append(u_idx(k, i)); vals.append(self.power_coefficients[i])
+                    rows.append(row); cols.append(peak); vals.append(-1.)
+                    b_ub.append(-p0[k])
+        n_total = len(c)
+        A_eq = sparse.coo_matrix((eq[2], (eq[0], eq[1])), shape=(len(eq[3]), n_total)).tocsr()
+        if len(b_ub) > 0:
+            A_ub = sparse.coo_matrix((vals, (rows, cols)), shape=(len(b_ub), n_total)).tocsr()
+            b_ub = np.array(b_ub)
+        else:
+            A_ub = None
+            b_ub = None
+        # Solve
+        method = self.method
+        if method is None:
+            method = 'highs' if self._has_highs() else 'interior-point'
+        solve_start = time.time()
+        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=np.array(eq[3]),
+                      bounds=bounds + slack_bounds + peak_bounds, method=method)
+        solve_time = time.time() - solve_start
+        statistics = {'status': 'Solve_Succeeded' if res.status == 0 else res.message,
+                      'iterations': getattr(res, 'nit', None),
+                      'objective': res.fun + constant_cost if res.status == 0 else None,
+                      'solve_time': solve_time}
+        if res.status != 0:
+            return None, statistics
+
+        return self._get_results(res.x, index, x0, Ppv, u_idx, x_idx), statistics
+
+    def get_slack_cost(self, weight, pi_d, dt):
+        '''Get the cost per unit of constraint violation and per step.
+
+        The cost is slack_penalty times the largest cost of running all
+        equipment at full power for one step, including the increase of
+        the demand charge, so that a violation always costs more than the
+        energy it saves.
+
+        Parameters
+        ----------
+        weight : array
+            Weight of the energy of each step in the objective, 1 per J
+            or pi_e in $/J.
+        pi_d : array or None
+            Demand price of each step in $/W, None without demand charge.
+        dt : float
+            Time step in seconds.
+
+        Returns
+        -------
+        cost : float
+            Cost per unit of violation, in the units of the objective.
+
+        '''
+        power = np.sum(np.abs(self.power_coefficients))
+        cost = np.max(np.abs(weight)) * power * dt if len(weight) > 0 else 0.
+        if pi_d is not None and len(pi_d) > 0:
+            cost += np.max(np.abs(pi_d)) * power
+        if not cost > 0:
+            # No cost of energy, any positive penalty enforces the bounds
+            cost = 1.
+
+        return self.slack_penalty * cost
+
+    def _get_continuous_model(self):
+        '''Get the state and input matrices of the continuous model.
+
+        '''
+        p = self.parameters
+        Ac = np.zeros((len(states), len(states)))
+        Bc = np.zeros((len(states), len(controls)))
+        # RTU zones
+        Ac[0, 0] = -(1 / p['Rrtu_west'] + 1 / p['Rwest_east']) / p['Crtu_west']
+        Ac[0, 1] = 1 / p['Rwest_east'] / p['Crtu_west']
+        Ac[1, 0] = 1 / p['Rwest_east'] / p['Crtu_east']
+        Ac[1, 1] = -(1 / p['Rrtu_east'] + 1 / p['Rwest_east'] + 1 / p['Rref'] + 1 / p['Rfre']) / p['Crtu_east']
+        Ac[1, 2] = 1 / p['Rref'] / p['Crtu_east']
+        Ac[1, 3] = 1 / p['Rfre'] / p['Crtu_east']
+        Bc[0, 0] = -p['RTUWestCoolingCap'] / p['Crtu_west']
+        Bc[0, 1] = p['RTUWestHeatingCap'] * p['RTUWestHeatingEff'] / p['Crtu_west']
+        Bc[1, 0] = -p['RTUEastCoolingCap'] / p['Crtu_east']
+        Bc[1, 1] = p['RTUEastHeatingCap'] * p['RTUEastHeatingEff'] / p['Crtu_east']
+        # Refrigerator and freezer in the east zone
+        Ac[2, 1] = 1 / p['Rref'] / p['Cref']
+        Ac[2, 2] = -(1 / p['Rref'] + 1 / p['Rref_fre']) / p['Cref']
+        Ac[2, 3] = 1 / p['Rref_fre'] / p['Cref']
+        Ac[3, 1] = 1 / p['Rfre'] / p['Cfre']
+        Ac[3, 2] = 1 / p['Rref_fre'] / p['Cfre']
+        Ac[3, 3] = -(1 / p['Rfre'] + 1 / p['Rref_fre']) / p['Cfre']
+        Bc[2, 2] = -p['RefCoolingCap'] / p['Cref']
+        Bc[3, 3] = -p['FreCoolingCap'] / p['Cfre']
+        # Battery energy
+        Bc[4, 4] = p['P_cap']
+
+        return Ac, Bc
+
+    def _get_power_coefficients(self):
+        '''Get the electric power of each control at full signal.
+
+        '''
+        p = self.parameters
+        return np.array([p['RTUWestCoolingCap'] / p['RTUWestCoolingCOP'] + p['RTUEastCoolingCap'] / p['RTUEastCoolingCOP'],
+                         0.,
+                         p['RefCoolingCap'] / p['RefCoolingCOP'],
+                         p['FreCoolingCap'] / p['FreCoolingCOP'],
+                         p['P_cap']])
+
+    def _get_initial_state(self, initial_state):
+        '''Get the initial state vector from measured values and parameters.
+
+        '''
+        p = self.parameters
+        values = dict((state, p.get('{0}_0'.format(state), None)) for state in ['Trtu_west', 'Trtu_east', 'Tref', 'Tfre', 'SOC'])
+        if 'Trtu' in initial_state:
+            values['Trtu_west'] = initial_state['Trtu']
+            values['Trtu_east'] = initial_state['Trtu']
+        values.update(dict((key, initial_state[key]) for key in initial_state if key in values))
+
+        return np.array([values['Trtu_west'], values['Trtu_east'], values['Tref'], values['Tfre'], values['SOC'] * p['Ecap']])
+
+    def _get_terms(self, variable, k, u_idx, x_idx, p0):
+        '''Express a constrained variable at step k as linear terms of the variables.
+
+        Returns the terms, a constant and the index of the time of the value.
+
+        '''
+        if variable in states[:4]:
+            return [(x_idx(k, states.index(variable)), 1.)], 0., k + 1
+        elif variable == 'Trtu':
+            return [(x_idx(k, 0), 0.5), (x_idx(k, 1), 0.5)], 0., k + 1
+        elif variable == 'SOC':
+            return [(x_idx(k, 4), 1. / self.parameters['Ecap'])], 0., k + 1
+        elif variable == 'Pnet':
+            return [(u_idx(k, i), self.power_coefficients[i]) for i in range(len(controls))], p0[k], k
+
+        return None, None, None
+
+    def _get_bound(self, bounds, constraint_type, time, default):
+        '''Get the value of a bound at a time.
+
+        '''
+        if constraint_type not in bounds:
+            return default
+        series = bounds[constraint_type]
+        value = series.asof(time) if time >= series.index[0] else series.iloc[0]
+        if default is not None and np.isnan(value):
+            return default
+
+        return value
+
+    def _resample(self, df, index):
+        '''Interpolate input data on the time grid.
+
+        '''
+        df = df.reindex(df.index.union(index)).interpolate(method='time')
+        df = df.fillna(method='ffill').fillna(method='bfill')
+
+        return df.reindex(index)
+
+    def _get_results(self, x, index, x0, Ppv, u_idx, x_idx):
+        '''Package the solution as a DataFrame of controls, states and outputs.
+
+        '''
+        n = len(index) - 1
+        p = self.parameters
+        u = np.array([[x[u_idx(k, i)] for i in range(len(controls))] for k in range(n)])
+        xs = np.vstack([x0, np.array([[x[x_idx(k, j)] for j in range(len(states))] for k in range(n)])])
+        # Controls and powers hold over each step, repeat the last one at the final time
+        u = np.vstack([u, u[-1:]])
+        results = pd.DataFrame(u, index=index, columns=controls)
+        for j, state in enumerate(states[:4]):
+            results[state] = xs[:, j]
+        results['Trtu'] = (results['Trtu_west'] + results['Trtu_east']) / 2
+        results['SOC'] = xs[:, 4] / p['Ecap']
+        results['Prtu_west'] = p['RTUWestCoolingCap'] / p['RTUWestCoolingCOP'] * results['uCool']
+        results['Prtu_east'] = p['RTUEastCoolingCap'] / p['RTUEastCoolingCOP'] * results['uCool']
+        results['Prtu'] = results['Prtu_west'] + results['Prtu_east']
+        results['Grtu_west'] = p['RTUWestHeatingCap'] * results['uHeat']
+        results['Grtu_east'] = p['RTUEastHeatingCap'] * results['uHeat']
+        results['Grtu'] = results['Grtu_west'] + results['Grtu_east']
+        results['Pref'] = p['RefCoolingCap'] / p['RefCoolingCOP'] * results['uRef']
+        results['Pfre'] = p['FreCoolingCap'] / p['FreCoolingCOP'] * results['uFreCool']
+        results['Pbattery'] = p['P_cap'] * results['uBattery']
+        results['Ppv'] = Ppv
+        results['Pnet'] = results['Prtu'] + results['Pref'] + results['Pfre'] + results['Pbattery'] + p['Pload'] - results['Ppv']
+
+        return results
+
+    def _has_highs(self):
+        '''Check if scipy provides the HiGHS solvers.
+
+        '''
+        try:
+            from scipy.optimize import _linprog_highs
+            return True
+        except ImportError:
+            return False
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the model cache, which keeps compiled model FMUs on
+disk so that an unchanged Modelica model is not recompiled every time the
+MPC controller is instantiated.  Only the FMU is cached; the optimization
+problem is still transferred by JModelica at every instantiation, which
+the resident mode of mpc_controller avoids.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import datetime
+
+# Fingerprints of the Modelica libraries, computed once per process
+_library_fingerprints = {}
+
+class Model_Cache(object):
+    '''On-disk cache of compiled model FMUs.
+
+    Artifacts are stored in one folder per key, where the key is a content
+    hash of everything that affects the compilation.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder in which the compiled artifacts are stored.
+    '''
+
+    def __init__(self, cache_dir):
+        '''Constructor.
+
+        '''
+        self.cache_dir = cache_dir
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_key(self, mopath, modelpath, libraries=None):
+        '''Compute the cache key of a model.
+
+        Parameters
+        ----------
+        mopath : str
+            Path to the .mo file of the model.
+        modelpath : str
+            Modelica path of the model within the .mo file.
+        libraries : str or list, optional
+            Modelica libraries used by the model, either as a list of paths
+            or as a MODELICAPATH string.
+
+        Returns
+        -------
+        key : str
+            Hex digest identifying the compiled model.
+
+        '''
+        sha = hashlib.sha1()
+        with open(mopath, 'rb') as f:
+            sha.update(f.read())
+        sha.update(modelpath.encode('utf-8'))
+        for library in self._split_libraries(libraries):
+            sha.update(library.encode('utf-8'))
+            sha.update(self._get_library_fingerprint(library).encode('utf-8'))
+        sha.update(os.getenv('JMODELICA_HOME', '').encode('utf-8'))
+
+        return sha.hexdigest()
+
+    def get(self, key):
+        '''Get the path of the cached FMU for a key.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, see get_key.
+
+        Returns
+        -------
+        fmupath : str or None
+            Path to the cached FMU, None if the key is not cached.
+
+        '''
+        manifest_path = os.path.join(self.cache_dir, key, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        fmupath = os.path.join(self.cache_dir, key, manifest['fmu'])
+        if not os.path.exists(fmupath):
+            return None
+
+        return fmupath
+
+    def put(self, key, fmupath, info=None):
+        '''Store a compiled FMU under a key.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, see get_key.
+        fmupath : str
+            Path to the compiled FMU.
+        info : dict, optional
+            Additional information saved in the manifest.
+
+        Returns
+        -------
+        cached_fmupath : str
+            Path to the cached copy of the FMU.
+
+        '''
+        key_dir = os.path.join(self.cache_dir, key)
+        # One temporary folder per process, for processes compiling the same model
+        tmp_dir = '{0}.{1}.tmp'.format(key_dir, os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        fmu = os.path.basename(fmupath)
+        shutil.copy(fmupath, os.path.join(tmp_dir, fmu))
+        manifest = {'fmu': fmu,
+                    'created': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    'info': info or {}}
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        # Replace any previous entry only once the new one is complete
+        if os.path.exists(key_dir):
+            shutil.rmtree(key_dir)
+        try:
+            os.rename(tmp_dir, key_dir)
+        except OSError:
+            # Another process stored the same model meanwhile
+            if not os.path.exists(key_dir):
+                raise
+            shutil.rmtree(tmp_dir)
+
+        return os.path.join(key_dir, fmu)
+
+    def _split_libraries(self, libraries):
+        '''Get the list of library paths from a list or MODELICAPATH string.
+
+        '''
+        if not libraries:
+            return []
+        if isinstance(libraries, (list, tuple)):
+            return [str(library) for library in libraries]
+
+        return [library for library in libraries.split(os.pathsep) if library]
+
+    def _get_library_fingerprint(self, library):
+        '''Summarize the packages of a MODELICAPATH folder by version or content.
+
+        A package whose package.mo declares a version, like a released
+        library, is summarized by its name and version, other packages
+        and .mo files by a hash of the content of their .mo files.  The
+        fingerprints are computed once per process.
+
+        '''
+        if library in _library_fingerprints:
+            return _library_fingerprints[library]
+        if os.path.exists(os.path.join(library, 'package.mo')):
+            packages = [library]
+        elif os.path.isdir(library):
+            packages = [os.path.join(library, name) for name in sorted(os.listdir(library))]
+        else:
+            packages = []
+        entries = []
+        for package in packages:
+            name = os.path.basename(package)
+            if os.path.isdir(package):
+                package_mo = os.path.join(package, 'package.mo')
+                if not os.path.exists(package_mo):
+                    continue
+                with open(package_mo, 'rb') as f:
+                    version = re.search(br'[\s,]version\s*=\s*"([^"]+)"', f.read())
+                if version:
+                    entries.append('{0}:{1}'.format(name, version.group(1).decode('utf-8')))
+                else:
+                    entries.append('{0}:{1}'.format(name, self._get_content_hash(package)))
+            elif package.endswith('.mo'):
+                entries.append('{0}:{1}'.format(name, self._get_content_hash(package)))
+        _library_fingerprints[library] = '\n'.join(entries)
+
+        return _library_fingerprints[library]
+
+    def _get_content_hash(self, path):
+        '''Hash the content of a .mo file, or of the .mo files of a folder.
+
+        '''
+        sha = hashlib.sha1()
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.endswith('.mo'):
+                        sha.update(os.path.relpath(os.path.join(root, filename), path).encode('utf-8'))
+                        with open(os.path.join(root, filename), 'rb') as f:
+                            sha.update(f.read())
+        else:
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+
+        return sha.hexdigest()
@@ -11,8 +11,14 @@ explicitly as appropriate.
 from mpcpy import exodata, models, optimization, variables, units, systems
 import pandas as pd
 from data_manager import Data_Manager
+from model_cache import Model_Cache
+from linear_store import Linear_Store, load_parameters
+from timing import Phase_Timer
 # import process_data
 import datetime
+import time
+import math
+import os
 
 class mpc(object):
     '''MPC controller.
@@ -71,8 +77,10 @@ class mpc(object):
         self.price_config = price_config
         # Get timezone
         self.tz_name = tz_name
+        # Time the phases of each control cycle
+        self.timer = Phase_Timer()
         # Initialize exodata
-        self.data_manager = Data_Manager(data_manager_config=data_manager_config)
+        self.data_manager = Data_Manager(data_manager_config=data_manager_config, timer=self.timer)
         self.weather = self._initialize_weather(self.weather_config)
         self.control = self._initialize_control(self.control_config)
         self.other_input = self._initialize_other_input(self.other_input_config)
@@ -84,8 +92,15 @@ class mpc(object):
         self.system = self._initialize_system(self.system_config)
         # Save optimization configuration
         self.opt_config = opt_config
-
-    def optimize(self, start_time, final_time, init = True):
+        self.init_time = None
+        # Previous solution and reference statistics for warm starts
+        self.previous_control = None
+        self.cold_statistics = None
+        # Last successful plan to fall back to
+        self.last_plan = None
+        self.linear_store = None
+
+    def optimize(self, start_time, final_time, init = True, time_budget = None, data = None):
         '''Solve the control optimization problem.
 
         Parameters
@@ -96,45 +111,531 @@ class mpc(object):
             Final time of optimization
         init : bool, optional
             True if initial optimization.  Will instantiate optimization problem.
+            opt_config['backend'] selects the problem, 'jmodelica' (default)
+            for the Modelica model or 'linear' for the linear program of
+            linear_store.Linear_Store.
+        time_budget : float, optional
+            Time in seconds allowed for this call, including data updates.
+            The solver is stopped when the budget runs out.
+            Default is opt_config['time_budget'] if given, otherwise no limit.
+        data : dict, optional
+            DataFrames keyed by configuration section ('system', 'weather',
+            'other_input', 'constraint', 'price', 'control') to use instead
+            of querying the data manager, e.g. for scenario variants.
+            Sections not given are fetched concurrently with
+            data_manager.Data_Manager.prepare_cycle_data.
 
         Returns
         -------
         solution : DataFrame
             Solution of optimization problem for model measurements.
-        statistics : tup
-            Statistics of optimization solver.
+        statistics : dict
+            Statistics of optimization solver with keys 'status',
+            'iterations', 'objective', 'solve_time' and 'warm_start'.
+            Warm-started solves also report 'iterations_saved' and
+            'solve_time_saved', the difference to the last cold-started
+            solve.  They include the effect of the changed data between the
+            two solves, not only that of the initial guess.
+            The key 'plan' tags the returned plan as 'optimal',
+            'feasible_iterate' (solver stopped early on a feasible point),
+            'fallback' (tail of the last successful plan) or 'infeasible'
+            (no feasible point and no plan to fall back to).  Errors of
+            the solve are raised if there is no plan to fall back to.
+            The durations of the phases of the call are in self.timer,
+            which is reset at the start of each call.
 
         '''
 
-        # Update system measurements with recent data
+        optimize_start = time.time()
+        self.timer.reset()
+        backend = self.opt_config.get('backend', 'jmodelica')
+        data = dict(data or {})
         historic_period = 30*60
         previous_time = start_time - datetime.timedelta(seconds=historic_period)
-        self._update_system(previous_time, start_time)
+        # Fetch the data of all sections of this cycle concurrently
+        requests = {'system': (previous_time, start_time)}
+        for exo, config_section in [(self.weather, 'weather'),
+                                    (self.other_input, 'other_input'),
+                                    (self.constraint, 'constraint'),
+                                    (self.price, 'price')]:
+            if exo:
+                requests[config_section] = (start_time, final_time)
+        if init and backend == 'jmodelica':
+            requests['control'] = (start_time, final_time)
+        requests = dict((key, requests[key]) for key in requests if key not in data)
+        with self.timer.phase('prefetch'):
+            data.update(self.data_manager.prepare_cycle_data(requests))
+        # Update system measurements with recent data
+        with self.timer.phase('update_system'):
+            self._update_system(previous_time, start_time, df=data.get('system', None))
         # Estimate state
-        self._estimate_state()
+        with self.timer.phase('estimate_state'):
+            self._estimate_state()
         # Update exodata
-        for exo in [self.weather,
-                    self.other_input,
-                    self.constraint,
-                    self.price]:
-            self._update_exo(exo, start_time, final_time)
-        # Instantiate problem and load initial control if initial
-        if init:
-            self._update_exo(self.control, start_time, final_time)
-            self.opt_object = self._initialize_opt_problem(self.opt_config)
+        for exo, config_section in [(self.weather, 'weather'),
+                                    (self.other_input, 'other_input'),
+                                    (self.constraint, 'constraint'),
+                                    (self.price, 'price')]:
+            with self.timer.phase('update_{0}'.format(config_section)):
+                self._update_exo(exo, start_time, final_time, df=data.get(config_section, None))
+        warm_start = False
+        if backend == 'jmodelica':
+            # Instantiate problem and load initial control if initial
+            if init:
+                init_start = time.time()
+                with self.timer.phase('update_control'):
+                    self._update_exo(self.control, start_time, final_time, df=data.get('control', None))
+                with self.timer.phase('instantiate'):
+                    self.opt_object = self._initialize_opt_problem(self.opt_config)
+                self.init_time = time.time() - init_start
+            # Use the previous solution as initial guess if warm starting
+            with self.timer.phase('warm_start'):
+                warm_start = self._warm_start(start_time, final_time)
+            # Limit the solver to what is left of the time budget
+            if time_budget is None:
+                time_budget = self.opt_config.get('time_budget', None)
+            max_cpu_time = None
+            if time_budget is not None:
+                max_cpu_time = max(time_budget - (time.time() - optimize_start), 1.0)
+            horizon = (final_time - start_time).total_seconds()
+            self._set_solver_options(warm_start, horizon, max_cpu_time)
+        elif backend == 'linear':
+            if init or self.linear_store is None:
+                init_start = time.time()
+                with self.timer.phase('instantiate'):
+                    self.linear_store = self._initialize_linear_problem(self.opt_config)
+                self.init_time = time.time() - init_start
+        else:
+            raise ValueError('Optimization backend "{0}" unknown or not available.'.format(backend))
         # Solve problem
-        self.opt_object.optimize(start_time, final_time, price_data=self.price.data)
-        # Get solution and statistics
+        try:
+            if backend == 'linear':
+                with self.timer.phase('solve'):
+                    control, measurements, other_outputs, statistics = self._optimize_linear(start_time, final_time)
+            else:
+                with self.timer.phase('solve'):
+                    self.opt_object.optimize(start_time, final_time, price_data=self.price.data)
+                # Get solution and statistics
+                with self.timer.phase('package'):
+                    control, measurements, other_outputs = self._get_solution()
+                    statistics = self._get_statistics(warm_start)
+            if statistics['status'] in ['Solve_Succeeded', 'Solved_To_Acceptable_Level']:
+                plan = 'optimal'
+            elif self._is_feasible(control, measurements, other_outputs):
+                plan = 'feasible_iterate'
+            else:
+                plan = None
+        except Exception as e:
+            # Without an unexpired plan to fall back to, there is nothing to return
+            if self._get_fallback_plan(start_time, final_time) is None:
+                raise
+            print('Optimization ended in error={0}'.format(str(e)))
+            statistics = {'status': str(e), 'warm_start': warm_start}
+            plan = None
+        # Fall back to the last successful plan if there is no feasible solution
+        if plan is None:
+            fallback = self._get_fallback_plan(start_time, final_time)
+            if fallback is not None:
+                print('No feasible solution, falling back to the plan of the previous run.')
+                control, measurements, other_outputs = fallback
+                plan = 'fallback'
+            else:
+                plan = 'infeasible'
+        else:
+            self.last_plan = (control, measurements, other_outputs)
+            # Only warm start the next solve from a solution of this one
+            self.previous_control = control
+        statistics['plan'] = plan
+
+        return control, measurements, other_outputs, statistics
+
+    def _optimize_linear(self, start_time, final_time):
+        '''Solve the linear program of the optimization problem.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+
+        Returns
+        -------
+        control : DataFrame
+            Optimal control.
+        measurements : DataFrame
+            Solution of optimization problem for model measurements.
+        other_outputs : DataFrame
+            Solution of optimization problem for other model outputs.
+        statistics : dict
+            Statistics of optimization solver.
+
+        '''
+
+        # Get data in base units
+        weather = pd.DataFrame({'Tout': self.weather.data['weaTDryBul'].get_base_data(),
+                                'poa_pv': self.weather.data['weaPoaPv'].get_base_data(),
+                                'poa_win': self.weather.data['weaPoaWin'].get_base_data()})
+        price = None
+        if self.price:
+            price = pd.DataFrame(dict((key, self.price.data[key].get_base_data()) for key in ['pi_e', 'pi_d'] if key in self.price.data))
+        constraints = None
+        if self.constraint:
+            constraints = dict()
+            for variable in self.constraint.data:
+                constraints[variable] = dict((constraint_type, self.constraint.data[variable][constraint_type].get_base_data())
+                                             for constraint_type in self.constraint.data[variable])
+        initial_state = dict()
+        for par in self.init_vm:
+            initial_state[self.init_vm[par]] = self.model.parameter_data[par]['Value'].get_base_data()
+        # Solve
+        results, statistics = self.linear_store.optimize(start_time, final_time, initial_state,
+                                                         weather, price=price, constraints=constraints)
+        if results is None:
+            raise ValueError('Linear optimization failed with status "{0}".'.format(statistics['status']))
+        statistics['warm_start'] = False
+        control = results[[self.control_config['vm'][key][0] for key in self.control_config['vm']]]
+        measurements = results[self.model_config['measurements']]
+        other_outputs = results[self.other_outputs]
+
+        return control, measurements, other_outputs, statistics
+
+    def _get_solution(self):
+        '''Get the solution of the last optimization solve.
+
+        Returns
+        -------
+        control : DataFrame
+            Optimal control.
+        measurements : DataFrame
+            Solution of optimization problem for model measurements.
+        other_outputs : DataFrame
+            Solution of optimization problem for other model outputs.
+
+        '''
+
         control = self.control.display_data()
         measurements = self.opt_object.display_measurements('Simulated')
         other_outputs = pd.DataFrame(index=measurements.index)
         for key in self.other_outputs:
             other_outputs[key] = self.opt_object._package_type.res_opt['mpc_model.{0}'.format(key)]
-        statistics = self.opt_object.get_optimization_statistics()
 
-        return control, measurements, other_outputs, statistics
+        return control, measurements, other_outputs
+
+    def _is_feasible(self, control, measurements, other_outputs):
+        '''Check if a solution satisfies the constraints.
+
+        Constraints are compared in base units to the solution, with a
+        relative tolerance of opt_config['feasibility_tol'] (default 1e-3).
+
+        Parameters
+        ----------
+        control : DataFrame
+            Control of the solution.
+        measurements : DataFrame
+            Model measurements of the solution.
+        other_outputs : DataFrame
+            Other model outputs of the solution.
+
+        Returns
+        -------
+        feasible : bool
+            True if no constraint is violated.
+
+        '''
+
+        if not self.constraint:
+            return True
+        tol = self.opt_config.get('feasibility_tol', 1e-3)
+        for variable in self.constraint.data:
+            series = None
+            for df in [control, measurements, other_outputs]:
+                if variable in df.columns:
+                    series = df[variable].dropna()
+                    break
+            if series is None or len(series) == 0:
+                continue
+            for constraint_type in self.constraint.data[variable]:
+                bound = self.constraint.data[variable][constraint_type].get_base_data()
+                bound = bound.reindex(series.index, method='ffill')
+                margin = tol * bound.abs().clip(lower=1)
+                if constraint_type == 'GTE' and ((series - bound) < -margin).any():
+                    return False
+                if constraint_type == 'LTE' and ((series - bound) > margin).any():
+                    return False
+
+        return True
+
+    def _get_fallback_plan(self, start_time, final_time):
+        '''Get the unexpired tail of the last successful plan, shifted to the horizon.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+
+        Returns
+        -------
+        fallback : tuple of DataFrame or None
+            Control, measurements and other outputs of the shifted plan.
+            None if there is no plan or if it has expired.
+
+        '''
+
+        if self.last_plan is None:
+            return None
+        fallback = []
+        for df in self.last_plan:
+            shifted = self._shift_plan(df, start_time, final_time)
+            if shifted is None:
+                return None
+            fallback.append(shifted)
+
+        return tuple(fallback)
+
+    def _warm_start(self, start_time, final_time):
+        '''Load the previous optimal control, shifted to the new horizon, as initial guess.
+
+        Only used if opt_config['warm_start'] is True and a previous
+        solution is available.  This is a control-only initial guess:
+        MPCPy simulates the model with the control initial guess to obtain
+        the initial trajectory of the solver, so the state trajectories
+        follow from the shifted control and the newly estimated state.  The
+        state and dual trajectories of the previous solve are not reused,
+        since MPCPy does not expose them.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+
+        Returns
+        -------
+        warm_start : bool
+            True if the solve is warm started.
+
+        '''
+
+        warm_start = False
+        if self.opt_config.get('warm_start', False) and self.previous_control is not None:
+            guess = self._shift_plan(self.previous_control, start_time, final_time)
+            if guess is not None:
+                # Map model input names back to the data source column names
+                columns = dict((self.control_config['vm'][key][0], key) for key in self.control_config['vm'])
+                guess = guess.rename(columns=columns)
+                guess.index = guess.index.tz_convert('UTC').tz_localize(None)
+                self.control._df = guess
+                print('Warm starting {0} from the previous solution...'.format(self.control.name))
+                self.control.collect_data(start_time, final_time)
+                warm_start = True
+
+        return warm_start
+
+    def _set_solver_options(self, warm_start, horizon, max_cpu_time=None):
+        '''Set the collocation and IPOPT options of the next solve.
+
+        Parameters
+        ----------
+        warm_start : bool
+            True to add opt_config['warm_start_options'] (default none)
+            to the IPOPT options.
+        horizon : float
+            Length of the optimization horizon in seconds.
+        max_cpu_time : float, optional
+            Time in seconds after which the solver is stopped.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        opt_options = self.opt_object.get_optimization_options()
+        # Collocation grid and control blocking
+        n_e, hs, blocking_factors = self._get_collocation_grid(horizon)
+        opt_options['n_e'] = n_e
+        if hs is not None:
+            opt_options['hs'] = hs
+        if blocking_factors is not None:
+            opt_options['blocking_factors'] = blocking_factors
+        # Solver
+        ipopt_options = dict(self.cold_ipopt_options)
+        if warm_start:
+            # No default, a small mu_init needs a primal-dual starting point
+            ipopt_options.update(self.opt_config.get('warm_start_options', {}))
+        if max_cpu_time is not None:
+            ipopt_options['max_cpu_time'] = max_cpu_time
+        opt_options['IPOPT_options'] = ipopt_options
+        self.opt_object.set_optimization_options(opt_options)
+
+        return None
+
+    def _get_collocation_grid(self, horizon):
+        '''Get the collocation elements and control blocks over the horizon.
+
+        opt_config['collocation'] defines a non-uniform grid with the keys
+        'fine_horizon', 'fine_step' and 'coarse_step', all in seconds:
+        elements of about fine_step cover the first fine_horizon seconds and
+        elements of about coarse_step cover the rest of the horizon.
+        Otherwise, opt_config['n_e'] (default 24*4) uniform elements are used.
+
+        opt_config['move_blocking'] holds the controls constant over blocks
+        of elements, with the keys 'free_horizon' and 'block_length' in
+        seconds: controls can change at every element during the first
+        free_horizon seconds and at most every block_length seconds later.
+
+        Parameters
+        ----------
+        horizon : float
+            Length of the optimization horizon in seconds.
+
+        Returns
+        -------
+        n_e : int
+            Number of collocation elements.
+        hs : list of float or None
+            Element lengths normalized by the horizon, None if uniform.
+        blocking_factors : list of int or None
+            Number of elements in each control block, None if not blocked.
+
+        '''
+
+        collocation = self.opt_config.get('collocation', None)
+        if collocation:
+            fine_horizon = float(min(collocation['fine_horizon'], horizon))
+            n_fine = max(int(math.ceil(fine_horizon / collocation['fine_step'])), 1)
+            lengths = [fine_horizon / n_fine] * n_fine
+            coarse_horizon = horizon - fine_horizon
+            if coarse_horizon > 0:
+                n_coarse = max(int(math.ceil(coarse_horizon / collocation['coarse_step'])), 1)
+                lengths += [coarse_horizon / n_coarse] * n_coarse
+            n_e = len(lengths)
+            hs = [length / horizon for length in lengths]
+        else:
+            n_e = self.opt_config.get('n_e', 24*4)
+            lengths = [horizon / n_e] * n_e
+            hs = None
+        move_blocking = self.opt_config.get('move_blocking', None)
+        if move_blocking:
+            blocking_factors = []
+            elapsed = 0.
+            block_elements = 0
+            block_span = 0.
+            for length in lengths:
+                if elapsed < move_blocking['free_horizon']:
+                    blocking_factors.append(1)
+                else:
+                    block_elements += 1
+                    block_span += length
+                    if block_span >= move_blocking['block_length']:
+                        blocking_factors.append(block_elements)
+                        block_elements = 0
+                        block_span = 0.
+                elapsed += length
+            if block_elements > 0:
+                blocking_factors.append(block_elements)
+        else:
+            blocking_factors = None
+
+        return n_e, hs, blocking_factors
+
+    def _shift_plan(self, plan, start_time, final_time, freq='5T'):
+        '''Shift a plan from a previous run to the horizon of a new run.
+
+        The part of the plan before start_time is dropped and the tail is
+        extended up to final_time by holding the last value.
+
+        Parameters
+        ----------
+        plan : DataFrame
+            Plan of a previous run with a timezone-aware index.
+        start_time : pandas datetime
+            Start time of the new horizon
+        final_time : pandas datetime
+            Final time of the new horizon
+        freq : str, optional
+            Frequency of the points added to extend the tail.
+            Default is '5T'.
+
+        Returns
+        -------
+        shifted : DataFrame or None
+            Plan over the new horizon.  None if the plan ends before
+            start_time.
+
+        '''
+
+        if len(plan.index) == 0 or plan.index[-1] <= start_time:
+            return None
+        # Keep the last point before the start to hold its value
+        past = plan.index[plan.index <= start_time]
+        if len(past) > 0:
+            plan = plan.loc[past[-1]:]
+        index = pd.date_range(start_time, final_time, freq=freq)
+        shifted = plan.reindex(plan.index.union(index)).fillna(method='ffill')
+        shifted = shifted.loc[start_time:final_time]
+
+        return shifted
+
+    def _get_statistics(self, warm_start):
+        '''Get the statistics of the last optimization solve.
+
+        Parameters
+        ----------
+        warm_start : bool
+            True if the last solve was warm started.
+
+        Returns
+        -------
+        statistics : dict
+            Statistics of optimization solver.
+
+        '''
+
+        status, iterations, objective, solve_time = self.opt_object.get_optimization_statistics()
+        statistics = {'status': status,
+                      'iterations': iterations,
+                      'objective': objective,
+                      'solve_time': solve_time,
+                      'warm_start': warm_start}
+        if not warm_start:
+            self.cold_statistics = statistics
+        elif self.cold_statistics is not None:
+            statistics['iterations_saved'] = self.cold_statistics['iterations'] - iterations
+            statistics['solve_time_saved'] = self.cold_statistics['solve_time'] - solve_time
+
+        return statistics
+
+    def get_solver_options(self):
+        '''Get the solver options of the last optimization solve.
+
+        Returns
+        -------
+        solver_options : dict
+            'backend' and, for the jmodelica backend, the collocation
+            options 'n_e' and 'blocking_factors' and the 'IPOPT_options',
+            or, for the linear backend, 'step' and 'method'.
+
+        '''
+
+        backend = self.opt_config.get('backend', 'jmodelica')
+        solver_options = {'backend': backend}
+        if backend == 'linear' and self.linear_store is not None:
+            solver_options['step'] = self.linear_store.step
+            solver_options['method'] = self.linear_store.method
+        elif backend == 'jmodelica' and hasattr(self, 'opt_object'):
+            opt_options = self.opt_object.get_optimization_options()
+            solver_options['n_e'] = opt_options['n_e']
+            solver_options['blocking_factors'] = opt_options.get('blocking_factors', None)
+            solver_options['IPOPT_options'] = dict(opt_options['IPOPT_options'])
 
-    def set_setpoints(self, control, measurements):
+        return solver_options
+
+    def set_setpoints(self, control, measurements, plan = 'optimal', sink = None):
         '''Push the optimal setpoints to a DataFrame
 
         Parameters
@@ -143,12 +644,47 @@ class mpc(object):
             Solution of optimization problem
         measurements : DataFrame
             Solution of optimization problem for model measurements
+        plan : str, optional
+            Tag of the plan, see statistics['plan'] returned by optimize.
+            Setpoints are only pushed to the data manager if the tag is in
+            opt_config['publish_plans'] (default all tags).
+            Default is 'optimal'.
+        sink : dict, optional
+            Setpoints sink configuration replacing the one of the data
+            manager, e.g. for a controller running in shadow.
+            Default is None.
 
         Returns
         -------
         setpoints : DataFrame
             Optimal setpoints obtained after the completion of simulation
 
+        '''
+        with self.timer.phase('set_setpoints'):
+            setpoints = self._get_setpoints(control, measurements)
+        publish_plans = self.opt_config.get('publish_plans', ['optimal', 'feasible_iterate', 'fallback', 'infeasible'])
+        if plan in publish_plans:
+            self.data_manager.set_setpoints(setpoints, sink = sink)
+        else:
+            print('Setpoints of the {0} plan are not published.'.format(plan))
+
+        return setpoints
+
+    def _get_setpoints(self, control, measurements):
+        '''Convert the optimal solution to device setpoints.
+
+        Parameters
+        -----------
+        control : DataFrame
+            Solution of optimization problem
+        measurements : DataFrame
+            Solution of optimization problem for model measurements
+
+        Returns
+        -------
+        setpoints : DataFrame
+            Setpoints at 5 minute intervals
+
         '''
         vm = self.setpoints_config['vm']
         setpoints_list = []
@@ -186,7 +722,6 @@ class mpc(object):
             setpoints['Trtu_west_heat'] = setpoints['Trtu_east_heat']
             setpoints['Tfre'] = -7
             setpoints['Tref'] = 33
-        self.data_manager.set_setpoints(setpoints)
 
         return setpoints
 
@@ -431,6 +966,9 @@ class mpc(object):
         ----------
         model_config : dict()
             Configruation of model.
+            If 'cache_dir' is given, compiled models are stored in and
+            loaded from that folder, keyed by the content of the model
+            and its libraries.
 
         Returns
         -------
@@ -459,17 +997,41 @@ class mpc(object):
         self.parameter.collect_data()
         # Specify initial parameter dictionary
         init_vm =  model_config['init_vm']
-        # Instantiate object
+        # Look for an already compiled model
         moinfo = (mopath, modelpath, libraries)
-        model = models.Modelica(models.JModelica,
-                                     models.RMSE,
-                                     measurements,
-                                     moinfo = moinfo,
-                                     weather_data = self.weather.data,
-                                     control_data = self.control.data,
-                                     parameter_data = self.parameter.data,
-                                     tz_name = self.weather.tz_name,
-                                     save_parameter_input_data=True)
+        cache_dir = model_config.get('cache_dir', None)
+        fmupath = None
+        if cache_dir:
+            model_cache = Model_Cache(cache_dir)
+            cache_key = model_cache.get_key(mopath, modelpath, libraries)
+            fmupath = model_cache.get(cache_key)
+        # Instantiate object
+        if fmupath:
+            print('Loading compiled model {0} from cache...'.format(fmupath))
+            model = models.Modelica(models.JModelica,
+                                         models.RMSE,
+                                         measurements,
+                                         fmupath = fmupath,
+                                         weather_data = self.weather.data,
+                                         control_data = self.control.data,
+                                         parameter_data = self.parameter.data,
+                                         tz_name = self.weather.tz_name,
+                                         save_parameter_input_data=True)
+            # The optimization problem is built from the model source
+            model.mopath, model.modelpath, model.libraries = moinfo
+        else:
+            model = models.Modelica(models.JModelica,
+                                         models.RMSE,
+                                         measurements,
+                                         moinfo = moinfo,
+                                         weather_data = self.weather.data,
+                                         control_data = self.control.data,
+                                         parameter_data = self.parameter.data,
+                                         tz_name = self.weather.tz_name,
+                                         save_parameter_input_data=True)
+            if cache_dir:
+                fmupath = model_cache.put(cache_key, model.fmupath, info={'mopath': mopath, 'modelpath': modelpath})
+                print('Saved compiled model to cache {0}.'.format(fmupath))
         # Check if other inputs present
         if self.other_input:
             model.other_inputs = self.other_input.data
@@ -512,15 +1074,46 @@ class mpc(object):
                                                tz_name = self.weather.tz_name)
         # Set default options
         opt_options = opt_object.get_optimization_options()
-        opt_options['n_e'] = 24*4
+        opt_options['n_e'] = opt_config.get('n_e', 24*4)
         opt_options['IPOPT_options']['tol'] = 1e-10
         opt_options["IPOPT_options"]["max_iter"] = 500
         opt_options['IPOPT_options']['linear_solver'] = 'mumps'
         opt_object.set_optimization_options(opt_options)
+        # Save solver options used for cold starts
+        self.cold_ipopt_options = dict(opt_options['IPOPT_options'])
 
         return opt_object
 
-    def _update_exo(self, exo_object, start_time, final_time):
+    def _initialize_linear_problem(self, opt_config):
+        '''Instantiate the linear program of the optimization problem.
+
+        Parameters
+        ----------
+        opt_config: dict()
+            Configuration of optimization problem.  opt_config['linear']
+            can set 'parameters_csv' (default models/pars_thermal.csv),
+            'parameters' to override values, and the 'step', 'slack_penalty'
+            and 'method' of linear_store.Linear_Store.
+
+        Returns
+        -------
+        linear_store : linear_store.Linear_Store
+            Object to represent the control optimization.
+
+        '''
+
+        linear_config = opt_config.get('linear', {})
+        parameters = load_parameters(linear_config.get('parameters_csv', os.path.join('models', 'pars_thermal.csv')))
+        parameters.update(linear_config.get('parameters', {}))
+        linear_store = Linear_Store(parameters,
+                                    objective = opt_config['problem'],
+                                    step = linear_config.get('step', 300),
+                                    slack_penalty = linear_config.get('slack_penalty', 1e3),
+                                    method = linear_config.get('method', None))
+
+        return linear_store
+
+    def _update_exo(self, exo_object, start_time, final_time, df=None):
         '''Update the exodata object with data during the time period.
 
         If the object source is a .csv file, the .csv file will be used.
@@ -535,6 +1128,8 @@ class mpc(object):
             The start time of the update period.
         final_time : pandas datetime in utc
             The final time of the update period.
+        df : DataFrame, optional
+            Data to use instead of querying the data manager.
 
         Returns
         -------
@@ -557,7 +1152,8 @@ class mpc(object):
             else:
                 raise ValueError('Exodata object {0} unknown.'.format(exo_object))
             # Update data
-            df = self.data_manager.get_data_from_config(config_section, start_time, final_time)
+            if df is None:
+                df = self.data_manager.get_data_from_config(config_section, start_time, final_time)
 
             exo_object._df = df
             print('Updating {0}...'.format(exo_object.name))
@@ -566,7 +1162,7 @@ class mpc(object):
 
         return None
 
-    def _update_system(self, start_time, final_time):
+    def _update_system(self, start_time, final_time, df=None):
         '''Update the system object with data during the time period.
 
         If the object source is a .csv file, the .csv file will be used.
@@ -577,6 +1173,8 @@ class mpc(object):
             The start time of the update period.
         final_time : pandas datetime
             The final time of the update period.
+        df : DataFrame, optional
+            Data to use instead of querying the data manager.
 
         Returns
         -------
@@ -585,7 +1183,8 @@ class mpc(object):
         '''
 
         # Update exodata
-        df = self.data_manager.get_data_from_config("system", start_time, final_time)
+        if df is None:
+            df = self.data_manager.get_data_from_config("system", start_time, final_time)
         self.system._df = df
         for key in df.columns:
             print('Updating system measurement for {0}...'.format(key))
@@ -9,13 +9,34 @@ it can only be run at xx:x5:00 successfully.
 import os
 import datetime
 import time
+import collections
 import pandas as pd
 import mpc_config as mpc_config
 from mpc_config import tz_computer, islanding
 from mpc import mpc
+from timing import Timing_Log
+from statistics_log import Statistics_Log
+from run_archive import Run_Archive
+from scheduler import Scheduler
+
+resident = getattr(mpc_config, 'resident', False)
 
 class MPC_Controller:
-    def __init__(self, mpc_config, tz_computer, islanding):
+    def __init__(self, mpc_config, tz_computer, islanding, resident=False):
+        '''Constructor
+
+            Parameters
+            ----------
+            mpc_config: module
+                configuration module with a get_config() function
+            tz_computer: str
+                time zone of the computer clock
+            islanding: bool
+                True if the store runs in islanding mode
+            resident: bool
+                True to build the mpc object once and reuse it, together with its
+                optimization problem, in every following run
+        '''
         self.mpc_config = mpc_config
 
         # Initialize
@@ -26,6 +47,9 @@ class MPC_Controller:
         self.mpc_horizon = 12*3600
         self.tz_computer = tz_computer
         self.islanding = islanding
+        self.resident = resident
+        self.controller = None
+        self.setup_time = None
 
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
@@ -33,10 +57,52 @@ class MPC_Controller:
         #if controller is 'mpc':
         self.config = self.mpc_config.get_config()
 
-    def run(self, start_time_str=None):
-        print('\n')
-        print('The MPC controller has been instantiated.')
-        print('\n')
+        # Logs and archive of the live and shadow runs, kept apart to compare them
+        self.timing_influxdb = self.config.get('timing_config', {}).get('influxdb', False)
+        self.logs = {}
+        self.get_logs('live')
+
+    def get_logs(self, role='live'):
+        '''Get the logs of the runs of one role, created on first use
+
+            The logs of the live runs are timing.jsonl, statistics.csv and archive in the output
+            folder, those of the other roles have the suffix _<role>, e.g. statistics_shadow.csv.
+
+            Parameters
+            ----------
+            role: str
+                'live' or 'shadow'
+
+            Returns
+            -------
+            timing_log: timing.Timing_Log
+                log of the duration of each phase of the control loop
+            statistics_log: statistics_log.Statistics_Log
+                log of the solver statistics of every run
+            run_archive: run_archive.Run_Archive
+                archive of the result frames of every run, partitioned by day
+        '''
+        if role not in self.logs:
+            suffix = '' if role == 'live' else '_' + role
+            timing_config = self.config.get('timing_config', {})
+            base, ext = os.path.splitext(timing_config.get('filename', os.path.join(self.outdir, 'timing.jsonl')))
+            self.logs[role] = (Timing_Log(filename=base + suffix + ext,
+                                          measurement=timing_config.get('measurement', 'mpc_timing') + suffix),
+                               Statistics_Log(os.path.join(self.outdir, 'statistics{0}.csv'.format(suffix))),
+                               Run_Archive(os.path.join(self.outdir, 'archive' + suffix)))
+        return self.logs[role]
+
+    def build_controller(self):
+        '''Instantiate the mpc object from the configuration
+
+            Returns
+            -------
+            controller: mpc
+                new mpc object
+            build_time: float
+                time in seconds taken to instantiate the mpc object
+        '''
+        build_start = time.time()
         controller = mpc(self.config['model_config'],
                               self.config['opt_config'],
                               self.config['system_config'],
@@ -46,12 +112,43 @@ class MPC_Controller:
                               constraint_config=self.config['constraint_config'],
                               data_manager_config=self.config['data_manager_config'],
                               price_config=self.config['price_config'])
+        build_time = time.time() - build_start
+        print('\n')
+        print('The MPC controller has been instantiated in {0:.1f} s.'.format(build_time))
+        print('\n')
 
+        return controller, build_time
+
+    def run(self, start_time_str=None, sink=None, role='live'):
+        '''Run one control cycle
+
+            Parameters
+            ----------
+            start_time_str: str
+                start time in the computer time zone, in the format "%Y-%m-%d %H:%M:00", now if None
+            sink: dict
+                setpoints sink configuration replacing data_sink["setpoints"], e.g. for a shadow run
+            role: str
+                'live' or 'shadow', selects the logs of the run, see get_logs
+        '''
+        timing_log, statistics_log, run_archive = self.get_logs(role)
         if start_time_str is None:
             start = datetime.datetime.now()
         else:
             start  = datetime.datetime.strptime(start_time_str, "%Y-%m-%d %H:%M:00")
 
+        # In resident mode, reuse the mpc object and its optimization problem
+        if self.resident and self.controller is not None:
+            controller = self.controller
+            init = False
+            build_time = 0.
+            print('Reusing the resident MPC controller.')
+        else:
+            controller, build_time = self.build_controller()
+            init = True
+        if self.timing_influxdb:
+            timing_log.influx_client = getattr(controller.data_manager, 'influx_client', None)
+
         start_time = start.strftime("%Y-%m-%d %H:%M:00")
         start_time_utc = pd.to_datetime(start_time).tz_localize(self.tz_computer).tz_convert('UTC')
         print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
@@ -62,33 +159,42 @@ class MPC_Controller:
         print('\n')
 
         final_time_utc = start_time_utc + datetime.timedelta(seconds=self.mpc_horizon)
-        control, measurements, other_outputs, statistics = controller.optimize(start_time_utc, final_time_utc)
-        # Save optimization result data
-        control.to_csv(self.outdir+'/control_{0}.csv'.format(start_time))
-        measurements.to_csv(self.outdir+'/measurements_{0}.csv'.format(start_time))
-        other_outputs.to_csv(self.outdir+'/other_outputs_{0}.csv'.format(start_time))
-        with open(self.outdir+'/optimal_statistics_{0}.txt'.format(start_time), 'a') as f:
-            f.write(str(start_time) + ': ' +  str(statistics) + '\n')
+        try:
+            control, measurements, other_outputs, statistics = controller.optimize(start_time_utc, final_time_utc, init=init)
+        except Exception:
+            # Rebuild from scratch in the next run
+            self.controller = None
+            raise
+        if self.resident and init:
+            self.controller = controller
+            self.setup_time = build_time + controller.init_time
+        # Save optimization result data before pushing, so that it is kept if pushing fails
+        with controller.timer.phase('save_results'):
+            run_archive.append(start_time_utc, {'control': control,
+                                                'measurements': measurements,
+                                                'other_outputs': other_outputs})
+            statistics_log.append(start_time_utc, statistics, horizon=self.mpc_horizon,
+                                  solver_options=controller.get_solver_options())
         # Push setpoints
-        setpoints = controller.set_setpoints(control, measurements)
-        setpoints.to_csv(self.outdir+'/setpoints_{0}.txt'.format(start_time))
+        setpoints = controller.set_setpoints(control, measurements, plan=statistics['plan'], sink=sink)
+        with controller.timer.phase('save_setpoints'):
+            run_archive.append(start_time_utc, {'setpoints': setpoints})
         # check if setpoints have been pushed successefully
         end_time = datetime.datetime.now()
         control_loop_time = (end_time - start).total_seconds()
         print('This control loop has taken {} min'.format(control_loop_time/60))
+        timing = collections.OrderedDict([('build', build_time)])
+        timing.update(controller.timer.get_record())
+        timing['total'] = control_loop_time
+        timing_log.write(start_time_utc, timing, data_manager=controller.data_manager)
+        if self.resident and not init:
+            saved_fraction = self.setup_time / (self.setup_time + control_loop_time)
+            print('Resident mode saved {0:.1f} s ({1:.0%} of the control loop).'.format(self.setup_time, saved_fraction))
 
 
 if __name__ == '__main__':
-    minute = -1
-    mpc_controller = MPC_Controller(mpc_config=mpc_config, tz_computer=tz_computer, islanding=islanding)
-    while True:
-        time.sleep(1)
-        t = datetime.datetime.now()
-        print(t)
-        if (t.minute%5==0) and (t.minute != minute):
-            minute = t.minute
-            try:
-                mpc_controller.run()
-                print('Run ended ok.')
-            except Exception as e :
-                print('Run ended in error, error={0}'.format(str(e)))
+    mpc_controller = MPC_Controller(mpc_config=mpc_config, tz_computer=tz_computer, islanding=islanding, resident=resident)
+    # Run at xx:x0:00 and xx:x5:00, skipping the runs that would overlap a long one
+    scheduler = Scheduler(mpc_controller.run, name='mpc', period=300,
+                          log_filename=os.path.join(mpc_controller.outdir, 'schedule.csv'))
+    scheduler.run()
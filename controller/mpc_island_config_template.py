@@ -7,9 +7,11 @@ import os
 
 tz_computer = 'UTC'
 islanding = True
+resident = True
 config={"model_config" :{'mopath' : os.path.join('models','SolarPlus.mo'),
                          'modelpath' : 'SolarPlus.Building.Optimization.StoreIsland',
                          'libraries' : os.getenv('MODELICAPATH'),
+                         'cache_dir' : os.path.join('models','cache'),
                          'measurements' : ['Trtu_west', 'Trtu_east', 'Tref', 'Tfre'],
                          'other_outputs' : ['Pnet', 'Prtu_west', 'Prtu_east', 'Pref', 'Pfre', 'Ppv', 'Grtu_west', 'Grtu_east'],
                          'sample_rate' : 3600,
@@ -28,7 +30,15 @@ config={"model_config" :{'mopath' : os.path.join('models','SolarPlus.mo'),
                         },
 
 "opt_config" :        {'problem'  : 'EnergyMin',
-                     'power_var': 'J'},
+                     'power_var': 'J',
+                     'backend': 'jmodelica',
+                     # Initial guess of the control from the previous solution, without states and duals
+                     'warm_start': True,
+                     # Non-uniform grid and move-blocking, not yet compared with the uniform grid
+                     # 'collocation': {'fine_horizon': 3600, 'fine_step': 300, 'coarse_step': 1800},
+                     # 'move_blocking': {'free_horizon': 3600, 'block_length': 3600},
+                     'time_budget': 240,
+                     'publish_plans': ['optimal', 'feasible_iterate', 'fallback']},
 
 "weather_config" :    {'vm'  : {'Outdoor':('weaTDryBul', units.degF),
                               'poa_pv':('weaPoaPv', units.W_m2),
@@ -81,6 +91,9 @@ config={"model_config" :{'mopath' : os.path.join('models','SolarPlus.mo'),
                                'Tfre':('Tfre',units.degF)
                                }
                         },
+"timing_config" :     {'filename' : os.path.join('controller','output','timing.jsonl'),
+                       'measurement' : 'mpc_timing',
+                       'influxdb' : False},
 "data_manager_config": {
     "site": "blr",
     "source": {
@@ -89,7 +102,14 @@ config={"model_config" :{'mopath' : os.path.join('models','SolarPlus.mo'),
             "Shadow/Constraints_Forecast.csv"
         ],
         "influxdb": {"config_filename":"database_client/config.yaml",
-                     "section": "database"}
+                     "section": "database",
+                     "batch_queries": True,
+                     # Time in s to keep the latest forecast times, the forecasts are issued hourly
+                     "forecast_ttl": 3300,
+                     "write_batch_size": 5000,
+                     "write_nonblocking": False,
+                     "cache": {"path": os.path.join("data", "influx_cache.sqlite"),
+                               "retention": 7*24*3600}}
     },
     "weather": {
         "type": "influxdb",
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the run archive, which appends the result frames of
+every controller run to files partitioned by frame name and day, and
+reads them back by run start time.
+
+The runs of a day are appended to a csv file per frame name.  With
+pyarrow, the csv files of past days are compacted into one parquet file
+per name and day when the first run of a later day is appended, or when
+compact is called, so that reads of past days only load the columns
+asked for.
+The archive folder is laid out as::
+
+    archive_dir/index.csv
+    archive_dir/<name>/<YYYY-MM-DD>.csv
+    archive_dir/<name>/<YYYY-MM-DD>.parquet
+
+where the index has one row per run and frame with the number of rows
+archived, and the partitions hold the rows of all runs started on that
+day (UTC) with the columns run_start and time in front.
+
+"""
+
+import csv
+import os
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    print("not importing pyarrow packages")
+
+class Run_Archive(object):
+    '''Day-partitioned archive of controller run results.
+
+    Parameters
+    ----------
+    archive_dir : str
+        Folder of the archive.  It is created if needed.
+    file_format : str, optional
+        'parquet' to compact the partitions of past days, or 'csv' to keep
+        them as csv.  Partitions of both formats are read.
+        Default is 'parquet' if pyarrow is available, otherwise 'csv'.
+    '''
+
+    def __init__(self, archive_dir, file_format=None):
+        '''Constructor.
+
+        '''
+        if file_format is None:
+            try:
+                pyarrow
+                file_format = 'parquet'
+            except NameError:
+                file_format = 'csv'
+        elif file_format not in ['parquet', 'csv']:
+            raise ValueError('Archive format "{0}" unknown or not available.'.format(file_format))
+        self.archive_dir = archive_dir
+        self.file_format = file_format
+        self.index_filename = os.path.join(self.archive_dir, 'index.csv')
+        self.current_day = None
+        if not os.path.exists(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+    def append(self, run_start, frames):
+        '''Append the frames of one run.
+
+        Parameters
+        ----------
+        run_start : pandas datetime
+            Start time of the run.
+        frames : dict
+            DataFrames with a time index keyed by name, e.g. 'control',
+            'measurements', 'other_outputs' and 'setpoints'.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        run_start = self._to_utc(run_start)
+        day = run_start.strftime('%Y-%m-%d')
+        index_rows = []
+        for name in sorted(frames):
+            df = frames[name]
+            if df is None:
+                continue
+            df = df.copy()
+            df.index = pd.DatetimeIndex(df.index)
+            if df.index.tz is None:
+                df.index = df.index.tz_localize('UTC')
+            df.index = df.index.tz_convert('UTC').strftime('%Y-%m-%d %H:%M:%S.%f')
+            df.index.name = 'time'
+            df.insert(0, 'run_start', run_start.strftime('%Y-%m-%d %H:%M:%S'))
+            folder = os.path.join(self.archive_dir, name)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            self._append_partition(os.path.join(folder, '{0}.csv'.format(day)), df)
+            index_rows.append([run_start.strftime('%Y-%m-%d %H:%M:%S'), name, day, len(df)])
+        write_header = not os.path.exists(self.index_filename)
+        with open(self.index_filename, 'a') as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(['run_start', 'name', 'day', 'rows'])
+            writer.writerows(index_rows)
+        if self.file_format == 'parquet' and day != self.current_day:
+            self.compact(before=day)
+            self.current_day = day
+
+        return None
+
+    def compact(self, before=None):
+        '''Compact the csv partitions into one parquet file per name and day.
+
+        A csv partition of a day that already has a parquet file, e.g. of
+        a late run, is merged into it.
+
+        Parameters
+        ----------
+        before : str, optional
+            Only compact the days before this day, as 'YYYY-MM-DD'.
+            Default is None for all days.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        for name in sorted(os.listdir(self.archive_dir)):
+            folder = os.path.join(self.archive_dir, name)
+            if not os.path.isdir(folder):
+                continue
+            for filename in sorted(os.listdir(folder)):
+                day, extension = os.path.splitext(filename)
+                if extension != '.csv' or (before is not None and day >= before):
+                    continue
+                partition = os.path.join(folder, day)
+                df = pd.concat(self._read_partition(partition), ignore_index=True)
+                df.to_parquet(partition + '.parquet', engine='pyarrow')
+                os.remove(partition + '.csv')
+
+        return None
+
+    def get_runs(self, start_time=None, final_time=None, name=None):
+        '''Get the archived runs.
+
+        Parameters
+        ----------
+        start_time : pandas datetime, optional
+            First run start time to return.
+        final_time : pandas datetime, optional
+            Last run start time to return.
+        name : str, optional
+            Only return runs that archived a frame of this name.
+
+        Returns
+        -------
+        runs : DataFrame
+            Frame name, partition day and number of rows with a UTC run
+            start time index.
+
+        '''
+
+        if not os.path.exists(self.index_filename):
+            return pd.DataFrame(columns=['name', 'day', 'rows'])
+        runs = pd.read_csv(self.index_filename, dtype={'name': str, 'day': str})
+        runs.index = pd.to_datetime(runs.pop('run_start'), format='%Y-%m-%d %H:%M:%S')
+        runs.index = runs.index.tz_localize('UTC')
+        runs.index.name = 'run_start'
+        runs = runs.sort_index()
+        if name is not None:
+            runs = runs[runs['name'] == name]
+        if start_time is not None or final_time is not None:
+            runs = runs[self._slice_time(start_time):self._slice_time(final_time)]
+
+        return runs
+
+    def read(self, name, start_time=None, final_time=None, usecols=None):
+        '''Read the frames of one name for a range of run start times.
+
+        Only the day partitions of the runs in the range are read.
+
+        Parameters
+        ----------
+        name : str
+            Name of the frames, e.g. 'control'.
+        start_time : pandas datetime, optional
+            First run start time to return.
+        final_time : pandas datetime, optional
+            Last run start time to return.
+        usecols : list, optional
+            Columns to read, all if None.
+
+        Returns
+        -------
+        df : DataFrame
+            Frames of all runs in the range with a (run_start, time)
+            index in UTC.
+
+        '''
+
+        runs = self.get_runs(start_time, final_time, name=name)
+        if usecols is not None:
+            usecols = ['run_start', 'time'] + [col for col in usecols if col not in ['run_start', 'time']]
+        dfs = []
+        for day in sorted(set(runs['day'])):
+            dfs.extend(self._read_partition(os.path.join(self.archive_dir, name, day), usecols))
+        if not dfs:
+            return pd.DataFrame()
+        df = pd.concat(dfs, ignore_index=True)
+        df['run_start'] = df['run_start'].dt.tz_localize('UTC')
+        df['time'] = df['time'].dt.tz_localize('UTC')
+        df = df.set_index(['run_start', 'time']).sort_index()
+        if start_time is not None:
+            df = df[df.index.get_level_values('run_start') >= self._slice_time(start_time)]
+        if final_time is not None:
+            df = df[df.index.get_level_values('run_start') <= self._slice_time(final_time)]
+
+        return df
+
+    def _read_partition(self, partition, usecols=None):
+        '''Read the csv and parquet files of a day partition.
+
+        Returns a list of frames with naive UTC run_start and time columns.
+
+        '''
+
+        dfs = []
+        if os.path.exists(partition + '.csv'):
+            df = pd.read_csv(partition + '.csv', usecols=usecols)
+            df['run_start'] = pd.to_datetime(df['run_start'], format='%Y-%m-%d %H:%M:%S')
+            df['time'] = pd.to_datetime(df['time'], format='%Y-%m-%d %H:%M:%S.%f')
+            dfs.append(df)
+        if os.path.exists(partition + '.parquet'):
+            if usecols is not None:
+                # Frames of a name may differ in columns between runs
+                columns = pyarrow.parquet.read_schema(partition + '.parquet').names
+                df = pd.read_parquet(partition + '.parquet', engine='pyarrow',
+                                     columns=[col for col in usecols if col in columns])
+            else:
+                df = pd.read_parquet(partition + '.parquet', engine='pyarrow')
+            dfs.append(df)
+
+        return dfs
+
+    def _append_partition(self, filename, df):
+        '''Append a frame to a partition file.
+
+        The partition is rewritten with the union of the columns if the
+        columns of the frame differ from those of the file.
+
+        '''
+
+        if not os.path.exists(filename):
+            df.to_csv(filename)
+            return None
+        with open(filename, 'r') as f:
+            header = next(csv.reader(f))
+        if header == [df.index.name] + list(df.columns):
+            df.to_csv(filename, mode='a', header=False)
+        else:
+            existing = pd.read_csv(filename, index_col=0)
+            pd.concat([existing, df], axis=0).to_csv(filename)
+
+        return None
+
+    def _to_utc(self, time):
+        '''Convert a time to a UTC pandas timestamp, assuming UTC if naive.
+
+        '''
+
+        time = pd.Timestamp(time)
+        if time.tzinfo is None:
+            return time.tz_localize('UTC')
+
+        return time.tz_convert('UTC')
+
+    def _slice_time(self, time):
+        '''Convert an optional slice bound to UTC.
+
+        '''
+
+        if time is None:
+            return None
+
+        return self._to_utc(time)
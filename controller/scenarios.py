@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the scenario optimizer, which solves the control
+optimization problem for several variants of the exodata, e.g. forecast
+perturbations, demand response events or price variants, in parallel
+worker processes and aggregates the solutions to one plan.
+
+Each worker keeps its own mpc object, and thereby its own compiled model
+and optimization problem, for the lifetime of the pool.  A worker solves
+different scenarios over time, so no plan is carried from one solve to
+the next for warm starts or fallbacks.
+
+"""
+
+import datetime
+import math
+import multiprocessing
+import shutil
+import tempfile
+import time
+import pandas as pd
+from data_manager import Data_Manager
+from model_cache import Model_Cache
+from mpc import mpc
+
+# mpc object of a worker process
+_worker_controller = None
+
+def _build_controller(config):
+    '''Instantiate an mpc object from a configuration dictionary.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration as returned by mpc_config.get_config().
+
+    Returns
+    -------
+    controller : mpc
+        New mpc object.
+
+    '''
+
+    controller = mpc(config['model_config'],
+                     config['opt_config'],
+                     config['system_config'],
+                     weather_config = config['weather_config'],
+                     control_config = config['control_config'],
+                     setpoints_config = config['setpoints_config'],
+                     other_input_config = config.get('other_input_config', None),
+                     constraint_config = config.get('constraint_config', None),
+                     data_manager_config = config['data_manager_config'],
+                     price_config = config.get('price_config', None))
+
+    return controller
+
+def _initialize_worker(config):
+    '''Build the mpc object of a worker process.
+
+    '''
+
+    global _worker_controller
+    _worker_controller = _build_controller(config)
+
+def _solve_scenario(args):
+    '''Solve the optimization problem of one scenario in a worker process.
+
+    Parameters
+    ----------
+    args : tuple
+        Name, start time, final time, data and time budget of the scenario.
+
+    Returns
+    -------
+    result : tuple
+        Name, control, measurements, other outputs and statistics of the
+        scenario.  The DataFrames are None if the solve failed.
+
+    '''
+
+    name, start_time, final_time, data, time_budget = args
+    # The optimization problem is instantiated in the first solve of a worker
+    init = _worker_controller.init_time is None
+    # The previous solve of the worker may be of another scenario
+    _worker_controller.last_plan = None
+    _worker_controller.previous_control = None
+    try:
+        control, measurements, other_outputs, statistics = _worker_controller.optimize(start_time, final_time,
+                                                                                        init = init,
+                                                                                        time_budget = time_budget,
+                                                                                        data = data)
+    except Exception as e:
+        return name, None, None, None, {'status': str(e), 'plan': 'infeasible'}
+
+    return name, control, measurements, other_outputs, statistics
+
+class Scenario_Optimizer(object):
+    '''Solve the control optimization problem for several exodata scenarios.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration as returned by mpc_config.get_config().
+    n_workers : int, optional
+        Number of worker processes.
+        Default is the number of CPUs.
+    aggregate : str, optional
+        Method to aggregate the scenario solutions, see aggregate_solutions.
+        Default is 'mean'.
+    historic_period : int, optional
+        Period in seconds of system data used for the state estimation.
+        Default is 30 minutes, as in mpc.optimize.
+    '''
+
+    def __init__(self, config, n_workers=None, aggregate='mean', historic_period=30*60):
+        '''Constructor.
+
+        '''
+        self.config = config
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.aggregate = aggregate
+        self.historic_period = historic_period
+        self.data_manager = Data_Manager(data_manager_config=config['data_manager_config'])
+        self.pool = None
+        # Private model cache of the workers if none is configured
+        self.model_dir = None
+
+    def start(self):
+        '''Compile the model if needed and start the worker processes.
+
+        The model is compiled once in this process and the workers load
+        it from the model cache, so that they never compile the same model
+        in the same folder at the same time.  Without
+        model_config['cache_dir'], a temporary cache is used until close.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        if self.pool is not None:
+            return None
+        config = self.config
+        model_config = config['model_config']
+        cache_dir = model_config.get('cache_dir', None)
+        if not cache_dir:
+            self.model_dir = tempfile.mkdtemp(prefix='scenario_models_')
+            cache_dir = self.model_dir
+            model_config = dict(model_config, cache_dir=cache_dir)
+            config = dict(config, model_config=model_config)
+        # Compile once in this process so that the workers load the cached model
+        model_cache = Model_Cache(cache_dir)
+        cache_key = model_cache.get_key(model_config['mopath'],
+                                        model_config['modelpath'],
+                                        model_config['libraries'])
+        if model_cache.get(cache_key) is None:
+            print('Compiling the model for the scenario workers...')
+            _build_controller(config)
+        print('Starting {0} scenario workers...'.format(self.n_workers))
+        self.pool = multiprocessing.Pool(processes=self.n_workers,
+                                         initializer=_initialize_worker,
+                                         initargs=(config,))
+
+        return None
+
+    def close(self):
+        '''Stop the worker processes.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.model_dir is not None:
+            shutil.rmtree(self.model_dir, ignore_errors=True)
+            self.model_dir = None
+
+        return None
+
+    def get_base_data(self, start_time, final_time):
+        '''Get the nominal data of the optimization from the data manager.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+
+        Returns
+        -------
+        data : dict
+            DataFrames keyed by configuration section.
+
+        '''
+
+        previous_time = start_time - datetime.timedelta(seconds=self.historic_period)
+        requests = {'system': (previous_time, start_time)}
+        for config_section in ['weather', 'other_input', 'constraint', 'price', 'control']:
+            if self.config.get('{0}_config'.format(config_section), None):
+                requests[config_section] = (start_time, final_time)
+
+        return self.data_manager.prepare_cycle_data(requests)
+
+    def optimize(self, start_time, final_time, scenarios, time_budget=None):
+        '''Solve the optimization problem of each scenario in parallel.
+
+        Parameters
+        ----------
+        start_time : pandas datetime
+            Start time of optimization
+        final_time : pandas datetime
+            Final time of optimization
+        scenarios : list of dict
+            Each scenario has a 'name' and, for any configuration section
+            ('weather', 'other_input', 'constraint', 'price'), either a
+            DataFrame replacing the nominal data or a function that takes
+            a copy of the nominal DataFrame and returns the variant.
+            A scenario without sections solves the nominal problem.
+        time_budget : float, optional
+            Time in seconds allowed for all scenarios.  It is split over
+            the rounds of scenarios the workers need to solve.
+            Default is opt_config['time_budget'] if given, otherwise no limit.
+
+        Returns
+        -------
+        solutions : dict
+            Control, measurements, other outputs and statistics keyed by
+            scenario name.
+        aggregate : tuple
+            Control, measurements, other outputs and statistics of the
+            aggregated plan, see aggregate_solutions.
+
+        '''
+
+        self.start()
+        optimize_start = time.time()
+        base_data = self.get_base_data(start_time, final_time)
+        tasks = []
+        for scenario in scenarios:
+            data = dict(base_data)
+            for config_section in scenario:
+                if config_section == 'name':
+                    continue
+                if config_section not in base_data:
+                    raise ValueError('Scenario section "{0}" unknown or not configured.'.format(config_section))
+                variant = scenario[config_section]
+                if callable(variant):
+                    variant = variant(base_data[config_section].copy())
+                data[config_section] = variant
+            tasks.append([scenario['name'], start_time, final_time, data, None])
+        # Split the remaining budget over the rounds of solves
+        if time_budget is None:
+            time_budget = self.config['opt_config'].get('time_budget', None)
+        if time_budget is not None:
+            rounds = int(math.ceil(len(tasks) / float(self.n_workers)))
+            scenario_budget = max((time_budget - (time.time() - optimize_start)) / rounds, 1.0)
+            for task in tasks:
+                task[4] = scenario_budget
+        solutions = dict()
+        for name, control, measurements, other_outputs, statistics in self.pool.map(_solve_scenario, [tuple(task) for task in tasks]):
+            solutions[name] = (control, measurements, other_outputs, statistics)
+            print('Scenario {0} ended with status {1}.'.format(name, statistics['status']))
+        aggregate = aggregate_solutions(solutions, method=self.aggregate)
+
+        return solutions, aggregate
+
+def aggregate_solutions(solutions, method='mean', plans=('optimal', 'feasible_iterate')):
+    '''Aggregate the solutions of several scenarios to one plan.
+
+    Parameters
+    ----------
+    solutions : dict
+        Control, measurements, other outputs and statistics keyed by
+        scenario name, as returned by Scenario_Optimizer.optimize.
+    method : str, optional
+        'mean' or 'median' to average the trajectories over the scenarios
+        at each time, or 'medoid' to select the solution of the scenario
+        whose control is closest to all others, so that the plan is one
+        that was actually solved.
+        Default is 'mean'.
+    plans : tuple, optional
+        Plan tags of the solutions to aggregate.
+        Default is ('optimal', 'feasible_iterate').
+
+    Returns
+    -------
+    control : DataFrame
+        Aggregated control.
+    measurements : DataFrame
+        Aggregated model measurements.
+    other_outputs : DataFrame
+        Aggregated other model outputs.
+    statistics : dict
+        Aggregation method, names of the aggregated 'scenarios' and 'plan',
+        which is 'infeasible' if no scenario could be aggregated.
+
+    '''
+
+    names = sorted(name for name in solutions if solutions[name][3].get('plan', None) in plans)
+    if not names:
+        return None, None, None, {'method': method, 'scenarios': [], 'plan': 'infeasible'}
+    # Align all solutions on a common time index
+    index = solutions[names[0]][0].index
+    for name in names[1:]:
+        index = index.union(solutions[name][0].index)
+    aligned = dict()
+    for name in names:
+        aligned[name] = [df.reindex(df.index.union(index)).interpolate(method='time').reindex(index).fillna(method='bfill')
+                         for df in solutions[name][:3]]
+    if method in ['mean', 'median']:
+        aggregate = []
+        for i in range(3):
+            df = pd.concat([aligned[name][i] for name in names])
+            if method == 'mean':
+                aggregate.append(df.groupby(level=0).mean())
+            else:
+                aggregate.append(df.groupby(level=0).median())
+    elif method == 'medoid':
+        distance = dict()
+        for name in names:
+            distance[name] = sum(((aligned[name][0] - aligned[other][0])**2).sum().sum() for other in names)
+        medoid = min(names, key=lambda name: distance[name])
+        aggregate = solutions[medoid][:3]
+    else:
+        raise ValueError('Aggregation method "{0}" unknown or not available.'.format(method))
+    statistics = {'method': method, 'scenarios': names, 'plan': 'optimal'}
+    if any(solutions[name][3]['plan'] != 'optimal' for name in names):
+        statistics['plan'] = 'feasible_iterate'
+
+    return aggregate[0], aggregate[1], aggregate[2], statistics
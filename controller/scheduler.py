@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the control scheduler, which runs a controller at
+times aligned to a fixed period, e.g. every 5 minutes on the clock.
+
+The scheduler sleeps until the next aligned time instead of polling the
+clock.  Runs never overlap: ticks that pass while a run is still going
+are skipped and counted.  For every run, the start delay after the tick
+(jitter), the duration and the outcome are recorded, together with the
+ticks skipped after it.
+
+"""
+
+import collections
+import math
+import os
+import time
+import pandas as pd
+
+columns = ['tick', 'controller', 'role', 'jitter', 'duration', 'late', 'skipped', 'status']
+
+class Scheduler(object):
+    '''Run a job at aligned times without overlap.
+
+    Parameters
+    ----------
+    job : callable
+        Function that runs the controller once.  It may return the name
+        of the controller that ran, under which the run is recorded, or a
+        tuple of the name and the role of the controller, e.g. 'shadow'.
+    name : str, optional
+        Name under which the runs are recorded if job returns None.
+        Default is 'controller'.
+    period : float, optional
+        Period of the runs in seconds.  Runs are aligned to multiples of
+        the period since epoch, e.g. xx:x0:00 and xx:x5:00 for 300.
+        Default is 300.
+    offset : float, optional
+        Time in seconds after the aligned times at which to run.
+        Default is 0.
+    late_tolerance : float, optional
+        Jitter in seconds above which a run counts as late.
+        Default is 10% of the period.
+    log_filename : str, optional
+        Path of a csv file to append the record of every run to.
+        Default is None for no file.
+    history : int, optional
+        Number of runs kept in memory for get_metrics.
+        Default is 1000.
+    clock : callable, optional
+        Function returning the time in seconds since epoch.
+        Default is time.time.
+    sleep : callable, optional
+        Function sleeping a number of seconds.
+        Default is time.sleep.
+    '''
+
+    def __init__(self, job, name='controller', period=300, offset=0, late_tolerance=None, log_filename=None,
+                 history=1000, clock=time.time, sleep=time.sleep):
+        '''Constructor.
+
+        '''
+        self.job = job
+        self.name = name
+        self.period = period
+        self.offset = offset
+        self.late_tolerance = late_tolerance if late_tolerance is not None else 0.1 * period
+        self.log_filename = log_filename
+        self.records = collections.deque(maxlen=history)
+        self.clock = clock
+        self.sleep = sleep
+        if self.log_filename:
+            folder = os.path.dirname(os.path.abspath(self.log_filename))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+    def get_next_tick(self, now):
+        '''Get the first aligned time after now.
+
+        Parameters
+        ----------
+        now : float
+            Time in seconds since epoch.
+
+        Returns
+        -------
+        tick : float
+            Next aligned time in seconds since epoch.
+
+        '''
+
+        return (math.floor((now - self.offset) / self.period) + 1) * self.period + self.offset
+
+    def wait_until(self, tick):
+        '''Sleep until the time tick.
+
+        Sleeps at most a minute at a time, so that changes of the computer
+        clock are followed.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        while True:
+            remaining = tick - self.clock()
+            if remaining <= 0:
+                return None
+            self.sleep(min(remaining, 60.))
+
+    def run_once(self, tick):
+        '''Run the job for the aligned time tick and record the run.
+
+        Parameters
+        ----------
+        tick : float
+            Aligned time in seconds since epoch of the run.
+
+        Returns
+        -------
+        record : dict
+            Record of the run, see columns.  'skipped' is set by run.
+
+        '''
+
+        run_start = self.clock()
+        role = ''
+        try:
+            name = self.job()
+            if isinstance(name, tuple):
+                name, role = name
+            status = 'ok'
+        except Exception as e:
+            name = None
+            status = 'error: {0}'.format(str(e))
+            print('Run ended in error, error={0}'.format(str(e)))
+        duration = self.clock() - run_start
+        jitter = run_start - tick
+        record = collections.OrderedDict([('tick', pd.Timestamp(tick, unit='s', tz='UTC')),
+                                          ('controller', name if name is not None else self.name),
+                                          ('role', role),
+                                          ('jitter', jitter),
+                                          ('duration', duration),
+                                          ('late', jitter > self.late_tolerance),
+                                          ('skipped', 0),
+                                          ('status', status)])
+        if status == 'ok':
+            print('{0} run ended ok in {1:.1f} s.'.format(record['controller'], duration))
+
+        return record
+
+    def run(self, max_runs=None):
+        '''Run the job at every aligned time.
+
+        Parameters
+        ----------
+        max_runs : int, optional
+            Number of runs after which to return.
+            Default is None to run forever.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        tick = self.get_next_tick(self.clock())
+        runs = 0
+        while max_runs is None or runs < max_runs:
+            self.wait_until(tick)
+            record = self.run_once(tick)
+            runs = runs + 1
+            # Skip the ticks that passed during the run
+            next_tick = self.get_next_tick(max(self.clock(), tick))
+            record['skipped'] = int(round((next_tick - tick) / self.period)) - 1
+            if record['skipped'] > 0:
+                print('{0} run took {1:.1f} s, skipped {2} runs.'.format(record['controller'], record['duration'], record['skipped']))
+            self.append(record)
+            tick = next_tick
+
+        return None
+
+    def append(self, record):
+        '''Keep the record of a run and append it to the log file.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        self.records.append(record)
+        if self.log_filename:
+            write_header = not os.path.exists(self.log_filename)
+            pd.DataFrame([record], columns=columns).to_csv(self.log_filename, mode='a', header=write_header, index=False)
+
+        return None
+
+    def get_metrics(self):
+        '''Get the run metrics of each controller over the recorded runs.
+
+        Returns
+        -------
+        metrics : DataFrame
+            Number of 'runs', 'errors', 'late' runs and 'skipped' ticks,
+            and mean and maximum of the 'jitter' and 'duration' in seconds,
+            indexed by controller.
+
+        '''
+
+        df = pd.DataFrame(list(self.records), columns=columns)
+        df['error'] = df['status'] != 'ok'
+        grouped = df.groupby('controller')
+        metrics = pd.DataFrame({'runs': grouped.size(),
+                                'errors': grouped['error'].sum().astype(int),
+                                'late': grouped['late'].sum().astype(int),
+                                'skipped': grouped['skipped'].sum().astype(int),
+                                'jitter_mean': grouped['jitter'].mean(),
+                                'jitter_max': grouped['jitter'].max(),
+                                'duration_mean': grouped['duration'].mean(),
+                                'duration_max': grouped['duration'].max()},
+                               columns=['runs', 'errors', 'late', 'skipped', 'jitter_mean', 'jitter_max',
+                                        'duration_mean', 'duration_max'])
+
+        return metrics
+
+def read_schedule_logs(filenames):
+    '''Read the logs of several schedulers side by side.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Paths of the log files, see Scheduler.
+
+    Returns
+    -------
+    df : DataFrame or None
+        Records indexed by tick, with the columns (field, controller),
+        e.g. ('duration', 'mpc').  None if none of the files exist.
+
+    '''
+
+    frames = [pd.read_csv(filename, parse_dates=['tick']) for filename in filenames if os.path.exists(filename)]
+    if not frames:
+        return None
+    df = pd.concat(frames)
+    df = df.drop_duplicates(['tick', 'controller'], keep='last')
+
+    return df.set_index(['tick', 'controller']).unstack('controller').sort_index()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+This module builds the XBOS actuation messages of the setpoints sent to
+the devices over WAVEMQ.  It is used by the data manager and by the xbos
+publisher in drivers/xbos_publisher.
+
+The setpoints are taken from the columns of the DataFrame as lists, and
+added to the repeated setpoints field of the message one field at a
+time, instead of going through the rows of the DataFrame.
+
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    # xboswave packages
+    from pyxbos import xbos_pb2
+    from pyxbos import flexstat_pb2
+    from pyxbos import parker_pb2
+    from pyxbos import rtac_pb2
+except ImportError:
+    print("not importing xbos packages")
+
+def get_message_type(device):
+    '''Get the actuation message type of a device.
+
+    Parameters
+    ----------
+    device : str
+        Topic of the device, e.g. 'flexstat/thermostat_east/actuation'.
+
+    Returns
+    -------
+    message_type : tuple or None
+        Actuation message class, name of its field in the XBOS message and
+        names of the setpoint fields.  None if the device type is unknown.
+
+    '''
+
+    if device.startswith("flexstat"):
+        return flexstat_pb2.FlexstatActuationMessage, 'flexstat_actuation_message', ['heating_setpoint', 'cooling_setpoint']
+    elif device.startswith("parker"):
+        return parker_pb2.ParkerActuationMessage, 'parker_actuation_message', ['setpoint', 'differential']
+    elif device.startswith("emulated_battery"):
+        return rtac_pb2.RtacActuationMessage, 'rtac_actuation_message', ['real_power_setpoint']
+    else:
+        return None
+
+def build_message(device, change_times, columns, now=None):
+    '''Build the actuation message of a device from setpoint arrays.
+
+    Parameters
+    ----------
+    device : str
+        Topic of the device.
+    change_times : array of int
+        Times in ns since epoch at which the setpoints apply.
+    columns : dict
+        Arrays of setpoint values keyed by setpoint field, e.g.
+        'heating_setpoint', each as long as change_times.  Fields the
+        device type does not have are ignored.
+    now : float, optional
+        Time in seconds since epoch of the message.
+        Default is the time of the computer clock.
+
+    Returns
+    -------
+    msg : xbos_pb2.XBOS or None
+        Actuation message, None if the device type is unknown or there are
+        no setpoints.
+
+    '''
+
+    message_type = get_message_type(device)
+    if message_type is None:
+        return None
+    actuation_class, xbos_field, setpoint_fields = message_type
+    fields = [field for field in setpoint_fields if field in columns]
+    change_times = np.asarray(change_times, dtype=np.int64).tolist()
+    if not fields or not change_times:
+        return None
+    if now is None:
+        now = time.time()
+
+    actuation = actuation_class(time=int(now * 1e9))
+    setpoints = [actuation.setpoints.add(change_time=change_time) for change_time in change_times]
+    for field in fields:
+        for setpoint, value in zip(setpoints, np.asarray(columns[field], dtype=float).tolist()):
+            getattr(setpoint, field).value = value
+
+    return xbos_pb2.XBOS(**{xbos_field: actuation})
+
+def build_messages(df, device_config, now=None):
+    '''Build the actuation messages of the devices from a setpoint DataFrame.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Setpoints with a time index.  Rows with a missing value are dropped.
+    device_config : dict
+        Setpoint fields of each device topic, mapped to columns of df, e.g.
+        {'flexstat/thermostat_east/actuation': {'heating_setpoint': 'Trtu_east_heat'}}.
+    now : float, optional
+        Time in seconds since epoch of the messages.
+        Default is the time of the computer clock.
+
+    Returns
+    -------
+    msgs : dict
+        Actuation message keyed by device topic.  Devices of unknown type
+        or without setpoints are left out.
+
+    '''
+
+    df = df.dropna()
+    change_times = pd.DatetimeIndex(df.index).asi8
+    if now is None:
+        now = time.time()
+    msgs = dict()
+    for device in device_config:
+        var_cfg = device_config[device]
+        columns = dict((variable, df[var_cfg[variable]].values) for variable in var_cfg)
+        msg = build_message(device, change_times, columns, now=now)
+        if msg is None:
+            print("no setpoints to publish to topic %s" % (device))
+        else:
+            msgs[device] = msg
+
+    return msgs
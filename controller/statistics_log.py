@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the statistics log, an append-only csv file with
+one row per optimization and a fixed set of columns, and the functions
+to read it back for trend analysis.
+
+"""
+
+import csv
+import json
+import os
+import pandas as pd
+
+# Columns of the log, in order
+columns = ['time', 'horizon', 'backend', 'status', 'plan', 'iterations',
+           'objective', 'solve_time', 'warm_start', 'iterations_saved',
+           'solve_time_saved', 'solver_options']
+
+class Statistics_Log(object):
+    '''Append-only log of optimization statistics.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the csv file.  The folder is created if needed.
+    '''
+
+    def __init__(self, filename):
+        '''Constructor.
+
+        '''
+        self.filename = filename
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def append(self, run_time, statistics, horizon=None, solver_options=None):
+        '''Append the statistics of one optimization.
+
+        Parameters
+        ----------
+        run_time : pandas datetime
+            Start time of the optimization horizon.
+        statistics : dict
+            Statistics as returned by mpc.optimize.
+        horizon : float, optional
+            Length of the optimization horizon in seconds.
+        solver_options : dict, optional
+            Solver options as returned by mpc.get_solver_options.  The key
+            'backend' gets its own column, the others are saved as JSON.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        run_time = pd.Timestamp(run_time)
+        if run_time.tzinfo is None:
+            run_time = run_time.tz_localize('UTC')
+        solver_options = dict(solver_options or {})
+        row = dict((key, statistics.get(key, '')) for key in columns)
+        row['time'] = run_time.tz_convert('UTC').strftime('%Y-%m-%d %H:%M:%S')
+        row['horizon'] = '' if horizon is None else horizon
+        row['backend'] = solver_options.pop('backend', '')
+        row['status'] = str(row['status']).replace('\n', ' ')
+        row['solver_options'] = json.dumps(solver_options, sort_keys=True, default=str) if solver_options else ''
+        write_header = not os.path.exists(self.filename)
+        with open(self.filename, 'a') as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(columns)
+            writer.writerow([row[key] for key in columns])
+
+        return None
+
+    def read(self, start_time=None, final_time=None, usecols=None):
+        '''Read the logged statistics.
+
+        Parameters
+        ----------
+        start_time : pandas datetime, optional
+            First run time to return.
+        final_time : pandas datetime, optional
+            Last run time to return.
+        usecols : list, optional
+            Columns to read, all if None.  Reading only the needed columns
+            is faster for long logs.
+
+        Returns
+        -------
+        df : DataFrame
+            Statistics with a UTC time index.
+
+        '''
+
+        return read_statistics(self.filename, start_time=start_time, final_time=final_time, usecols=usecols)
+
+def read_statistics(filename, start_time=None, final_time=None, usecols=None):
+    '''Read a statistics log.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the csv file.
+    start_time : pandas datetime, optional
+        First run time to return.
+    final_time : pandas datetime, optional
+        Last run time to return.
+    usecols : list, optional
+        Columns to read, all if None.
+
+    Returns
+    -------
+    df : DataFrame
+        Statistics with a UTC time index.
+
+    '''
+
+    if usecols is not None:
+        usecols = ['time'] + [key for key in usecols if key != 'time']
+    df = pd.read_csv(filename, usecols=usecols,
+                     dtype={'status': str, 'plan': str, 'backend': str, 'solver_options': str})
+    df.index = pd.to_datetime(df.pop('time'), format='%Y-%m-%d %H:%M:%S')
+    df.index = df.index.tz_localize('UTC')
+    df.index.name = 'time'
+    df = df.sort_index()
+    if start_time is not None or final_time is not None:
+        df = df[start_time:final_time]
+
+    return df
+
+def summarize_statistics(df, freq='D'):
+    '''Summarize logged statistics over periods for trend analysis.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Statistics as returned by read_statistics.
+    freq : str, optional
+        Length of the periods as pandas frequency.
+        Default is 'D'.
+
+    Returns
+    -------
+    summary : DataFrame
+        Number of runs, fraction of optimal plans and mean and maximum of
+        solve time and iterations for each period.
+
+    '''
+
+    resampler = df.resample(freq)
+    summary = pd.DataFrame({'runs': resampler.size()})
+    if 'plan' in df.columns:
+        summary['optimal_fraction'] = (df['plan'] == 'optimal').astype(float).resample(freq).mean()
+    for key in ['solve_time', 'iterations']:
+        if key in df.columns:
+            summary['{0}_mean'.format(key)] = resampler[key].mean()
+            summary['{0}_max'.format(key)] = resampler[key].max()
+
+    return summary
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the phase timer, which measures the time spent in
+each phase of a control cycle, and the timing log, which writes one
+record per cycle to a JSON lines or csv file and optionally to InfluxDB.
+
+"""
+
+import collections
+import contextlib
+import json
+import os
+import time
+import pandas as pd
+
+class Phase_Timer(object):
+    '''Accumulate the time spent in named phases of a control cycle.
+
+    Phases are kept in the order they are first entered.  Entering the
+    same phase several times in a cycle adds up the durations.
+    '''
+
+    def __init__(self):
+        '''Constructor.
+
+        '''
+        self.phases = collections.OrderedDict()
+
+    def reset(self):
+        '''Clear the phases to start a new cycle.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        self.phases = collections.OrderedDict()
+
+        return None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Time the enclosed block as phase name.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+
+        '''
+
+        phase_start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - phase_start)
+
+    def add(self, name, duration):
+        '''Add a duration to a phase.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+        duration : float
+            Duration in seconds.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        self.phases[name] = self.phases.get(name, 0.) + duration
+
+        return None
+
+    def get_record(self):
+        '''Get the phase durations of the current cycle.
+
+        Returns
+        -------
+        record : collections.OrderedDict
+            Duration in seconds keyed by phase name.
+
+        '''
+
+        return collections.OrderedDict(self.phases)
+
+class Timing_Log(object):
+    '''Write the phase timings of each control cycle.
+
+    Parameters
+    ----------
+    filename : str, optional
+        Path of the log file.  Files ending with .csv get one row per
+        phase with the columns time, phase and seconds, all other files
+        get one JSON object per cycle and line.
+        Default is None for no file.
+    influx_client : influxdb.DataFrameClient, optional
+        Client to also write the records to InfluxDB.
+    measurement : str, optional
+        InfluxDB measurement of the records.
+        Default is 'mpc_timing'.
+    '''
+
+    def __init__(self, filename=None, influx_client=None, measurement='mpc_timing'):
+        '''Constructor.
+
+        '''
+        self.filename = filename
+        self.influx_client = influx_client
+        self.measurement = measurement
+        if self.filename:
+            folder = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+    def write(self, cycle_time, record, data_manager=None):
+        '''Append the record of one cycle.
+
+        Parameters
+        ----------
+        cycle_time : pandas datetime
+            Start time of the cycle.
+        record : dict
+            Duration in seconds keyed by phase name.
+        data_manager : data_manager.Data_Manager, optional
+            Data manager used to write to InfluxDB.  Required if the log
+            has an influx_client.
+
+        Returns
+        -------
+        None
+
+        '''
+
+        cycle_time = pd.Timestamp(cycle_time)
+        if self.filename:
+            if self.filename.endswith('.csv'):
+                write_header = not os.path.exists(self.filename)
+                with open(self.filename, 'a') as f:
+                    if write_header:
+                        f.write('time,phase,seconds\n')
+                    for phase in record:
+                        f.write('{0},{1},{2:.6f}\n'.format(cycle_time.isoformat(), phase, record[phase]))
+            else:
+                line = collections.OrderedDict([('time', cycle_time.isoformat())])
+                line.update(record)
+                with open(self.filename, 'a') as f:
+                    f.write(json.dumps(line) + '\n')
+        if self.influx_client is not None and data_manager is not None:
+            if cycle_time.tzinfo is None:
+                cycle_time = cycle_time.tz_localize('UTC')
+            df = pd.DataFrame(record, index=[cycle_time], columns=list(record.keys()))
+            data_manager.write_df_to_influx(df=df, influx_dataframe_client=self.influx_client, measurement=self.measurement)
+
+        return None
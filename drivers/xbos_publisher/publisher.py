@@ -3,19 +3,21 @@ try:
     from pyxbos.wavemq_pb2 import *
     from pyxbos.wavemq_pb2_grpc import *
     from grpc import insecure_channel
-
-    import pyxbos.flexstat_pb2 as flexstat_pb2
-    import pyxbos.xbos_pb2 as xbos_pb2
-    from pyxbos import nullabletypes_pb2 as types
 except ImportError:
     print("not importing xbos packages")
 
+import os
+import sys
 import pandas as pd
 import time
 import datetime
 import pytz
 import base64
 import yaml
+# Add ../../controller to path for the setpoint message builder
+repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(repo_dir, 'controller'))
+from setpoint_messages import build_messages
 
 def create_setpoints_df(start_date):
     tz_local = pytz.timezone("US/Pacific")
@@ -63,56 +65,9 @@ def ensure_b64decode(e):
 
 
 def get_wavemq_msg_dictionary(setpoint_df, device_config):
-    df = setpoint_df.copy()
-    df = df.dropna()
-
-    msg_dict = {}
-    for device in device_config:
-        var_cfg = device_config[device]
-
-        relevant_df_cols = []
-        relevant_new_col_names = []
-        for variable in var_cfg:
-            df_var_name = var_cfg[variable]
-            relevant_df_cols.append(df_var_name)
-            relevant_new_col_names.append(variable)
-
-        device_df = df[relevant_df_cols]
-        device_df.columns = relevant_new_col_names
-
-        #     print(device_df.head())
-
-        setpoint_list = []
-        if device.startswith("flexstat"):
-            for index, row in device_df.iterrows():
-                change_time = int(index.value)
-                hsp = row.get('heating_setpoint', None)
-                csp = row.get('cooling_setpoint', None)
-
-                if hsp != None and csp != None:
-                    setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                              heating_setpoint=types.Double(value=hsp),
-                                                              cooling_setpoint=types.Double(value=csp))
-                elif hsp != None:
-                    setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                              heating_setpoint=types.Double(value=hsp))
-                elif csp != None:
-                    setpoint = flexstat_pb2.FlexstatSetpoints(change_time=change_time,
-                                                              cooling_setpoint=types.Double(value=csp))
-                else:
-                    setpoint = None
-
-                if setpoint != None:
-                    setpoint_list.append(setpoint)
-            msg = xbos_pb2.XBOS(
-                flexstat_actuation_message=flexstat_pb2.FlexstatActuationMessage(
-                    time=int(time.time() * 1e9),
-                    setpoints=setpoint_list
-                )
-            )
-            msg_dict[device] = msg
-
-            print("created message to publish on to wavemq to topic %s" % (device))
+    msg_dict = build_messages(setpoint_df, device_config)
+    for device in msg_dict:
+        print("created message to publish on to wavemq to topic %s" % (device))
 
     return msg_dict
 
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+This script converts csv data files to parquet or feather files for the
+parquet_files source of the data manager.
+
+The time index is converted to UTC and stored sorted in a column named
+time, so that reads of a time range can skip the row groups outside of
+the range.
+
+Usage::
+
+    python process/convert_to_parquet.py data/Temperature.csv data/Constraint.csv
+
+"""
+
+import argparse
+import os
+import pandas as pd
+import pyarrow
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+
+def convert(csvpath, outpath=None, tz='America/Los_Angeles', row_group_size=24*60):
+    '''Convert a csv data file with a local time index.
+
+    Parameters
+    ----------
+    csvpath : str
+        Path of the csv file, with the time in the first column.
+    outpath : str, optional
+        Path of the output file, ending with .parquet or .feather.
+        Default is csvpath with the extension .parquet.
+    tz : str, optional
+        Time zone of the time index in the csv file.
+        Default is 'America/Los_Angeles'.
+    row_group_size : int, optional
+        Number of rows per parquet row group.
+        Default is one day of minute data.
+
+    Returns
+    -------
+    outpath : str
+        Path of the output file.
+
+    '''
+
+    if outpath is None:
+        outpath = os.path.splitext(csvpath)[0] + '.parquet'
+    df = pd.read_csv(csvpath, index_col=0, parse_dates=True)
+    df = df.tz_localize(tz).tz_convert('UTC').tz_localize(None)
+    df.index = pd.to_datetime(df.index)
+    df.index.name = 'time'
+    df = df.sort_index().reset_index()
+    df.columns = [str(column) for column in df.columns]
+    if outpath.endswith('.feather'):
+        feather.write_feather(df, outpath)
+    else:
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(table, outpath, row_group_size=row_group_size)
+    print('Converted {0} to {1}.'.format(csvpath, outpath))
+
+    return outpath
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert csv data files to parquet or feather files.')
+    parser.add_argument('csvpaths', nargs='+', help='csv files to convert')
+    parser.add_argument('--tz', default='America/Los_Angeles', help='time zone of the csv time index')
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'feather'], help='output file format')
+    parser.add_argument('--row-group-size', type=int, default=24*60, help='rows per parquet row group')
+    args = parser.parse_args()
+    for csvpath in args.csvpaths:
+        outpath = os.path.splitext(csvpath)[0] + '.' + args.format
+        convert(csvpath, outpath=outpath, tz=args.tz, row_group_size=args.row_group_size)
@@ -11,7 +11,8 @@ from mpcpy import systems, exodata, units, variables
 
 class emulator(object):
 
-    def __init__(self, use_data_manager_in_emulator=False, data_manager=None, outdir=None):
+    def __init__(self, use_data_manager_in_emulator=False, data_manager=None, outdir=None, data_path='data',
+                 mopath=os.path.join('models','SolarPlus.mo')):
 
         weather_vm = {'Outdoor': ('weaTDryBul', units.degC),
                       'poa_pv': ('weaPoaPv', units.W_m2),
@@ -35,14 +36,13 @@ class emulator(object):
             self.setpoints = exodata.OtherInputFromDF(setpoints_df, setpoints_vm)
         else:
             self.outdir = outdir
-            csvpath_weather = os.path.join('data','Temperature.csv')
+            csvpath_weather = os.path.join(data_path,'Temperature.csv')
             self.weather = exodata.WeatherFromCSV(csvpath_weather, weather_vm, geography)
-            csvpath_setpoints = os.path.join('data','setpoints.csv')
+            csvpath_setpoints = os.path.join(data_path,'setpoints.csv')
             self.setpoints = exodata.OtherInputFromCSV(csvpath_setpoints, setpoints_vm)
 
         # Emulator
         # Model information
-        mopath = 'models/SolarPlus.mo'
         modelpath = 'SolarPlus.Building.Emulation.Store'
         libraries = []
         self.moinfo = (mopath, modelpath, libraries)
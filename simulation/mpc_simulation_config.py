@@ -11,6 +11,7 @@ import os
 config={"model_config" :{'mopath' : os.path.join('models','SolarPlus.mo'),
                          'modelpath' : 'SolarPlus.Building.Optimization.Store',
                          'libraries' : os.getenv('MODELICAPATH'),
+                         'cache_dir' : os.path.join('models','cache'),
                          'measurements' : ['Trtu', 'Tref', 'Tfre', 'SOC', 'Pbattery'],
                          'other_outputs' : ['Pnet', 'Prtu', 'Pref', 'Pfre', 'Pbattery', 'Grtu'],
                          'sample_rate' : 3600,
@@ -4,14 +4,22 @@ This script runs a simulation of the MPC controller for the convenience
 store.  A version of the MPC model with feedback control is used to
 represent the real building.
 
+The simulation loop is the function run_simulation, which sweep.py runs
+for several episodes in parallel.
+
 """
 
+from __future__ import division
 from mpcpy import exodata, units, systems, variables
 import os
+import copy
+import time
 from datetime import timedelta
 import pandas as pd
 import numpy as np
 from controller.mpc import mpc
+from controller.statistics_log import Statistics_Log, read_statistics
+from controller.baseline_backtest import get_cost
 import mpc_simulation_config as mpc_config
 from emulator import emulator
 import pytz
@@ -22,34 +30,107 @@ sim_start_time = '6/1/2018 00:00:00'
 sim_final_time = '6/2/2018 00:00:00'
 tz_name = 'America/Los_Angeles'
 sim_control_step = 1*3600
-controller = 'mpc'
 mpc_horizon = 24*3600
-emulation_states_csv = "data/emulation_states.csv"
 
-# Initialize
-# ==========================================================================
-# Create output directory
-cwd = os.getcwd()
-outdir = os.path.join('simulation', 'output')
-# Define simulation steps
-sim_steps = pd.date_range(sim_start_time,
-                          sim_final_time,
-                          freq = '{0}s'.format(sim_control_step))
 tz_local = pytz.timezone("America/Los_Angeles")
 tz_utc = pytz.timezone("UTC")
 
-sim_steps = sim_steps.tz_localize(tz_local).tz_convert(tz_utc)
-
-iterations = range(len(sim_steps))
-# Save setup
-with open(outdir+'/mpc_setup.txt', 'w') as f:
-    f.write(str(sim_start_time) +'\n')
-    f.write(str(sim_final_time) +'\n')
-    f.write(str(sim_control_step) +'\n')
-    f.write(str(mpc_horizon) +'\n')
-# Instantiate controller
-if controller is 'mpc':
-    config = mpc_config.get_config()
+def write_initial_states(config, start_time, filename):
+    '''Write the initial emulation states of the model configuration, read by the controller as system data.
+
+    Parameters
+    ----------
+    config : dict
+        Simulation configuration, see mpc_simulation_config.
+    start_time : pandas datetime
+        Time of the states, in UTC.
+    filename : str
+        Path of the csv file, replaced if it exists.
+
+    Returns
+    -------
+    None
+
+    '''
+
+    parameters = pd.DataFrame(config['model_config']['parameters']).set_index('Name')
+    df_initial_states = pd.DataFrame(index=[start_time])
+    df_initial_states.index.name = 'Time'
+    for state in config['model_config']['init_vm']:
+        df_initial_states[config['model_config']['init_vm'][state]] = parameters.loc[state, 'Value']
+    if os.path.exists(filename):
+        os.remove(filename)
+    df_initial_states.to_csv(filename)
+
+    return None
+
+def run_simulation(sim_start_time, sim_final_time, outdir, config=None, data_path='data',
+                   sim_control_step=sim_control_step, mpc_horizon=mpc_horizon):
+    '''Run the closed loop of the mpc and the emulator over a period.
+
+    Parameters
+    ----------
+    sim_start_time : str
+        Start of the simulation in local time.
+    sim_final_time : str
+        End of the simulation in local time.
+    outdir : str
+        Folder of the result files, created if needed.
+    config : dict, optional
+        Simulation configuration, see mpc_simulation_config.
+        Default is mpc_simulation_config.get_config().
+    data_path : str, optional
+        Folder of the data files of the data manager and the emulator.
+        The emulation states and the setpoints are written to it, so
+        simulations running at the same time need their own folder.
+        Default is 'data'.
+    sim_control_step : int, optional
+        Control step in seconds.
+        Default is 3600.
+    mpc_horizon : int, optional
+        Optimization horizon in seconds.
+        Default is 24*3600.
+
+    Returns
+    -------
+    kpis : dict
+        'energy_cost', 'demand_cost', 'total_cost' in $ and 'peak_power'
+        in kW of the emulated net power (see
+        baseline_backtest.get_cost), 'net_energy' in kWh, 'final_soc',
+        the number of 'optimizations', the 'optimal_fraction' of the
+        plans, the mean and maximum 'solve_time' and the 'wall_time' of
+        the simulation in seconds.
+
+    '''
+
+    wall_start = time.time()
+    if config is None:
+        config = mpc_config.get_config()
+    config = copy.deepcopy(config)
+    config['data_manager_config']['data_path'] = data_path
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    # Define simulation steps
+    sim_steps = pd.date_range(sim_start_time,
+                              sim_final_time,
+                              freq = '{0}s'.format(sim_control_step))
+    sim_steps = sim_steps.tz_localize(tz_local).tz_convert(tz_utc)
+    iterations = range(len(sim_steps))
+    # Save setup
+    with open(outdir+'/mpc_setup.txt', 'w') as f:
+        f.write(str(sim_start_time) +'\n')
+        f.write(str(sim_final_time) +'\n')
+        f.write(str(sim_control_step) +'\n')
+        f.write(str(mpc_horizon) +'\n')
+    # Log solver statistics of all steps in one file
+    statistics_csv = os.path.join(outdir, 'statistics.csv')
+    if os.path.exists(statistics_csv):
+        os.remove(statistics_csv)
+    statistics_log = Statistics_Log(statistics_csv)
+    # Initialize emulator states for controller, before the controller reads them
+    emulation_states_csv = os.path.join(data_path, 'emulation_states.csv')
+    write_initial_states(config, sim_steps[0], emulation_states_csv)
+    # Instantiate controller
     controller = mpc(config['model_config'],
                      config['opt_config'],
                      config['system_config'],
@@ -60,72 +141,99 @@ if controller is 'mpc':
                      data_manager_config = config['data_manager_config'],
                      price_config = config['price_config'])
 
-# Instantiate emulator to None
-emu = None
-#use_data_manager_in_emulator = config.get("use_data_manager_in_emulator", False)
-use_data_manager_in_emulator = config.get("use_data_manager_in_emulator", False)
-
-# Initialize emulator states for controller
-# Remove previous simulation if exists
-if os.path.exists(emulation_states_csv):
-    os.remove(emulation_states_csv)
-# Get states and names from configuration
-initial_states = []
-initial_names = []
-df_initial_states = pd.DataFrame(index=[sim_steps[0]])
-df_initial_states.index.name = 'Time'
-for state in config['model_config']['init_vm']:
-    value = controller.parameter.display_data().loc[state,'Value']
-    df_initial_states[config['model_config']['init_vm'][state]] = value
-# Save per configuration
-df_initial_states.to_csv(emulation_states_csv)
-
-
-# Simulation Loop
-# ==========================================================================
-for i in iterations[:-1]:
-    # Set optimization horizon time
-    opt_start_time = sim_steps[i]
-    opt_final_time = sim_steps[i]+timedelta(seconds=mpc_horizon)
-    print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
-    print('Running simulation step {0} to {1}...'.format(sim_steps[i], sim_steps[i+1]))
-    print('Optimization horizon is {0} to {1}...'.format(opt_start_time, opt_final_time))
-    # Solve optimal control problem
-    if i is 0:
-        init = True
-    else:
-        init = False
-    control, measurements, other_outputs, statistics = controller.optimize(opt_start_time, opt_final_time, init=init)
-    # Save optimization result data
-    control.to_csv(outdir+'/control_{0}.csv'.format(i))
-    measurements.to_csv(outdir+'/measurements_{0}.csv'.format(i))
-    other_outputs.to_csv(outdir+'/other_outputs_{0}.csv'.format(i))
-    if i == 0:
-        open_as = 'w'
-    else:
-        open_as = 'a'
-    with open(outdir+'/optimal_statistics_{0}.txt'.format(i), open_as) as f:
-        f.write(str(sim_steps[i]) + ': ' +  str(statistics) + '\n')
-    # Push setpoints
-    setpoints = controller.set_setpoints(control, measurements)
-#    # Simulate optimal control to check
-#    sim_measurements, sim_other_outputs = controller.simulate(opt_start_time, opt_final_time, optimal=True)
-#    # Save optimization simulation data
-#    sim_measurements.to_csv(outdir+'/sim_measurements_{0}.csv'.format(i))
-#    sim_other_outputs.to_csv(outdir+'/sim_other_outputs_{0}.csv'.format(i))
-    # Simulate emulator
-    emu_final_time = sim_steps[i+1]
-    if i is 0:
-        emu_start_time = sim_steps[i]
-    else:
-        emu_start_time = 'continue'
-
-    if emu == None:
-        # Instantiate emulator
-        emu = emulator(use_data_manager_in_emulator=use_data_manager_in_emulator, data_manager=controller.data_manager, outdir=outdir)
-
-    emu_measurements = emu.simulate(emu_start_time, emu_final_time)
-    # Save emulator data
-    emu_measurements.to_csv(outdir+'/emu_measurements_{0}.csv'.format(i))
-    # Output emulation states
-    emu_measurements.to_csv('data/emulation_states.csv')
+    # Instantiate emulator to None
+    emu = None
+    use_data_manager_in_emulator = config.get("use_data_manager_in_emulator", False)
+    emu_frames = []
+
+    # Simulation Loop
+    # ==========================================================================
+    for i in iterations[:-1]:
+        # Set optimization horizon time
+        opt_start_time = sim_steps[i]
+        opt_final_time = sim_steps[i]+timedelta(seconds=mpc_horizon)
+        print('\n%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+        print('Running simulation step {0} to {1}...'.format(sim_steps[i], sim_steps[i+1]))
+        print('Optimization horizon is {0} to {1}...'.format(opt_start_time, opt_final_time))
+        # Solve optimal control problem
+        init = i == 0
+        control, measurements, other_outputs, statistics = controller.optimize(opt_start_time, opt_final_time, init=init)
+        # Save optimization result data
+        control.to_csv(outdir+'/control_{0}.csv'.format(i))
+        measurements.to_csv(outdir+'/measurements_{0}.csv'.format(i))
+        other_outputs.to_csv(outdir+'/other_outputs_{0}.csv'.format(i))
+        statistics_log.append(sim_steps[i], statistics, horizon=mpc_horizon,
+                              solver_options=controller.get_solver_options())
+        # Push setpoints
+        setpoints = controller.set_setpoints(control, measurements, plan=statistics['plan'])
+        # Simulate emulator
+        emu_final_time = sim_steps[i+1]
+        if i == 0:
+            emu_start_time = sim_steps[i]
+        else:
+            emu_start_time = 'continue'
+
+        if emu is None:
+            # Instantiate emulator
+            emu = emulator(use_data_manager_in_emulator=use_data_manager_in_emulator, data_manager=controller.data_manager,
+                           outdir=outdir, data_path=data_path, mopath=config['model_config']['mopath'])
+
+        emu_measurements = emu.simulate(emu_start_time, emu_final_time)
+        # Save emulator data
+        emu_measurements.to_csv(outdir+'/emu_measurements_{0}.csv'.format(i))
+        emu_frames.append(emu_measurements)
+        # Output emulation states
+        emu_measurements.to_csv(emulation_states_csv)
+
+    # Net power and prices of the whole simulation, to merge the costs of several simulations
+    emu_measurements = pd.concat(emu_frames)
+    emu_measurements = emu_measurements[~emu_measurements.index.duplicated(keep='last')].sort_index()
+    price = controller.data_manager.get_data_from_config("price", sim_steps[0], sim_steps[-1])
+    price = price.reindex(price.index.union(emu_measurements.index)).fillna(method='ffill')
+    net_power = pd.DataFrame({'Pnet': emu_measurements['Pnet']}, index=emu_measurements.index)
+    net_power = net_power.join(price[[column for column in ['pi_e', 'pi_d'] if column in price]])
+    net_power.to_csv(os.path.join(outdir, 'net_power.csv'))
+
+    return get_kpis(net_power, statistics_csv, emu_measurements['SOC'].iloc[-1], time.time() - wall_start)
+
+def get_kpis(net_power, statistics_csv, final_soc=np.nan, wall_time=np.nan):
+    '''Get the KPIs of a simulation.
+
+    Parameters
+    ----------
+    net_power : DataFrame
+        Emulated 'Pnet' in W, and 'pi_e' in $/kWh and optionally 'pi_d'
+        in $/kW.
+    statistics_csv : str
+        Path of the statistics log of the simulation.
+    final_soc : float, optional
+        State of charge at the end of the simulation.
+    wall_time : float, optional
+        Duration of the simulation in seconds.
+
+    Returns
+    -------
+    kpis : dict
+        See run_simulation.
+
+    '''
+
+    kpis = get_cost(net_power['Pnet'], net_power)
+    dt = np.append(np.diff(net_power.index.asi8) / 1e9 / 3600, 0)
+    kpis['net_energy'] = np.nansum(net_power['Pnet'].values * dt) / 1000
+    kpis['final_soc'] = final_soc
+    statistics = read_statistics(statistics_csv, usecols=['plan', 'solve_time'])
+    kpis['optimizations'] = len(statistics)
+    kpis['optimal_fraction'] = (statistics['plan'] == 'optimal').mean() if len(statistics) > 0 else np.nan
+    kpis['solve_time_mean'] = statistics['solve_time'].mean()
+    kpis['solve_time_max'] = statistics['solve_time'].max()
+    kpis['wall_time'] = wall_time
+
+    return kpis
+
+if __name__ == '__main__':
+    outdir = os.path.join('simulation', 'output')
+    config = mpc_config.get_config()
+    kpis = run_simulation(sim_start_time, sim_final_time, outdir, config=config, data_path='data',
+                          sim_control_step=sim_control_step, mpc_horizon=mpc_horizon)
+    print(pd.Series(kpis).to_string())
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+This script runs closed loop simulations of the MPC controller for many
+episodes in parallel, and merges their KPIs.
+
+An episode is one simulation period, e.g. one day, with one configuration
+variant.  Each episode runs in its own process with its own mpc and
+emulator, with its own folder and copy of the data files, so that the
+emulation states and setpoints files of the episodes are separate.  The
+relative paths of the configuration are made absolute from the working
+folder of the sweep, see get_episode_config.
+Episodes start from the initial states of the model configuration, not
+from the end of the previous episode.
+
+Usage::
+
+    python simulation/sweep.py --start 6/1/2018 --end 6/8/2018 --episode_days 1 --variants variants.json
+
+where variants.json maps variant names to changes of the configuration,
+e.g. {"demand": {"opt_config": {"problem": "EnergyPlusDemandCostMin"}}}.
+
+"""
+
+from __future__ import division
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import traceback
+import pandas as pd
+from controller.baseline_backtest import get_cost
+import mpc_simulation_config as mpc_config
+from simulate import run_simulation, sim_control_step, mpc_horizon
+
+def update_config(config, changes):
+    '''Apply nested changes to a configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration, modified in place.
+    changes : dict
+        Values replacing those of config.  Dictionaries are merged with
+        the dictionaries of config, other values replace them.
+
+    Returns
+    -------
+    config : dict
+        The updated configuration.
+
+    '''
+
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(config.get(key, None), dict):
+            update_config(config[key], value)
+        else:
+            config[key] = value
+
+    return config
+
+def get_episodes(start_time, final_time, episode_days=1, variants=None):
+    '''Partition a simulation period and configuration variants into episodes.
+
+    Parameters
+    ----------
+    start_time : str
+        Start of the period in local time.
+    final_time : str
+        End of the period in local time.
+    episode_days : int, optional
+        Length of the episodes in days, the last one may be shorter.
+        Default is 1.
+    variants : dict, optional
+        Configuration changes keyed by variant name, see update_config.
+        Default is None for the configuration as is, named 'base'.
+
+    Returns
+    -------
+    episodes : list of dict
+        'name', 'variant', 'changes', 'start_time' and 'final_time' of
+        each episode.
+
+    '''
+
+    variants = variants or {'base': {}}
+    starts = pd.date_range(start_time, final_time, freq='{0}D'.format(episode_days))
+    final_time = pd.Timestamp(final_time)
+    episodes = []
+    for variant in sorted(variants):
+        for start in starts:
+            final = min(start + pd.Timedelta(days=episode_days), final_time)
+            if final <= start:
+                continue
+            episodes.append({'name': '{0}_{1}'.format(variant, start.strftime('%Y%m%d')),
+                             'variant': variant,
+                             'changes': variants[variant],
+                             'start_time': start.strftime('%m/%d/%Y %H:%M:%S'),
+                             'final_time': final.strftime('%m/%d/%Y %H:%M:%S')})
+
+    return episodes
+
+def get_episode_config(changes, data_path, episode_data_path):
+    '''Get the configuration of an episode with absolute paths.
+
+    Parameters
+    ----------
+    changes : dict
+        Configuration changes of the episode, see update_config.
+    data_path : str
+        Folder of the data files.
+    episode_data_path : str
+        Folder of the copies of the data files for the episode.
+
+    Returns
+    -------
+    config : dict
+        Configuration, where the paths to data files in data_path point
+        to episode_data_path and the other paths are absolute.
+
+    '''
+
+    config = update_config(copy.deepcopy(mpc_config.get_config()), changes)
+    # Model files are shared, the compiled models too if cached
+    config['model_config']['mopath'] = os.path.abspath(config['model_config']['mopath'])
+    if config['model_config'].get('cache_dir', None):
+        config['model_config']['cache_dir'] = os.path.abspath(config['model_config']['cache_dir'])
+    if config['opt_config'].get('backend', 'jmodelica') == 'linear':
+        linear_config = config['opt_config'].setdefault('linear', {})
+        linear_config['parameters_csv'] = os.path.abspath(linear_config.get('parameters_csv',
+                                                                            os.path.join('models', 'pars_thermal.csv')))
+    for section in config:
+        if section.endswith('_config') and isinstance(config[section], dict) and config[section].get('path', None):
+            path = os.path.abspath(config[section]['path'])
+            if os.path.dirname(path) == os.path.abspath(data_path):
+                path = os.path.join(episode_data_path, os.path.basename(path))
+            config[section]['path'] = path
+
+    return config
+
+def run_episode(args):
+    '''Run the simulation of one episode with its own folder.
+
+    Parameters
+    ----------
+    args : tuple
+        Episode, see get_episodes, output folder of the sweep, data
+        folder to copy the data files from, control step and horizon in
+        seconds.
+
+    Returns
+    -------
+    kpis : dict
+        Episode, see get_episodes, and KPIs, see simulate.run_simulation,
+        or the 'error' of the episode.
+
+    '''
+
+    episode, outdir, data_path, control_step, horizon = args
+    kpis = dict((key, episode[key]) for key in ['name', 'variant', 'start_time', 'final_time'])
+    episode_dir = os.path.abspath(os.path.join(outdir, episode['name']))
+    episode_data_path = os.path.join(episode_dir, 'data')
+    if not os.path.exists(episode_data_path):
+        os.makedirs(episode_data_path)
+    config = get_episode_config(episode['changes'], data_path, episode_data_path)
+    files = set(config['data_manager_config']['source'].get('csv_files', [])) | set(['Temperature.csv'])
+    for section in config:
+        if section.endswith('_config') and isinstance(config[section], dict) and config[section].get('path', None):
+            if os.path.dirname(config[section]['path']) == episode_data_path:
+                files.add(os.path.basename(config[section]['path']))
+    for filename in files - set(['emulation_states.csv', 'setpoints.csv']):
+        if os.path.exists(os.path.join(data_path, filename)):
+            shutil.copy(os.path.join(data_path, filename), episode_data_path)
+    try:
+        kpis.update(run_simulation(episode['start_time'], episode['final_time'], episode_dir, config=config,
+                                   data_path=episode_data_path, sim_control_step=control_step, mpc_horizon=horizon))
+        kpis['error'] = ''
+    except Exception as e:
+        print('Episode {0} ended in error, error={1}'.format(episode['name'], str(e)))
+        traceback.print_exc()
+        kpis['error'] = str(e)
+
+    return kpis
+
+def merge_kpis(kpis, outdir):
+    '''Merge the KPIs of the episodes by variant.
+
+    The costs are computed again from the net power of all episodes of
+    a variant, so that the demand charge applies to the peak of the
+    whole billing month rather than to the peak of each episode.
+
+    Parameters
+    ----------
+    kpis : DataFrame
+        KPIs of each episode, see run_episode.
+    outdir : str
+        Output folder of the sweep.
+
+    Returns
+    -------
+    summary : DataFrame
+        Number of 'episodes' and 'errors', costs (see
+        baseline_backtest.get_cost), 'net_energy' in kWh, number of
+        'optimizations', 'optimal_fraction' and mean and maximum
+        'solve_time' of each variant.
+
+    '''
+
+    rows = []
+    for variant, group in kpis.groupby('variant'):
+        ok = group[group['error'] == '']
+        row = {'variant': variant, 'episodes': len(group), 'errors': len(group) - len(ok)}
+        frames = [pd.read_csv(os.path.join(outdir, name, 'net_power.csv'), index_col=0, parse_dates=True)
+                  for name in ok['name']]
+        if frames:
+            net_power = pd.concat(frames).sort_index()
+            net_power = net_power[~net_power.index.duplicated(keep='last')]
+            row.update(get_cost(net_power['Pnet'], net_power))
+            row['net_energy'] = ok['net_energy'].sum()
+            row['optimizations'] = ok['optimizations'].sum()
+            row['optimal_fraction'] = (ok['optimal_fraction'] * ok['optimizations']).sum() / max(row['optimizations'], 1)
+            row['solve_time_mean'] = (ok['solve_time_mean'] * ok['optimizations']).sum() / max(row['optimizations'], 1)
+            row['solve_time_max'] = ok['solve_time_max'].max()
+        rows.append(row)
+    columns = ['variant', 'episodes', 'errors', 'energy_cost', 'demand_cost', 'total_cost', 'peak_power',
+               'net_energy', 'optimizations', 'optimal_fraction', 'solve_time_mean', 'solve_time_max']
+
+    return pd.DataFrame(rows, columns=columns).set_index('variant')
+
+def run_sweep(episodes, outdir, data_path='data', n_workers=None, sim_control_step=sim_control_step,
+              mpc_horizon=mpc_horizon):
+    '''Run episodes in parallel worker processes and merge their KPIs.
+
+    Parameters
+    ----------
+    episodes : list of dict
+        Episodes, see get_episodes.
+    outdir : str
+        Output folder, with one folder per episode.
+    data_path : str, optional
+        Folder of the data files.
+        Default is 'data'.
+    n_workers : int, optional
+        Number of worker processes.
+        Default is the number of CPUs.
+    sim_control_step : int, optional
+        Control step in seconds.
+        Default is 3600.
+    mpc_horizon : int, optional
+        Optimization horizon in seconds.
+        Default is 24*3600.
+
+    Returns
+    -------
+    kpis : DataFrame
+        KPIs of each episode, see run_episode, also saved to
+        episodes.csv in outdir.
+    summary : DataFrame
+        KPIs of each variant, see merge_kpis, also saved to summary.csv
+        in outdir.
+
+    '''
+
+    outdir = os.path.abspath(outdir)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    n_workers = min(n_workers or multiprocessing.cpu_count(), len(episodes))
+    args = [(episode, outdir, os.path.abspath(data_path), sim_control_step, mpc_horizon) for episode in episodes]
+    # A new process for every episode, so that no model or solver state is shared between episodes
+    pool = multiprocessing.Pool(processes=n_workers, maxtasksperchild=1)
+    try:
+        results = pool.map(run_episode, args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    kpis = pd.DataFrame(results).set_index('name')
+    kpis.to_csv(os.path.join(outdir, 'episodes.csv'))
+    summary = merge_kpis(kpis.reset_index(), outdir)
+    summary.to_csv(os.path.join(outdir, 'summary.csv'))
+
+    return kpis, summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run closed loop simulations of the mpc for many episodes in parallel.')
+    parser.add_argument('--start', required=True, help='start of the simulation in local time')
+    parser.add_argument('--end', required=True, help='end of the simulation in local time')
+    parser.add_argument('--episode_days', type=int, default=1, help='length of the episodes in days')
+    parser.add_argument('--variants', help='json file of configuration changes keyed by variant name')
+    parser.add_argument('--outdir', default=os.path.join('simulation', 'output', 'sweep'), help='output folder')
+    parser.add_argument('--data_path', default='data', help='folder of the data files')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    variants = None
+    if args.variants:
+        with open(args.variants, 'r') as f:
+            variants = json.load(f)
+    episodes = get_episodes(args.start, args.end, episode_days=args.episode_days, variants=variants)
+    print('Running {0} episodes...'.format(len(episodes)))
+    kpis, summary = run_sweep(episodes, args.outdir, data_path=args.data_path, n_workers=args.workers)
+    print(kpis.to_string())
+    print(summary.to_string())
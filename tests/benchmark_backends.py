@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+This script compares the solve time and objective of the JModelica and
+linear optimization backends on the functional test data.
+
+The energy cost of both plans is also evaluated with the same net power
+and price data, since the objectives of the two problems differ.
+
+"""
+from __future__ import division
+import copy
+import time
+import pandas as pd
+import pytz
+from controller.mpc import mpc
+import tests.mpc_config_testing as mpc_config_testing
+
+def get_energy_cost(controller, other_outputs):
+    '''Energy cost in $ of the net power of a plan in W.'''
+    pi_e = controller.price.data['pi_e'].get_base_data()
+    pnet = other_outputs['Pnet']
+    pi_e = pi_e.reindex(pi_e.index.union(pnet.index)).interpolate(method='time').reindex(pnet.index)
+    dt = pd.Series(pnet.index).diff().dt.total_seconds().shift(-1).fillna(0).values
+    return (pnet * pi_e * dt).sum()
+
+tz_local = pytz.timezone("America/Los_Angeles")
+tz_utc = pytz.timezone("UTC")
+start_time = pd.to_datetime('6/1/2018').tz_localize(tz_local).tz_convert(tz_utc)
+final_time = pd.to_datetime('6/2/2018').tz_localize(tz_local).tz_convert(tz_utc)
+
+results = []
+for backend in ['jmodelica', 'linear']:
+    config = copy.deepcopy(mpc_config_testing.get_config())
+    config['opt_config']['backend'] = backend
+    controller = mpc(config['model_config'],
+                     config['opt_config'],
+                     config['system_config'],
+                     weather_config = config['weather_config'],
+                     control_config = config['control_config'],
+                     setpoints_config = config['setpoints_config'],
+                     constraint_config = config['constraint_config'],
+                     price_config = config['price_config'],
+                     data_manager_config=config['data_manager_config'])
+    optimize_start = time.time()
+    control, measurements, other_outputs, statistics = controller.optimize(start_time, final_time, init=True)
+    results.append({'backend': backend,
+                    'status': statistics['status'],
+                    'solve_time': statistics['solve_time'],
+                    'optimize_time': time.time() - optimize_start,
+                    'objective': statistics['objective'],
+                    'energy_cost': get_energy_cost(controller, other_outputs)})
+
+print(pd.DataFrame(results).set_index('backend'))
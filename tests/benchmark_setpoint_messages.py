@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+This script compares the time to build the XBOS actuation messages of
+multi-day setpoint plans row by row, as set_setpoints_xbos did with
+iterrows, and with the columnar builder of controller/setpoint_messages.
+
+"""
+from __future__ import division
+import time
+import numpy as np
+import pandas as pd
+from pyxbos import xbos_pb2
+from pyxbos import flexstat_pb2
+from pyxbos import nullabletypes_pb2 as types
+from controller.setpoint_messages import build_messages
+
+device_config = {
+    "flexstat/thermostat_east/actuation": {"cooling_setpoint": "Trtu_east_cool", "heating_setpoint": "Trtu_east_heat"},
+    "flexstat/thermostat_west/actuation": {"cooling_setpoint": "Trtu_west_cool", "heating_setpoint": "Trtu_west_heat"},
+}
+
+def build_messages_by_row(df, device_config):
+    '''Build the messages with one protobuf object per row.'''
+    df = df.dropna()
+    msgs = dict()
+    for device in device_config:
+        var_cfg = device_config[device]
+        device_df = df[[var_cfg[variable] for variable in var_cfg]]
+        device_df.columns = list(var_cfg)
+        setpoint_list = []
+        for index, row in device_df.iterrows():
+            setpoint_list.append(flexstat_pb2.FlexstatSetpoints(change_time=int(index.value),
+                                                                heating_setpoint=types.Double(value=row['heating_setpoint']),
+                                                                cooling_setpoint=types.Double(value=row['cooling_setpoint'])))
+        msgs[device] = xbos_pb2.XBOS(flexstat_actuation_message=flexstat_pb2.FlexstatActuationMessage(
+            time=int(time.time() * 1e9), setpoints=setpoint_list))
+    return msgs
+
+def get_time(function, df, repeat=5):
+    '''Best time in seconds of repeat calls.'''
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function(df, device_config)
+        times.append(time.time() - start)
+    return min(times)
+
+results = []
+for days in [0.5, 1, 3, 7]:
+    index = pd.date_range('6/1/2018', periods=int(days*24*12)+1, freq='5T', tz='UTC')
+    df = pd.DataFrame(np.random.uniform(60, 80, (len(index), 4)), index=index,
+                      columns=['Trtu_east_cool', 'Trtu_east_heat', 'Trtu_west_cool', 'Trtu_west_heat'])
+    # Both builders must give the same setpoints
+    now = time.time()
+    by_row = build_messages_by_row(df, device_config)
+    columnar = build_messages(df, device_config, now=now)
+    for device in device_config:
+        assert list(by_row[device].flexstat_actuation_message.setpoints) == list(columnar[device].flexstat_actuation_message.setpoints)
+    row_time = get_time(build_messages_by_row, df)
+    columnar_time = get_time(build_messages, df)
+    results.append({'days': days,
+                    'rows': len(df),
+                    'by_row': row_time,
+                    'columnar': columnar_time,
+                    'speedup': row_time / columnar_time})
+
+print(pd.DataFrame(results, columns=['days', 'rows', 'by_row', 'columnar', 'speedup']).set_index('days'))
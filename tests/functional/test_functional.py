@@ -9,6 +9,7 @@ import matplotlib
 matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 from controller.mpc import mpc
+from controller.linear_store import Linear_Store, load_parameters
 import tests.mpc_config_testing as mpc_config_testing
 import pandas as pd
 import os
@@ -16,6 +17,7 @@ import numpy as np
 import shutil
 import pyfunnel as pf
 import pytz
+import copy
 
 config = mpc_config_testing.get_config()
 
@@ -170,5 +172,72 @@ class test_optimize(unittest.TestCase):
             plt.xticks(np.linspace(0, 24, num=13))
             plt.savefig('price.png')
 
+class test_optimize_linear(unittest.TestCase):
+    def setUp(self):
+        # load reference data
+        control = os.path.abspath(os.path.join(__file__,'..','fixtures','control_optimize.csv'))
+        measurements = os.path.abspath(os.path.join(__file__,'..','fixtures','measurements_optimize.csv'))
+        other_outputs = os.path.abspath(os.path.join(__file__,'..','fixtures','other_outputs_optimize.csv'))
+        self.control = pd.read_csv(control,index_col='Time')
+        self.measurements = pd.read_csv(measurements,index_col='Time')
+        self.other_outputs = pd.read_csv(other_outputs,index_col='Time')
+        self.tz_local = pytz.timezone("America/Los_Angeles")
+        self.tz_utc = pytz.timezone("UTC")
+
+    def test_optimize_linear(self):
+        start_time = pd.to_datetime('6/1/2018').tz_localize(self.tz_local).tz_convert(self.tz_utc)
+        final_time = pd.to_datetime('6/6/2018').tz_localize(self.tz_local).tz_convert(self.tz_utc)
+        # Instantiate with the linear backend
+        linear_config = copy.deepcopy(config)
+        linear_config['opt_config']['backend'] = 'linear'
+        self.controller = mpc(linear_config['model_config'],
+                              linear_config['opt_config'],
+                              linear_config['system_config'],
+                              weather_config = linear_config['weather_config'],
+                              control_config = linear_config['control_config'],
+                              setpoints_config = linear_config['setpoints_config'],
+                              constraint_config = linear_config['constraint_config'],
+                              price_config = linear_config['price_config'],
+                              data_manager_config=linear_config['data_manager_config'])
+        # Optimize
+        control, measurements, other_outputs, statistics = self.controller.optimize(start_time, final_time, init=True)
+
+        # The frames have the same shape as with the JModelica backend
+        self.assertEqual(statistics['plan'], 'optimal')
+        self.assertEqual(sorted(control.columns), sorted(self.control.columns))
+        self.assertEqual(sorted(measurements.columns), sorted(self.measurements.columns))
+        self.assertEqual(sorted(other_outputs.columns), sorted(self.other_outputs.columns))
+        self.assertEqual(control.index[0], start_time)
+        self.assertEqual(control.index[-1], final_time)
+
+class test_linear_store_energy_min(unittest.TestCase):
+    def setUp(self):
+        parameters = os.path.abspath(os.path.join(__file__,'..','..','..','models','pars_thermal.csv'))
+        self.parameters = load_parameters(parameters)
+        self.start_time = pd.to_datetime('6/1/2018 19:00').tz_localize('UTC')
+        self.final_time = self.start_time + pd.Timedelta(hours=12)
+        index = pd.date_range(self.start_time, self.final_time, freq='1H')
+        hours = np.arange(len(index))
+        sun = np.clip(np.sin((hours-2)/12*np.pi), 0, None)
+        self.weather = pd.DataFrame({'Tout': 290 + 5*np.sin(hours/24*2*np.pi),
+                                     'poa_pv': 800*sun,
+                                     'poa_win': 300*sun}, index=index)
+        bound = lambda value: pd.Series(value, index=index)
+        self.constraints = {'Trtu': {'GTE': bound(293.15), 'LTE': bound(297.15)},
+                            'Tref': {'GTE': bound(273.15), 'LTE': bound(277.15)},
+                            'Tfre': {'GTE': bound(240.15), 'LTE': bound(255.15)},
+                            'SOC': {'GTE': bound(0.2), 'LTE': bound(1.)}}
+        self.initial_state = {'Trtu': 295., 'Tref': 275., 'Tfre': 250., 'SOC': 0.5}
+
+    def test_constraints(self):
+        # Without price, the objective is in J and cooling always saves energy
+        linear_store = Linear_Store(self.parameters, objective='EnergyMin')
+        results, statistics = linear_store.optimize(self.start_time, self.final_time, self.initial_state,
+                                                    self.weather, constraints=self.constraints)
+        self.assertEqual(statistics['status'], 'Solve_Succeeded')
+        for variable in self.constraints:
+            self.assertGreaterEqual(results[variable].min(), self.constraints[variable]['GTE'].iloc[0] - 1e-3)
+            self.assertLessEqual(results[variable].max(), self.constraints[variable]['LTE'].iloc[0] + 1e-3)
+
 if __name__ == '__main__':
     unittest.main()
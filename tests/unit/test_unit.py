@@ -6,6 +6,14 @@ This module contains unit tests of the MPC controller.
 from __future__ import division
 import unittest
 from controller.mpc import mpc
+from controller.data_manager import Data_Manager
+from controller.scenarios import aggregate_solutions
+from controller.timing import Phase_Timer
+from controller.statistics_log import Statistics_Log, summarize_statistics
+from controller.run_archive import Run_Archive
+from controller.scheduler import Scheduler
+from controller.baseline_policy import Baseline_Policy
+from controller.baseline_backtest import Baseline_Backtest, get_cost
 import tests.mpc_config_testing as mpc_config_testing
 import pandas as pd
 import pyfunnel as pf
@@ -95,5 +103,233 @@ class unit(unittest.TestCase):
         state_estimation = self.controller.parameter.display_data()
         self.assertAlmostEqual(self.state_estimation['Value'].sum(),state_estimation['Value'].sum())
 
+class fallback(unittest.TestCase):
+
+    def setUp(self):
+        # Controller with a linear backend whose solve fails, without data sources
+        self.controller = mpc.__new__(mpc)
+        self.controller.opt_config = {'backend': 'linear'}
+        self.controller.timer = Phase_Timer()
+        self.controller.weather = self.controller.other_input = None
+        self.controller.constraint = self.controller.price = None
+        self.controller.linear_store = object()
+        self.controller.data_manager = self
+        self.controller._update_system = lambda *args, **kwargs: None
+        self.controller._estimate_state = lambda: None
+        self.controller._update_exo = lambda *args, **kwargs: None
+        self.controller._optimize_linear = self.optimize_linear
+        self.start_time = pd.to_datetime('6/1/2018 12:00').tz_localize('UTC')
+        self.final_time = self.start_time + pd.Timedelta(hours=6)
+
+    def prepare_cycle_data(self, requests):
+        return {}
+
+    def optimize_linear(self, start_time, final_time):
+        raise ValueError('Linear optimization failed with status "error".')
+
+    def set_last_plan(self, final_time):
+        index = pd.date_range(self.start_time - pd.Timedelta(hours=1), final_time, freq='1H')
+        plan = pd.DataFrame({'uBattery': 0.5}, index=index)
+        self.controller.last_plan = (plan, plan, plan)
+        self.controller.previous_control = plan
+
+    def test_error_with_plan(self):
+        self.set_last_plan(self.start_time + pd.Timedelta(hours=2))
+        previous_control = self.controller.previous_control
+        control, measurements, other_outputs, statistics = self.controller.optimize(self.start_time, self.final_time, init=False)
+        self.assertEqual(statistics['plan'], 'fallback')
+        self.assertEqual(control.index[0], self.start_time)
+        # The fallback is not used as initial guess of the next solve
+        self.assertIs(self.controller.previous_control, previous_control)
+
+    def test_error_with_expired_plan(self):
+        self.set_last_plan(self.start_time - pd.Timedelta(minutes=30))
+        with self.assertRaises(ValueError):
+            self.controller.optimize(self.start_time, self.final_time, init=False)
+
+class batch_forecast(unittest.TestCase):
+
+    def setUp(self):
+        # Data manager with a client that answers the forecast query of two uuids
+        self.data_manager = Data_Manager.__new__(Data_Manager)
+        self.data_manager.influx_client = self
+        self.issue_times = pd.to_datetime(['6/1/2018 12:00', '6/1/2018 12:15', '6/1/2018 13:00']).tz_localize('UTC')
+        self.queries = []
+
+    def query(self, q):
+        self.queries.append(q)
+        result = {}
+        for uuid in ['a', 'b']:
+            index = self.issue_times.repeat(2)
+            result[('timeseries', (('uuid', uuid),))] = pd.DataFrame({'prediction_time': np.arange(6), 'value': 1.}, index=index)
+        return result
+
+    def test_query(self):
+        latest_ts = {'a': self.issue_times[1].value, 'b': self.issue_times[2].value}
+        dfs = self.data_manager.query_batch_forecast_from_influx(latest_ts)
+        self.assertEqual(len(self.queries), 1)
+        self.assertNotIn('time=', self.queries[0])
+        self.assertIn('time >= {0} and time <= {1}'.format(self.issue_times[1].value, self.issue_times[2].value), self.queries[0])
+        self.assertEqual(list(dfs['a']['prediction_time']), [2, 3])
+        self.assertEqual(list(dfs['b']['prediction_time']), [4, 5])
+
+class aggregate(unittest.TestCase):
+
+    def setUp(self):
+        index = pd.date_range('6/1/2018 07:00', periods=4, freq='15T', tz='UTC')
+        self.solutions = dict()
+        for name, value, plan in [('low', 0.2, 'optimal'), ('mid', 0.4, 'optimal'),
+                                  ('high', 0.9, 'feasible_iterate'), ('failed', 5.0, 'infeasible')]:
+            df = pd.DataFrame({'uCool': value}, index=index)
+            self.solutions[name] = (df, df, df, {'plan': plan})
+
+    def test_aggregate_mean(self):
+        control, measurements, other_outputs, statistics = aggregate_solutions(self.solutions, method='mean')
+        self.assertAlmostEqual(control['uCool'].iloc[0], 0.5)
+        self.assertEqual(statistics['scenarios'], ['high', 'low', 'mid'])
+        self.assertEqual(statistics['plan'], 'feasible_iterate')
+
+    def test_aggregate_medoid(self):
+        control, measurements, other_outputs, statistics = aggregate_solutions(self.solutions, method='medoid')
+        self.assertAlmostEqual(control['uCool'].iloc[0], 0.4)
+
+class statistics_log(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = os.path.abspath(os.path.join(__file__,'..','results'))
+        self.log = Statistics_Log(os.path.join(self.results_dir, 'statistics.csv'))
+        start_time = pd.to_datetime('6/1/2018').tz_localize('UTC')
+        for i in range(48):
+            statistics = {'status': 'Solve_Succeeded', 'plan': 'optimal', 'iterations': 20,
+                          'objective': 1.0, 'solve_time': 2.0, 'warm_start': i > 0}
+            if i % 4 == 0:
+                statistics = {'status': 'Maximum_CpuTime_Exceeded, stopped', 'plan': 'fallback'}
+            self.log.append(start_time + pd.Timedelta(hours=i), statistics, horizon=12*3600,
+                            solver_options={'backend': 'jmodelica', 'n_e': 48})
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_read(self):
+        df = self.log.read(start_time='6/2/2018', usecols=['status', 'solve_time'])
+        self.assertEqual(len(df), 24)
+        self.assertEqual(list(df.columns), ['status', 'solve_time'])
+        self.assertEqual(df['status'].iloc[0], 'Maximum_CpuTime_Exceeded, stopped')
+
+    def test_summarize(self):
+        summary = summarize_statistics(self.log.read())
+        self.assertEqual(list(summary['runs']), [24, 24])
+        self.assertAlmostEqual(summary['optimal_fraction'].iloc[0], 0.75)
+
+class run_archive(unittest.TestCase):
+    file_format = None
+
+    def setUp(self):
+        self.results_dir = os.path.abspath(os.path.join(__file__,'..','results'))
+        self.archive = Run_Archive(os.path.join(self.results_dir, 'archive'), file_format=self.file_format)
+        self.run_starts = pd.date_range('6/1/2018 22:00', periods=48, freq='5T', tz='UTC')
+        for run_start in self.run_starts:
+            index = pd.date_range(run_start, periods=13, freq='5T')
+            control = pd.DataFrame({'uCool': 0.5, 'uBattery': -0.1}, index=index)
+            self.archive.append(run_start, {'control': control, 'setpoints': control[['uBattery']]})
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_read(self):
+        df = self.archive.read('control', start_time=self.run_starts[10], final_time=self.run_starts[29])
+        run_starts = df.index.get_level_values('run_start').unique()
+        self.assertEqual(len(run_starts), 20)
+        self.assertEqual(run_starts[0], self.run_starts[10])
+        self.assertEqual(len(df), 20*13)
+        self.assertAlmostEqual(df['uCool'].sum(), 20*13*0.5)
+        self.assertEqual(len(self.archive.get_runs(name='setpoints')), 48)
+
+    def test_partitions(self):
+        files = sorted(os.listdir(os.path.join(self.archive.archive_dir, 'control')))
+        if self.archive.file_format == 'parquet':
+            self.assertEqual(files, ['2018-06-01.parquet', '2018-06-02.csv'])
+            self.archive.compact()
+            files = sorted(os.listdir(os.path.join(self.archive.archive_dir, 'control')))
+            self.assertEqual(files, ['2018-06-01.parquet', '2018-06-02.parquet'])
+        else:
+            self.assertEqual(files, ['2018-06-01.csv', '2018-06-02.csv'])
+        self.assertEqual(len(self.archive.read('control', usecols=['uCool'])), 48*13)
+
+class run_archive_csv(run_archive):
+    file_format = 'csv'
+
+class scheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.
+        self.durations = [10., 400., 20., 5.]
+        self.ticks = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def job(self):
+        self.ticks.append(self.now)
+        self.now += self.durations[len(self.ticks)-1]
+        if len(self.ticks) == 3:
+            raise ValueError('failed')
+
+    def test_run(self):
+        scheduler = Scheduler(self.job, name='mpc', period=300, clock=self.clock, sleep=self.sleep)
+        scheduler.run(max_runs=4)
+        # The run of 400 s overlaps the tick at 1800 s, which is skipped
+        self.assertEqual(self.ticks, [1200., 1500., 2100., 2400.])
+        metrics = scheduler.get_metrics()
+        self.assertEqual(metrics.loc['mpc', 'runs'], 4)
+        self.assertEqual(metrics.loc['mpc', 'errors'], 1)
+        self.assertEqual(metrics.loc['mpc', 'skipped'], 1)
+        self.assertEqual(metrics.loc['mpc', 'late'], 0)
+        self.assertAlmostEqual(metrics.loc['mpc', 'duration_max'], 400.)
+
+class baseline_policy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Baseline_Policy()
+        self.index = pd.date_range('6/1/2018 07:00', periods=12*24*7, freq='5T', tz='UTC')
+        hours = self.policy.get_hours(self.index)
+        self.pv = np.clip(20000*np.sin((hours-6)/12*np.pi), 0, None)
+        self.load = 8000 + 2000*np.cos(hours/24*2*np.pi)
+
+    def test_get_setpoints(self):
+        # Local hours 12h, 12h, 12h, 3h
+        setpoints = self.policy.get_setpoints([-30000, -5000, 5000, 5000], [0.5, 0.99, 0.5, 0.65], [12, 12, 12, 3])
+        np.testing.assert_allclose(setpoints, [21000, 0, -5000, 0.3*40500/3])
+
+    def test_simulate(self):
+        plan = self.policy.simulate(self.index, self.pv, self.load, 0.5)
+        self.assertEqual(len(plan), len(self.index))
+        self.assertTrue(plan['battery_soc'].between(0, 1).all())
+        # The plan follows the policy at each step
+        setpoints = self.policy.get_setpoints(plan['net_load'].values, plan['battery_soc'].values,
+                                              self.policy.get_hours(self.index))
+        np.testing.assert_allclose(plan['battery_setpoint'].values, setpoints)
+
+class baseline_backtest(unittest.TestCase):
+
+    def test_get_cost(self):
+        index = pd.date_range('6/1/2018', periods=4, freq='H', tz='UTC')
+        net_power = pd.Series([1000., 4000., 2000., -1000.], index=index)
+        price = pd.DataFrame({'pi_e': [0.1, 0.3, 0.3, 0.1], 'pi_d': [5., 20., 20., 5.]}, index=index)
+        cost = get_cost(net_power, price)
+        self.assertAlmostEqual(cost['energy_cost'], 0.1 + 1.2 + 0.6 - 0.1)
+        self.assertAlmostEqual(cost['demand_cost'], 5*1 + 20*4)
+        self.assertAlmostEqual(cost['peak_power'], 4)
+
+    def test_naive_index(self):
+        index = pd.date_range('6/1/2018', periods=4, freq='H')
+        data = pd.DataFrame({'pv_generation': 0., 'building_load': 1000., 'battery_soc': 0.5}, index=index)
+        price = pd.DataFrame({'pi_e': 0.1}, index=index.tz_localize('UTC'))
+        with self.assertRaises(ValueError):
+            Baseline_Backtest(data, price, {})
+
 if __name__ == '__main__':
     unittest.main()